@@ -18,6 +18,8 @@ PREREQUISITES:
    mkspiffs paths).
 4. Required Python libraries: 'colorama' and 'pyserial' (serial.tools.list_ports).
    Install them with: pip install colorama pyserial
+   Optional: 'esptool' (pip install esptool) for in-process flashing (//DIFF=TRUE, //VERIFY=TRUE).
+   Optional: 'littlefs-python' (pip install littlefs-python) for //FS=LITTLEFS.
 
 USAGE:
 1. Place this script in the root directory of your Arduino project (where the
@@ -28,14 +30,36 @@ USAGE:
    special comments (directives).
 4. Run the script from the project directory: python fasada_with_instructions.py
 
+COMMAND LINE OPTIONS:
+  --farm            Build and merge once, then flash every detected ESP port
+                    concurrently and print a per-port status/timing table.
+  --ports P1,P2     Explicit port list for --farm (default: all detected ESP ports).
+  --workers N       Number of parallel flash workers for --farm (default: one per port).
+  --watch           Stay resident and watch the sketch sources and data/: a source
+                    edit recompiles and flashes the app only, a data/ edit rebuilds
+                    and flashes SPIFFS only, a directive edit runs the full pipeline.
+  --matrix          Build every //MATRIX= variant concurrently (no flashing); output
+                    in bin_out/matrix/<variant>/ plus a per-variant timing table.
+  --batch DIR       Build every sketch folder under DIR (compile + merge + //CUST
+                    image, no flashing) into each sketch's bin_out/. Directives are
+                    cached per .ino (DIRECTIVE_CACHE); at most BATCH_COMPILES
+                    compiles and BATCH_DISK_JOBS image writers run at once. Prints
+                    a per-sketch table and the throughput in sketches per minute.
+  --report          Print p50/p95 duration and throughput per stage and board type
+                    from the run history (BUILD_BASE/_trace_history.jsonl) and exit.
+                    Every run also writes a Chrome trace (chrome://tracing) to
+                    BUILD_BASE/_traces.
+
 CONFIGURATION DIRECTIVES (in your .ino file):
 You must include these directives as comments in the following format:
 //DIRECTIVE=VALUE
 
 * //PART=VALUE
     Sets the Partition Scheme.
-    - AUTO (Default): Automatically selects a scheme based on the size of the 'data'
-      directory (prefers 'min_spiffs' if data fits, otherwise 'huge_app', or 'default').
+    - AUTO (Default): Automatically selects the tightest scheme of the board (all
+      partition CSVs of the core) whose SPIFFS fits the 'data' directory, whose app
+      partition fits the last compiled app and which fits the //FLASH= size;
+      'default' if nothing fits.
     - MS: Alias for 'min_spiffs'.
     - HA: Alias for 'huge_app'.
     - DEFAULT: Alias for 'default'.
@@ -52,20 +76,84 @@ You must include these directives as comments in the following format:
 
 * //ERASE=TRUE
     If set to TRUE, the script performs a full flash erase before compilation/flashing.
+    The erase runs in parallel with compilation; when nothing is compiled (build
+    cache hit, --farm) it is done as --erase-all inside the flash session.
 
 * //CUST=TRUE
-    If set to TRUE, the script uses the 'mkspiffs' tool to manually create and
-    flash a SPIFFS image from the 'data/' directory. If not set, SPIFFS is skipped.
+    If set to TRUE, the script creates and flashes a SPIFFS image from the 'data/'
+    directory. If not set, SPIFFS is skipped. The image is built in-process
+    (SPIFFS_BUILDER = "python", same block/page layout as 'mkspiffs -b 4096 -p 256');
+    set SPIFFS_BUILDER = "mkspiffs" to use the external tool instead.
+
+* //FS=SPIFFS|LITTLEFS
+    Filesystem of the //CUST=TRUE image (default: SPIFFS). LITTLEFS images are built
+    in-process with 'littlefs-python' (pip install littlefs-python) and updated in
+    place on the next build – only changed files are written; without the package
+    MK_LITTLEFS (mklittlefs of the core) is used. The partition lookup takes data
+    partitions of subtype spiffs or littlefs alike.
+    On erased flash (//ERASE=TRUE of a full run, else an erase-region of the partition when at
+    least SPARSE_MIN_SKIP bytes are blank) only the populated pages of every 4 KB
+    sector are written – of an empty SPIFFS block just the lookup page with its magic.
+
+* //ASSETS=MIN|GZIP|ALL
+    Pre-processes data/ before it goes to SPIFFS: MIN minifies HTML/CSS/JS/JSON/SVG,
+    GZIP replaces web assets by "name.gz" (served by ESPAsyncWebServer's
+    serveStatic() for a request of "name"), ALL does both. The reduced size drives
+    PART=AUTO and the SPIFFS fit check. Results are cached by content hash in
+    ASSET_CACHE_DIR; files matching ASSET_SKIP (yoRadio's /data) stay untouched.
 
 * //COM=NUMBER
-    Specifies the COM port number (e.g., //COM=5 for COM5). If omitted, the script
-    will attempt to auto-detect the port.
+    Specifies the COM port number (e.g., //COM=5 for COM5). If omitted, every USB
+    serial port is asked for its chip type and MAC (in parallel with compilation)
+    and the port whose chip matches PLATFORM is used. The answers are cached in
+    BUILD_BASE/_port_cache.json, so later runs resolve the port instantly.
+
+* //OTA=HOST[:PORT],...
+    Uploads over Wi-Fi to boards running ArduinoOTA instead of flashing over serial
+    (repeat the line or separate hosts with commas; port default OTA_PORT = 3232,
+    password OTA_PASSWORD). The app and the //CUST image are sent to all hosts
+    concurrently; no port detection, no erase, no merge. ota_receiver.py is a
+    stand-in board for trying it without hardware.
 
 * //PLATFORM=VALUE
     Defines the target chip architecture.
     Accepted values: ESP32 (Default), ESP32S3, ESP32C3.
     (You can also use single-line directives like //ESP32S3 or //ESP32C3)
 
+* //DIFF=TRUE
+    Differential flashing: the chip is asked for MD5 checksums of the firmware and
+    SPIFFS regions and only the 4 KB sectors that differ are written. Requires the
+    'esptool' Python package (pip install esptool); without it a full flash is done.
+    Ignored together with //ERASE=TRUE (after an erase every sector differs).
+
+* //VERIFY=TRUE
+    After flashing, the chip computes the MD5 of every written region (firmware
+    and the whole filesystem partition) and the digests are compared with the
+    ones taken when the images were prepared – nothing is read back. With the
+    'esptool' package the ROM loader hashes (no stub upload); otherwise 'esptool
+    verify-flash' is used. A mismatch fails the flash (--farm marks the board
+    FAILED); it is not retried and not recorded against the baud rate.
+
+* //BAUD=AUTO or //BAUD=NUMBER
+    Upload baud rate (default: BAUD, 921600). Every flash records its result and
+    measured bytes/s per USB adapter (VID:PID) in BAUD_PROFILE. AUTO starts at the
+    fastest reliable rate known for the adapter, probes one step higher after a
+    few clean flashes and retries a flash that failed on the serial link (packet
+    timeouts, corrupt data) at lower rates. A board that does not connect, a
+    busy port or a chip mismatch is not counted against the rate.
+
+* //MATRIX=ITEM,ITEM,...
+    One build variant for --matrix (repeat the line for more variants). Every item
+    is applied like a directive on top of the sketch's own ones, e.g.
+    //MATRIX=ESP32,PART=DEFAULT  or  //MATRIX=ESP32S3,PART=HA,FLASH=16MB,PSRAM=OPI.
+    Variants compile in parallel in BUILD_BASE/<sketch>/matrix/<variant> and share
+    compiled cores (CORE_CACHE_DIR, arduino-cli --build-cache-path).
+
+* //CACHE=FALSE
+    Disables the build cache for this sketch. By default the compiled binaries are
+    stored under BUILD_BASE, keyed by a hash of the sketch sources, libraries,
+    PART/PSRAM/PLATFORM and FQBN; an unchanged sketch skips 'arduino-cli compile'.
+
 Example .ino Directives:
 //PART=HA
 //FLASH=16MB
@@ -74,42 +162,405 @@ Example .ino Directives:
 """
 import os
 import sys
+import gzip
+import json
+import atexit
+import queue
+import math
+import re
+import mmap
+import argparse
 import shutil
+import fnmatch
+import glob
+import struct
+import hashlib
+import socket
 import subprocess
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from typing import Callable
 from datetime import datetime
 
 from colorama import init, Fore, Back, Style
 import serial.tools.list_ports
 
+try:
+    # optional – in-process esptool (differential flashing)
+    from esptool.cmds import detect_chip, run_stub, attach_flash, write_flash, reset_chip
+    from esptool.util import FatalError, flash_size_bytes
+    HAVE_ESPTOOL = True
+except ImportError:
+    HAVE_ESPTOOL = False
+
+try:
+    # optional – in-process, incremental LittleFS images (//FS=LITTLEFS)
+    import littlefs
+    HAVE_LITTLEFS = True
+except ImportError:
+    HAVE_LITTLEFS = False
+
 init(autoreset=True)
 
 # PATHS – adjust if something has changed
 ARDUINO_CLI = r"C:\Program Files\Arduino CLI\arduino-cli.exe"
 ESPTOOL     = r"C:\Users\Grzeg\AppData\Local\Arduino15\packages\esp32\tools\esptool_py\5.1.0\esptool.exe"
 MK_SPIFFS   = r"C:\Users\Grzeg\AppData\Local\Arduino15\packages\esp32\tools\mkspiffs\0.2.3\mkspiffs.exe"
+MK_LITTLEFS = r"C:\Users\Grzeg\AppData\Local\Arduino15\packages\esp32\tools\mklittlefs\4.0.2-db0513a\mklittlefs.exe"
 BOOT_APP0   = r"C:\Users\Grzeg\AppData\Local\Arduino15\packages\esp32\hardware\esp32\3.3.3\tools\partitions\boot_app0.bin"
+LIBRARIES   = r"C:\Users\Grzeg\Documents\Arduino\libraries"
 
 BUILD_BASE  = r"D:\arduino-builds"
 BAUD        = 921600
 LOGFILE     = "bf_mkspiffs.log"
 
+# run() limits per kind of tool call: (total s, s without any output); None = no limit
+RUN_TIMEOUTS = {
+    "compile":  (1800, None),   # arduino-cli is silent while compiling (no -v)
+    "flash":    (600, 20),      # esptool prints progress continuously – silence = hung serial link
+    "flash_erase": (600, 90),   # write-flash --erase-all: silent during the chip erase first
+    "erase":    (180, 90),      # erase-flash is silent while the chip erases (10-40 s)
+    "verify":   (120, 60),      # verify-flash is silent while the chip hashes
+    "merge":    (120, None),
+    "mkspiffs": (300, None),
+    "mklittlefs": (300, None),
+}
+
+# LOGFILE is written by a background thread; rotated to LOGFILE.1 … .N at this size.
+# Several processes (--matrix, --farm, parallel runs) may append to it: every batch
+# opens it by path, rotation happens under LOGFILE.lock
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS   = 3
+
+# per-run Chrome traces (newest TRACE_KEEP kept) + one history line per run for --report
+# (newest TRACE_HISTORY_KEEP kept)
+TRACE_DIR     = os.path.join(BUILD_BASE, "_traces")
+TRACE_HISTORY = os.path.join(BUILD_BASE, "_trace_history.jsonl")
+TRACE_KEEP    = 50
+TRACE_HISTORY_KEEP = 1000
+
+# USB VID:PID:serial -> chip type/MAC of the board behind it (port discovery)
+PORT_CACHE = os.path.join(BUILD_BASE, "_port_cache.json")
+
+# per USB adapter (VID:PID) baud rate results for //BAUD=AUTO
+BAUD_PROFILE = os.path.join(BUILD_BASE, "_baud_profile.json")
+
+# Build cache – compiled binaries keyed by sources + configuration (LRU, size-bounded)
+BUILD_CACHE_DIR    = os.path.join(BUILD_BASE, "_build_cache")
+BUILD_CACHE_MAX_MB = 1024
+
+# arduino-cli --build-cache-path – compiled cores shared by all sketches and --matrix variants
+CORE_CACHE_DIR = os.path.join(BUILD_BASE, "_core_cache")
+
+# merge-bin – "python" (in-process, trimmed, skipped when inputs are unchanged) or "esptool"
+MERGE_BUILDER = "python"
+
+# data/ mirror in BUILD_BASE – compare content hashes when size/mtime changed
+DATA_SYNC_HASH = False
+
+# SPIFFS image builder – "python" (in-process, per-file page cache) or "mkspiffs"
+SPIFFS_BUILDER   = "python"
+SPIFFS_CACHE_DIR = "spiffs_cache"    # page cache + obj_id index, in the build path of every sketch / variant
+
+# LittleFS image builder – "python" (littlefs-python, incremental) or "mklittlefs"
+LITTLEFS_BUILDER = "python"
+
+# //ASSETS= pre-processing of data/: content-addressed cache of minified/gzipped files
+ASSET_CACHE_DIR    = os.path.join(BUILD_BASE, "_asset_cache")
+ASSET_CACHE_MAX_MB = 64
+
+# --batch: parsed //directives per .ino, concurrent arduino-cli runs, concurrent image writers
+DIRECTIVE_CACHE = os.path.join(BUILD_BASE, "_directive_cache.json")
+BATCH_COMPILES  = 2
+BATCH_DISK_JOBS = 2
+
 
 # ---------------- LOG + MEASUREMENT ----------------
 
-def log(msg: str):
-    with open(LOGFILE, "a", encoding="utf-8") as f:
-        f.write(f"[{datetime.now()}] {msg}\n")
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_log_thread: threading.Thread | None = None
+_log_start_lock = threading.Lock()
+
 
+def log_value(v) -> str:
+    if isinstance(v, float):
+        return f"{v:.3f}"
+    v = str(v)
+    return json.dumps(v) if not v or " " in v or '"' in v else v
 
-def run(cmd: str):
-    print(Fore.CYAN + "\n[CMD] " + cmd + "\n")
-    log(cmd)
-    r = subprocess.run(cmd, shell=True)
-    if r.returncode != 0:
+
+def log(msg: str, **fields):
+    """
+    Queues one log line and returns immediately – a background thread writes
+    the lines in batches. fields are appended as key=value; the stage running
+    in the calling thread is added as stage=... automatically.
+    """
+    stage = current_stage()
+    if stage and "stage" not in fields:
+        fields = {"stage": stage, **fields}
+    line = f"[{datetime.now()}] {msg}"
+    if fields:
+        line += " |" + "".join(f" {k}={log_value(v)}" for k, v in fields.items())
+    _log_queue.put(line + "\n")
+    if _log_thread is None:
+        start_log_writer()
+
+
+def start_log_writer() -> None:
+    global _log_thread
+    with _log_start_lock:
+        if _log_thread is None:
+            _log_thread = threading.Thread(target=log_writer, name="log-writer", daemon=True)
+            _log_thread.start()
+            atexit.register(close_log)
+
+
+def rotate_log(path: str) -> None:
+    """
+    LOGFILE → LOGFILE.1 → … → LOGFILE.<LOG_BACKUPS> (the oldest is dropped).
+    Only the process holding LOGFILE.lock rotates, and only if the file is
+    still over the limit – a second writer must not rotate the fresh file.
+    """
+    lock = path + ".lock"
+    try:
+        fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        # somebody is rotating; a lock left by a killed process is dropped after a minute
+        try:
+            if time.time() - os.path.getmtime(lock) > 60:
+                os.remove(lock)
+        except OSError:
+            pass
+        return
+    except OSError:
+        return
+    try:
+        if os.path.getsize(path) < LOG_MAX_BYTES:
+            return
+        for i in range(LOG_BACKUPS - 1, 0, -1):
+            if os.path.exists(f"{path}.{i}"):
+                os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+        os.replace(path, f"{path}.1")
+    except OSError:
+        # Windows: another process is writing right now – the next batch retries
+        pass
+    finally:
+        os.close(fd)
+        os.remove(lock)
+
+
+def log_writer() -> None:
+    """
+    Writes everything queued so far with one write() – whole lines only. The
+    file is opened by path for every batch, so no process keeps appending to
+    a file another one has rotated away (and Windows can rename it).
+    """
+    while True:
+        batch = [_log_queue.get()]
+        while True:
+            try:
+                batch.append(_log_queue.get_nowait())
+            except queue.Empty:
+                break
+        lines = [line for line in batch if line is not None]
+        if lines:
+            path = LOGFILE
+            try:
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write("".join(lines))
+                    full = f.tell() >= LOG_MAX_BYTES
+                if full:
+                    rotate_log(path)
+            except OSError:
+                # logging must never break a build
+                pass
+        if None in batch:
+            return
+
+
+def close_log() -> None:
+    """Flushes the queue at exit."""
+    if _log_thread is not None and _log_thread.is_alive():
+        _log_queue.put(None)
+        _log_thread.join(timeout=5)
+
+
+# progress lines of esptool (4.x "Writing at 0x00010000... (12 %)",
+# 5.x "Writing at 0x00010000 [==>   ]  12.3% 4096/32768 bytes...") and arduino-cli
+RE_WRITING    = re.compile(r"Writing at (0x[0-9a-fA-F]+)\D*?(\d+(?:\.\d+)?) ?%")
+RE_COMPRESSED = re.compile(r"Compressed (\d+) bytes to (\d+)")
+RE_WROTE      = re.compile(r"Wrote (\d+) bytes(?: \((\d+) compressed\))? at (0x[0-9a-fA-F]+) in ([\d.]+) seconds")
+RE_PHASE      = re.compile(r"^(Compiling sketch|Compiling libraries|Compiling library \"[^\"]+\"|"
+                           r"Compiling core|Linking everything together)")
+RE_SKETCH_USES = re.compile(r"Sketch uses (\d+) bytes")
+# esptool errors of the serial link itself (worth a retry at a lower baud rate) – unlike
+# "Failed to connect", a busy/missing port or a chip mismatch, which no baud rate fixes
+RE_TRANSPORT  = re.compile(r"Timed out waiting for packet|Invalid head of packet|Packet content transfer stopped|"
+                           r"Serial data stream stopped|serial noise or corruption|chip stopped responding|"
+                           r"MD5 of file does not match|Corrupt data|Write timeout", re.I)
+
+
+def parse_progress(line: str) -> dict | None:
+    """One tool output line → progress event (or None)."""
+    m = RE_WRITING.search(line)
+    if m:
+        return {"kind": "writing", "addr": int(m.group(1), 16), "pct": float(m.group(2))}
+    m = RE_WROTE.search(line)
+    if m:
+        size, secs = int(m.group(1)), float(m.group(4))
+        return {"kind": "wrote", "addr": int(m.group(3), 16), "bytes": size,
+                "sent": int(m.group(2) or size), "secs": secs, "bps": size / secs if secs else 0.0}
+    m = RE_COMPRESSED.search(line)
+    if m:
+        return {"kind": "compressed", "bytes": int(m.group(1)), "sent": int(m.group(2))}
+    m = RE_PHASE.search(line)
+    if m:
+        return {"kind": "phase", "phase": m.group(1)}
+    m = RE_SKETCH_USES.search(line)
+    if m:
+        return {"kind": "size", "bytes": int(m.group(1))}
+    if RE_TRANSPORT.search(line) and "Failed to connect" not in line:
+        return {"kind": "transport", "line": line.strip()}
+    return None
+
+
+def cmd_text(cmd: list[str]) -> str:
+    """argv as one line for the console/log (quoted where needed)."""
+    return " ".join(f'"{a}"' if not a or " " in a or "\\" in a else a for a in cmd)
+
+
+def run(cmd: list[str], exit_on_error: bool = True, output: str | None = None,
+        kind: str | None = None, label: str = "", status: dict | None = None) -> int:
+    """
+    Runs a tool (argv list, no shell) and streams its output line by line –
+    to the console, or to the file given as output=. esptool / arduino-cli
+    progress is parsed into events (written bytes, bytes/s, compile phases)
+    that end up in the trace span and the log; with output= a short live
+    progress line is printed instead. RUN_TIMEOUTS[kind] kills a tool that
+    runs too long or goes silent. With exit_on_error=False the return code is
+    handed back instead of terminating the script; status["transport"] then
+    tells whether the tool reported a serial link error (or hung).
+    """
+    text = cmd_text(cmd)
+    print(Fore.CYAN + "\n[CMD] " + text + "\n")
+    log(text)
+    tool = os.path.basename(cmd[0])
+    limit, idle = RUN_TIMEOUTS.get(kind, (None, None))
+    tag = f" [{label}]" if label else ""
+    start = time.time()
+
+    with span(tool, "cmd", cmd=text):
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        except OSError as e:
+            print(Fore.RED + f"❌ Cannot start {tool}: {e}")
+            log("ERROR", tool=tool, error=str(e))
+            if exit_on_error:
+                sys.exit(1)
+            return 127
+        chunks: queue.SimpleQueue = queue.SimpleQueue()
+
+        def reader():
+            # os.read returns whatever is there – \r progress updates arrive live
+            while True:
+                chunk = os.read(proc.stdout.fileno(), 4096)
+                chunks.put(chunk)
+                if not chunk:
+                    return
+
+        threading.Thread(target=reader, name=f"{tool}-reader", daemon=True).start()
+        sink = open(output, "a", encoding="utf-8") if output else None
+        pending = ""
+        last_out = start
+        killed = None
+        region = None   # [start address, last %, last 25 % step shown]
+        written = 0
+        write_secs = 0.0
+        phases = []
+        try:
+            while True:
+                try:
+                    chunk = chunks.get(timeout=0.25)
+                except queue.Empty:
+                    chunk = b""
+                    now = time.time()
+                    if limit and now - start > limit:
+                        killed = f"running for more than {limit}s"
+                    elif idle and now - last_out > idle:
+                        killed = f"no output for {idle}s"
+                    if killed:
+                        proc.kill()
+                        break
+                    continue
+                if not chunk:
+                    break
+                last_out = time.time()
+                data = chunk.decode("utf-8", errors="replace")
+                if sink:
+                    sink.write(data)
+                else:
+                    sys.stdout.write(data)
+                    sys.stdout.flush()
+
+                pending += data
+                lines = re.split(r"[\r\n]", pending)
+                pending = lines.pop()
+                for line in lines:
+                    ev = parse_progress(line)
+                    if not ev:
+                        continue
+                    if ev["kind"] == "writing" and sink:
+                        # every 25 % per region, the raw output goes to the file;
+                        # esptool 5 prints the current address, so a region starts where % drops
+                        if region is None or ev["pct"] < region[1]:
+                            region = [ev["addr"], ev["pct"], -1]
+                        region[1] = ev["pct"]
+                        step = int(ev["pct"] // 25)
+                        if region[2] < step:
+                            region[2] = step
+                            print(Fore.CYAN + f"📶{tag} write 0x{region[0]:06X}: {ev['pct']:.0f}%")
+                    elif ev["kind"] == "wrote":
+                        region = None
+                        written += ev["bytes"]
+                        write_secs += ev["secs"]
+                        log(f"WROTE 0x{ev['addr']:06X}", tool=tool, bytes=ev["bytes"], sent=ev["sent"],
+                            duration=ev["secs"], bps=round(ev["bps"]))
+                    elif ev["kind"] == "phase":
+                        phases.append(ev["phase"])
+                        if sink:
+                            print(Fore.CYAN + f"🔨{tag} {ev['phase']}")
+                    elif ev["kind"] == "size":
+                        span_args(app_bytes=ev["bytes"])
+                    elif ev["kind"] == "transport" and status is not None:
+                        status["transport"] = True
+        finally:
+            if sink:
+                sink.close()
+        rc = proc.wait()
+        if killed:
+            rc = rc or -9
+            if status is not None:
+                status["transport"] = True
+
+        if written:
+            span_args(written=written, write_bps=round(written / write_secs) if write_secs else 0)
+        if phases:
+            span_args(phases=phases)
+        span_args(rc=rc)
+
+    log("EXIT", tool=tool, rc=rc, duration=time.time() - start)
+    if killed:
+        print(Fore.RED + f"❌ {tool}{tag} killed – {killed}.")
+        log("KILLED", tool=tool, reason=killed)
+    elif rc != 0:
         print(Fore.RED + "❌ Command finished with an error.")
-        log("ERROR")
+        log("ERROR", tool=tool, rc=rc)
+    if rc != 0 and exit_on_error:
         sys.exit(1)
+    return rc
 
 
 def print_step_time(label: str, step_start: float, global_start: float):
@@ -117,15 +568,170 @@ def print_step_time(label: str, step_start: float, global_start: float):
     total_duration = time.time() - global_start
     txt = f"⏱ {label}: step {step_duration:.2f}s | since start {total_duration:.2f}s"
     print(Back.WHITE + Fore.BLACK + Style.BRIGHT + txt + Style.RESET_ALL)
-    log(txt)
+    log(txt, step=label, duration=step_duration, total=total_duration)
+
+
+# ---------------- TRACE ----------------
+# Structured spans of one run (stages, tool calls, flash sessions) with byte
+# counts. Exported as a Chrome trace (chrome://tracing, ui.perfetto.dev) and
+# summarised into TRACE_HISTORY, which --report turns into p50/p95 tables.
+
+_trace_spans: list[dict] = []
+_trace_lock = threading.Lock()
+_trace_local = threading.local()
+
+
+@contextmanager
+def span(name: str, cat: str, **args):
+    """Records the enclosed block as one span; span_args() adds fields to it."""
+    sp = {"name": name, "cat": cat, "start": time.time(), "args": args,
+          "tid": threading.get_ident(), "thread": threading.current_thread().name}
+    stack = _trace_local.__dict__.setdefault("stack", [])
+    stack.append(sp)
+    try:
+        yield sp
+    finally:
+        stack.pop()
+        sp["end"] = time.time()
+        with _trace_lock:
+            _trace_spans.append(sp)
+
+
+def current_stage() -> str | None:
+    """Name of the pipeline stage running in this thread, if any."""
+    for sp in reversed(getattr(_trace_local, "stack", ())):
+        if sp["cat"] == "stage":
+            return sp["name"]
+    return None
+
+
+def span_args(**args) -> None:
+    """Adds fields (bytes, port, ...) to the innermost open span of this thread."""
+    stack = getattr(_trace_local, "stack", None)
+    if stack:
+        stack[-1]["args"].update(args)
+
+
+def trace_export(base: str, board: str, ok: bool, global_start: float) -> None:
+    """Writes the Chrome trace of this run and appends its summary to TRACE_HISTORY."""
+    with _trace_lock:
+        spans = sorted(_trace_spans, key=lambda sp: sp["start"])
+
+    events = []
+    tids = {}
+    summary = []
+    for sp in spans:
+        dur = sp["end"] - sp["start"]
+        args = dict(sp["args"])
+        if args.get("bytes") and dur > 0:
+            args["bps"] = round(args["bytes"] / dur)
+        if sp["tid"] not in tids:
+            tids[sp["tid"]] = len(tids) + 1
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tids[sp["tid"]],
+                           "args": {"name": sp["thread"]}})
+        events.append({"name": sp["name"], "cat": sp["cat"], "ph": "X", "pid": 1, "tid": tids[sp["tid"]],
+                       "ts": round((sp["start"] - global_start) * 1e6), "dur": round(dur * 1e6),
+                       "args": args})
+        summary.append({"name": sp["name"], "cat": sp["cat"], "dur": round(dur, 3),
+                        "bytes": args.get("bytes")})
+
+    stamp = datetime.fromtimestamp(global_start).strftime("%Y%m%d-%H%M%S-%f")[:-3]
+    total = round(time.time() - global_start, 3)
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    path = os.path.join(TRACE_DIR, f"{base}_{stamp}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms",
+                   "otherData": {"sketch": base, "board": board, "ok": ok, "total": total}}, f)
+
+    traces = sorted((e for e in os.scandir(TRACE_DIR) if e.name.endswith(".json")),
+                    key=lambda e: e.stat().st_mtime)
+    for e in traces[:-TRACE_KEEP]:
+        os.remove(e.path)
+
+    trace_history_append(json.dumps({"time": stamp, "sketch": base, "board": board, "ok": ok,
+                                     "total": total, "spans": summary}))
+    print(Fore.CYAN + f"🧾 Trace: {path}")
+
+
+def trace_history_append(line: str) -> None:
+    """
+    Appends one run to TRACE_HISTORY. Once it holds 10 % more than
+    TRACE_HISTORY_KEEP runs, it is cut back to the newest TRACE_HISTORY_KEEP
+    (not on every run – the rewrite is the expensive part).
+    """
+    with open(TRACE_HISTORY, "a+", encoding="utf-8") as f:
+        f.write(line + "\n")
+        f.seek(0)
+        lines = f.readlines()
+    if len(lines) <= TRACE_HISTORY_KEEP + TRACE_HISTORY_KEEP // 10:
+        return
+    tmp = TRACE_HISTORY + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.writelines(lines[-TRACE_HISTORY_KEEP:])
+    os.replace(tmp, TRACE_HISTORY)
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest-rank percentile."""
+    v = sorted(values)
+    return v[max(0, math.ceil(p / 100 * len(v)) - 1)]
+
+
+def trace_report() -> None:
+    """p50/p95 duration (and median throughput) per stage and board type from TRACE_HISTORY."""
+    runs = []
+    try:
+        with open(TRACE_HISTORY, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    runs.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    if not runs:
+        print(Fore.YELLOW + f"⚠ No timing history yet ({TRACE_HISTORY}).")
+        return
+
+    groups: dict[tuple[str, str], list[tuple[float, int | None]]] = {}
+    for r in runs:
+        if not r["ok"]:
+            continue
+        groups.setdefault((r["board"], "TOTAL"), []).append((r["total"], None))
+        for sp in r["spans"]:
+            if sp["cat"] != "cmd":
+                groups.setdefault((r["board"], sp["name"]), []).append((sp["dur"], sp["bytes"]))
+
+    failed = sum(1 for r in runs if not r["ok"])
+    print(Style.BRIGHT + f"\n📊 {len(runs)} run(s) in history, {failed} failed (not included)")
+    print(Style.BRIGHT + f"{'BOARD':<10}{'STAGE':<16}{'N':>5}{'P50':>9}{'P95':>9}{'KB/s':>10}")
+    for (board, name), samples in sorted(groups.items()):
+        durs = [d for d, _ in samples]
+        rates = [b / d / 1024 for d, b in samples if b and d > 0]
+        kbs = f"{percentile(rates, 50):.1f}" if rates else "-"
+        print(f"{board:<10}{name:<16}{len(durs):>5}{percentile(durs, 50):>8.2f}s"
+              f"{percentile(durs, 95):>8.2f}s{kbs:>10}")
 
 
 # ---------------- UTILITY FUNCTIONS ----------------
 
+ESP_PORT_HINTS = ["CP210", "CH340", "USB-SERIAL", "Silicon", "JTAG"]
+# USB vendors of ESP boards: Silicon Labs CP210x, WCH CH340/CH9102, Espressif native USB (S3/C3)
+ESP_USB_VIDS = {0x10C4, 0x1A86, 0x303A}
+
+
+def detect_ports() -> list[str]:
+    """Returns every port whose description looks like an ESP USB bridge."""
+    return [
+        p.device for p in serial.tools.list_ports.comports()
+        if any(x in p.description for x in ESP_PORT_HINTS)
+    ]
+
+
 def detect_port() -> str:
     ports = list(serial.tools.list_ports.comports())
     for p in ports:
-        if any(x in p.description for x in ["CP210", "CH340", "USB-SERIAL", "Silicon", "JTAG"]):
+        if any(x in p.description for x in ESP_PORT_HINTS):
             print(Fore.GREEN + f"🔌 ESP detected: {p.device}")
             return p.device
     if ports:
@@ -136,28 +742,627 @@ def detect_port() -> str:
     sys.exit(1)
 
 
+# ---------------- PORT DISCOVERY ----------------
+# Instead of guessing from the port description, every USB serial port of an
+# ESP bridge (ESP_USB_VIDS / ESP_PORT_HINTS) is asked (esptool read-mac, one
+# connect attempt) which chip is behind it. Other adapters (printers, modems,
+# other MCUs) are left alone – a probe toggles DTR/RTS and may reset them –
+# unless PROBE_ALL_USB is set. The answers
+# are cached by VID:PID:serial, so later runs resolve without touching the ports;
+# ports that did not answer are skipped for PROBE_RETRY seconds. When no cached
+# port has the wanted chip (board swapped on a serial-less CH340), all ports are
+# probed again.
+# Discovery starts right after the directives are read and runs as its own
+# stage, in parallel with compilation; only flashing waits for it.
+
+PROBE_TIMEOUT = 8       # s per port – a port without an ESP fails after one sync attempt
+PROBE_RETRY   = 3600    # s before a port that did not answer is probed again
+PROBE_ALL_USB = False   # True: also probe USB serial adapters of other vendors (FTDI ESP-Prog, ...)
+
+_port_cache_lock = threading.Lock()
+_discovery_pool = None  # created by the first start_port_discovery()
+
+
+def port_key(p) -> str:
+    """Stable identity of a USB serial adapter (CH340 has no serial – location/port name then)."""
+    return f"{p.vid:04X}:{p.pid:04X}:{p.serial_number or p.location or p.device}"
+
+
+def load_port_cache() -> dict:
+    try:
+        with open(PORT_CACHE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_port_cache(cache: dict) -> None:
+    os.makedirs(os.path.dirname(PORT_CACHE) or ".", exist_ok=True)
+    tmp = PORT_CACHE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(tmp, PORT_CACHE)
+
+
+def forget_port(port: str) -> None:
+    """Drops the cached chip of a port (after a failed flash the mapping may be stale)."""
+    with _port_cache_lock:
+        cache = load_port_cache()
+        stale = [k for k, v in cache.items() if v.get("port") == port]
+        for k in stale:
+            del cache[k]
+        if stale:
+            save_port_cache(cache)
+
+
+def is_esp_port(p) -> bool:
+    """Whether a serial port may be probed: a USB adapter of an ESP vendor (or any with PROBE_ALL_USB)."""
+    if p.vid is None:
+        return False
+    return PROBE_ALL_USB or p.vid in ESP_USB_VIDS or any(x in (p.description or "") for x in ESP_PORT_HINTS)
+
+
+def probe_port(port: str) -> tuple[str, str] | None:
+    """(chip, MAC) of the ESP on a port, e.g. ("esp32s3", "f4:12:fa:..."); None if nothing answers."""
+    try:
+        r = subprocess.run([ESPTOOL, "--port", port, "--connect-attempts", "1", "read-mac"],
+                           capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    except (subprocess.TimeoutExpired, OSError):
+        return None
+    chip = re.search(r"Connected to (\S+) on", r.stdout) or re.search(r"Detecting chip type\.*\s*(\S+)", r.stdout)
+    mac = re.search(r"MAC:\s+([0-9a-fA-F:]{17})", r.stdout)
+    if r.returncode != 0 or not chip:
+        return None
+    return chip.group(1).lower().replace("-", ""), mac.group(1).lower() if mac else ""
+
+
+def discover_ports(want: str | None = None) -> list[dict]:
+    """
+    Every ESP USB serial port with the chip behind it: [{"port", "chip", "mac", "cached"}].
+    Cached adapters resolve instantly, the rest are probed concurrently. If no
+    cached chip is want, the cache is not trusted and every port is probed.
+    """
+    with _port_cache_lock:
+        cache = load_port_cache()
+
+    found = []
+    probe = []
+    usb = [(p.device, port_key(p)) for p in serial.tools.list_ports.comports() if is_esp_port(p)]
+    for dev, key in usb:
+        hit = cache.get(key)
+        if hit and hit["chip"]:
+            found.append({"port": dev, "chip": hit["chip"], "mac": hit["mac"], "cached": True})
+        elif not hit or time.time() - hit["checked"] > PROBE_RETRY:
+            probe.append((dev, key))
+    if want and not any(f["chip"] == want for f in found):
+        found = []
+        probe = usb
+
+    if probe:
+        with ThreadPoolExecutor(max_workers=len(probe)) as pool:
+            results = list(pool.map(probe_port, [dev for dev, _ in probe]))
+        with _port_cache_lock:
+            cache = load_port_cache()
+            for (dev, key), res in zip(probe, results):
+                chip, mac = res or ("", "")
+                cache[key] = {"chip": chip, "mac": mac, "port": dev, "checked": round(time.time())}
+                if chip:
+                    found.append({"port": dev, "chip": chip, "mac": mac, "cached": False})
+            save_port_cache(cache)
+    return sorted(found, key=lambda f: f["port"])
+
+
+def start_port_discovery(want: str | None = None):
+    """Starts discover_ports() in the background; stage_port_discovery() collects the result."""
+    global _discovery_pool
+    with _port_cache_lock:
+        if _discovery_pool is None:
+            _discovery_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="discovery")
+    return _discovery_pool.submit(discover_ports, want)
+
+
+def sketch_ino(path: str) -> str | None:
+    """The main .ino of a sketch folder: <folder>.ino (Arduino convention), else the first by name."""
+    inos = sorted(f for f in os.listdir(path) if f.endswith(".ino"))
+    if not inos:
+        return None
+    main = os.path.basename(os.path.normpath(path)) + ".ino"
+    return os.path.join(path, main if main in inos else inos[0])
+
+
 def find_ino(path: str) -> str:
-    for f in os.listdir(path):
-        if f.endswith(".ino"):
-            print(Fore.GREEN + f"INO found: {f}")
-            return os.path.join(path, f)
+    ino = sketch_ino(path)
+    if ino:
+        print(Fore.GREEN + f"INO found: {os.path.basename(ino)}")
+        return ino
     print(Fore.RED + "❌ No .ino file found")
     sys.exit(1)
 
 
+@dataclass
+class DirInventory:
+    """One scan of a directory tree: files as (rel, path, size, mtime_ns), sorted by rel."""
+    root: str
+    files: list[tuple[str, str, int, int]]
+    dir_count: int
+
+    @property
+    def file_count(self) -> int:
+        return len(self.files)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(f[2] for f in self.files)
+
+
+def scan_dir(path: str) -> DirInventory:
+    """
+    Walks a tree once with os.scandir (the stat data comes with the directory
+    listing on Windows). The result feeds size checks, partition choice, the
+    data/ mirror and the SPIFFS builder, so data/ is not walked again.
+    """
+    files = []
+    dir_count = 0
+    stack = [("", path)]
+    while stack:
+        rel_dir, d = stack.pop()
+        with os.scandir(d) as it:
+            for e in it:
+                rel = rel_dir + e.name
+                # symlinked directories are not followed (as os.walk did) – no loops, no linked trees
+                if e.is_dir(follow_symlinks=False):
+                    dir_count += 1
+                    stack.append((rel + "/", e.path))
+                elif e.is_file():
+                    st = e.stat()
+                    files.append((rel, e.path, st.st_size, st.st_mtime_ns))
+    files.sort()
+    return DirInventory(path, files, dir_count)
+
+
 def calc_dir_size(path: str) -> int:
     """Recursively calculates the directory size in bytes."""
-    total = 0
-    for root, dirs, files in os.walk(path):
-        for f in files:
-            fp = os.path.join(root, f)
-            if os.path.isfile(fp):
-                total += os.path.getsize(fp)
-    return total
+    return scan_dir(path).total_bytes
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def sync_dir(src: str, dst: str, manifest_path: str, inventory: DirInventory | None = None) -> dict:
+    """
+    Mirrors src (or its inventory from scan_dir) into dst incrementally. A manifest
+    of (size, mtime[, sha256]) from the previous sync decides what changed: only
+    new/changed files are copied
+    (hardlinked when src and dst share a filesystem), removed ones are deleted.
+    Returns counters: copied, linked, deleted, unchanged, bytes.
+    """
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    if inventory is None:
+        inventory = scan_dir(src)
+    dst_files = {f[0] for f in scan_dir(dst).files} if os.path.isdir(dst) else set()
+
+    stats = {"copied": 0, "linked": 0, "deleted": 0, "unchanged": 0, "bytes": 0}
+    new_manifest = {}
+    can_link = True
+    for rel, sp, size, mtime_ns in inventory.files:
+        dp = os.path.join(dst, rel)
+        sig = [size, mtime_ns]
+        prev = manifest.get(rel)
+        in_dst = rel in dst_files
+        dst_files.discard(rel)
+
+        if prev and in_dst:
+            if prev[:2] == sig:
+                new_manifest[rel] = prev
+                stats["unchanged"] += 1
+                continue
+            if DATA_SYNC_HASH and len(prev) > 2 and prev[2] == file_sha256(sp):
+                new_manifest[rel] = sig + prev[2:]
+                stats["unchanged"] += 1
+                continue
+
+        os.makedirs(os.path.dirname(dp), exist_ok=True)
+        if in_dst:
+            os.remove(dp)
+        linked = False
+        if can_link:
+            try:
+                os.link(sp, dp)
+                linked = True
+            except OSError:
+                can_link = False   # e.g. project and BUILD_BASE on different drives
+        if linked:
+            stats["linked"] += 1
+        else:
+            shutil.copy2(sp, dp)
+            stats["copied"] += 1
+            stats["bytes"] += size
+        new_manifest[rel] = sig + ([file_sha256(sp)] if DATA_SYNC_HASH else [])
+
+    for rel in dst_files:
+        os.remove(os.path.join(dst, rel))
+        stats["deleted"] += 1
+    # drop directories that became empty
+    for root, dirs, files in os.walk(dst, topdown=False):
+        if root != dst and not os.listdir(root):
+            os.rmdir(root)
+
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(new_manifest, f)
+    return stats
+
+
+# ---------------- WEB ASSETS ----------------
+# //ASSETS=MIN|GZIP|ALL processes data/ into a mirror inside the build path
+# before the partition choice and SPIFFS see it: text assets are minified,
+# web assets are replaced by "name.gz" (ESPAsyncWebServer's serveStatic()
+# answers a request for "name" with "name.gz" + Content-Encoding: gzip).
+
+ASSET_DIR        = "data_assets"    # processed mirror of data/ in the build path
+ASSET_MINIFY_EXT = (".html", ".htm", ".js", ".css", ".json", ".svg")
+# only files the web server serves – .json/.txt/... may be opened by the firmware under their own name
+ASSET_GZIP_EXT   = (".html", ".htm", ".js", ".css", ".svg", ".ico")
+ASSET_SKIP       = ("data/*",)      # opened by the firmware itself (yoRadio playlists, Wi-Fi) – left as is
+ASSET_GZIP_GAIN  = 0.05             # keep the plain file when gzip saves less than 5 %
+ASSET_VERSION    = 2                # bump when the minifiers change – invalidates cached results
+
+RE_CSS_TOKEN  = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/|\s*([{};,>])\s*|\s+', re.S)
+RE_HTML_COMMENT = re.compile(r"<!--(?!\[if).*?-->", re.S)
+RE_HTML_VERBATIM = re.compile(r"<(pre|textarea)\b", re.I)
+
+
+def js_scan_line(line: str, stack: list[str]) -> None:
+    """
+    Advances the JS nesting state over one line: stack holds the open "`"
+    template literals, "${" substitutions, "{" blocks inside them and "/*"
+    comments. '…' / "…" strings and // comments end with the line.
+    """
+    quote = None
+    i = 0
+    while i < len(line):
+        c = line[i]
+        top = stack[-1] if stack else ""
+        if top == "`":
+            if c == "\\":
+                i += 1
+            elif c == "`":
+                stack.pop()
+            elif line.startswith("${", i):
+                stack.append("${")
+                i += 1
+        elif top == "/*":
+            if line.startswith("*/", i):
+                stack.pop()
+                i += 1
+        elif quote:
+            if c == "\\":
+                i += 1
+            elif c == quote:
+                quote = None
+        elif c in "'\"":
+            quote = c
+        elif line.startswith("//", i):
+            break
+        elif line.startswith("/*", i):
+            stack.append("/*")
+            i += 1
+        elif c == "`":
+            stack.append("`")
+        elif c == "{" and stack:
+            stack.append("{")
+        elif c == "}" and stack:
+            stack.pop()
+        i += 1
+
+
+def minify_lines(text: str) -> str:
+    """
+    Drops indentation, trailing blanks and empty lines. Newlines stay, so JS ASI
+    is untouched; whitespace inside `template literals` is kept as it is.
+    """
+    out = []
+    stack = []
+    for line in text.splitlines():
+        starts_in = stack[-1:] == ["`"]
+        js_scan_line(line, stack)
+        ends_in = stack[-1:] == ["`"]
+        if not starts_in:
+            line = line.lstrip()
+        if not ends_in:
+            line = line.rstrip()
+        if line or starts_in:
+            out.append(line)
+    # unbalanced – a regex literal or something else the scanner does not know; leave it alone
+    return text if "`" in stack else "\n".join(out)
+
+
+def minify_css(text: str) -> str:
+    def token(m):
+        if m.group(1):
+            return m.group(1)       # string literal – verbatim
+        if m.group(2):
+            return m.group(2)       # { } ; , > without the whitespace around it
+        return "" if m.group(0).startswith("/*") else " "
+    return RE_CSS_TOKEN.sub(token, text).strip()
+
+
+def minify_asset(ext: str, data: bytes) -> bytes:
+    """Conservative minification by extension; content that does not decode is returned as is."""
+    try:
+        text = data.decode("utf-8")
+    except UnicodeDecodeError:
+        return data
+    if ext == ".json":
+        try:
+            text = json.dumps(json.loads(text), ensure_ascii=False, separators=(",", ":"))
+        except ValueError:
+            return data
+    elif ext == ".css":
+        text = minify_css(text)
+    elif ext in (".html", ".htm", ".svg"):
+        text = RE_HTML_COMMENT.sub("", text)
+        if not RE_HTML_VERBATIM.search(text):
+            text = minify_lines(text)
+    else:
+        text = minify_lines(text)
+    out = text.encode("utf-8")
+    return out if len(out) < len(data) else data
+
+
+def asset_mode(rel: str, mode: str, fs: str = "SPIFFS") -> str:
+    """Effective processing of one file: ALL, MIN, GZIP or '' (copied as is)."""
+    if any(fnmatch.fnmatch(rel, pat) for pat in ASSET_SKIP):
+        return ""
+    ext = os.path.splitext(rel)[1].lower()
+    do_min = mode in ("MIN", "ALL") and ext in ASSET_MINIFY_EXT
+    # the .gz name must still fit the filesystem's name limit
+    do_gz = mode in ("GZIP", "ALL") and ext in ASSET_GZIP_EXT and fs_name_fits(rel + ".gz", fs)
+    return "ALL" if do_min and do_gz else "MIN" if do_min else "GZIP" if do_gz else ""
+
+
+def process_asset(rel: str, data: bytes, mode: str) -> tuple[bytes, bool]:
+    """(output bytes, gzipped) of one file for its effective mode."""
+    if mode in ("MIN", "ALL"):
+        data = minify_asset(os.path.splitext(rel)[1].lower(), data)
+    if mode in ("GZIP", "ALL"):
+        gz = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(gz) <= len(data) * (1 - ASSET_GZIP_GAIN):
+            return gz, True
+    return data, False
+
+
+def asset_cache_evict() -> None:
+    """Removes least recently used results until the cache fits ASSET_CACHE_MAX_MB."""
+    entries = [(e.stat().st_mtime, e.stat().st_size, e.path) for e in os.scandir(ASSET_CACHE_DIR)
+               if e.is_file() and not e.name.endswith(".tmp")]
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= ASSET_CACHE_MAX_MB * 1024 * 1024:
+            break
+        os.remove(path)
+        total -= size
+
+
+def prepare_assets(mode: str, inventory: DirInventory, dst: str, fs: str = "SPIFFS") -> DirInventory:
+    """
+    Mirrors the data/ inventory into dst with //ASSETS= processing and returns
+    the inventory of dst. Results are cached by content hash + mode in
+    ASSET_CACHE_DIR; a manifest of (size, mtime) skips even the hashing of
+    unchanged files. Outputs are hardlinks to the cache / source where possible.
+    """
+    start = time.time()
+    manifest_path = dst + ".manifest.json"
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    os.makedirs(ASSET_CACHE_DIR, exist_ok=True)
+    existing = {f[0] for f in scan_dir(dst).files} if os.path.isdir(dst) else set()
+
+    stats = {"min": 0, "gz": 0, "processed": 0, "cached": 0}
+    new_manifest = {}
+    produced = set()
+    stored = False
+    for rel, sp, size, mtime_ns in inventory.files:
+        eff = asset_mode(rel, mode, fs)
+        prev = manifest.get(rel)
+        if prev and prev[:3] == [size, mtime_ns, eff] and prev[3] in existing:
+            new_manifest[rel] = prev
+            produced.add(prev[3])
+            stats["cached"] += 1
+            stats["gz"] += prev[3] != rel
+            stats["min"] += eff in ("MIN", "ALL")
+            continue
+
+        src = sp
+        out_rel = rel
+        if eff:
+            with open(sp, "rb") as f:
+                data = f.read()
+            # same bytes minify differently as .js / .css / .json – the extension is part of the key
+            ext = os.path.splitext(rel)[1].lower().lstrip(".")
+            entry = os.path.join(ASSET_CACHE_DIR,
+                                 f"{hashlib.sha256(data).hexdigest()}.{ext}.{eff.lower()}{ASSET_VERSION}")
+            if os.path.exists(entry + ".gz"):
+                entry += ".gz"
+            if os.path.exists(entry):
+                os.utime(entry)   # LRU
+                stats["cached"] += 1
+            else:
+                out, gzipped = process_asset(rel, data, eff)
+                entry += ".gz" if gzipped else ""
+                with open(entry + ".tmp", "wb") as f:
+                    f.write(out)
+                os.replace(entry + ".tmp", entry)
+                stats["processed"] += 1
+                stored = True
+            src = entry
+            if entry.endswith(".gz"):
+                out_rel = rel + ".gz"
+                stats["gz"] += 1
+            stats["min"] += eff in ("MIN", "ALL")
+        else:
+            stats["cached"] += 1
+
+        dp = os.path.join(dst, out_rel)
+        os.makedirs(os.path.dirname(dp), exist_ok=True)
+        if out_rel in existing:
+            os.remove(dp)    # may be a hardlink to the cache or data/ – never written in place
+        try:
+            os.link(src, dp)
+        except OSError:
+            shutil.copy2(src, dp)
+        new_manifest[rel] = [size, mtime_ns, eff, out_rel]
+        produced.add(out_rel)
+
+    for rel in existing - produced:
+        os.remove(os.path.join(dst, rel))
+    for root, dirs, files in os.walk(dst, topdown=False):
+        if root != dst and not os.listdir(root):
+            os.rmdir(root)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(new_manifest, f)
+    if stored:
+        asset_cache_evict()
+
+    result = scan_dir(dst)
+    before, after = inventory.total_bytes, result.total_bytes
+    saved = 100.0 * (before - after) / before if before else 0.0
+    txt = (f"Assets ({mode}): {stats['min']} minified, {stats['gz']} gzipped, {stats['processed']} processed, "
+           f"{stats['cached']} unchanged/cached – {before} B → {after} B (-{saved:.1f}%) "
+           f"in {time.time() - start:.2f}s")
+    print(Fore.GREEN + "🗜 " + txt)
+    log(txt, bytes=after, saved=before - after)
+    span_args(assets_in=before, assets_out=after)
+    return result
+
+
+def asset_inventory(cfg: dict, data_inv: DirInventory | None, build_path: str) -> DirInventory | None:
+    """data/ inventory as it goes into the filesystem image – processed with //ASSETS=, otherwise data/ itself."""
+    if not data_inv or not cfg["ASSETS"]:
+        return data_inv
+    return prepare_assets(cfg["ASSETS"], data_inv, os.path.join(build_path, ASSET_DIR), cfg["FS"])
 
 
 # ---------------- .INO DIRECTIVES PARSING ----------------
 
+def norm_flash(val: str) -> str:
+    v = val.upper().replace(" ", "")
+    v = v.replace("MB", "").replace("M", "")
+    if v not in ("2", "4", "8", "16", "32"):
+        return "4MB"
+    return f"{v}MB"
+
+
+def norm_part_alias(val: str) -> str:
+    if not val:
+        return "AUTO"
+    u = val.strip().upper().replace("-", "_")
+    if u in ("MS", "MINIMAL_SPIFFS", "MIN_SPIFFS", "MIN_SPIPFS", "MIN_SPIFS"):
+        return "MS"
+    if u in ("HA", "HUGE_APP", "HUGEAPP", "HUGE"):
+        return "HA"
+    if u in ("DEF", "DEFAULT"):
+        return "DEFAULT"
+    if u in ("AUTO", "AUT"):
+        return "AUTO"
+    # raw name – leave as is (e.g., default_8MB, mf_large, no_ota)
+    return val.strip()
+
+
+def apply_directive(cfg: dict, line: str) -> None:
+    """Applies one //DIRECTIVE=VALUE line to cfg (other lines are ignored)."""
+    # disabled directives – //-SOMETHING
+    if line.startswith("//-"):
+        return
+
+    if line.startswith("//PART="):
+        val = line.split("=", 1)[1].strip()
+        cfg["PART"] = norm_part_alias(val)
+
+    elif line.startswith("//FLASH-SIZE=") or line.startswith("//FLASH="):
+        val = line.split("=", 1)[1].strip()
+        cfg["FLASH"] = norm_flash(val)
+
+    elif line.startswith("//PSRAM="):
+        cfg["PSRAM"] = line.split("=", 1)[1].strip()
+
+    elif line.startswith("//ERASE="):
+        cfg["ERASE"] = (line.split("=", 1)[1].strip().upper() == "TRUE")
+
+    elif line.startswith("//CUST="):
+        cfg["CUST"] = line.split("=", 1)[1].strip()
+
+    elif line.startswith("//DIFF="):
+        cfg["DIFF"] = (line.split("=", 1)[1].strip().upper() == "TRUE")
+
+    elif line.startswith("//VERIFY="):
+        cfg["VERIFY"] = (line.split("=", 1)[1].strip().upper() == "TRUE")
+
+    elif line.startswith("//CACHE="):
+        cfg["CACHE"] = (line.split("=", 1)[1].strip().upper() != "FALSE")
+
+    elif line.startswith("//OTA="):
+        hosts = [h.strip() for h in line.split("=", 1)[1].split(",") if h.strip()]
+        cfg["OTA"] = cfg["OTA"] + hosts    # new list – matrix variants share the parent's
+
+    elif line.startswith("//FS="):
+        val = line.split("=", 1)[1].strip().upper()
+        cfg["FS"] = "LITTLEFS" if val in ("LITTLEFS", "LFS") else "SPIFFS"
+
+    elif line.startswith("//ASSETS="):
+        val = line.split("=", 1)[1].strip().upper()
+        if val in ("MIN", "MINIFY"):
+            cfg["ASSETS"] = "MIN"
+        elif val in ("GZIP", "GZ"):
+            cfg["ASSETS"] = "GZIP"
+        elif val in ("ALL", "TRUE", "GZIP,MIN", "MIN,GZIP"):
+            cfg["ASSETS"] = "ALL"
+        else:
+            cfg["ASSETS"] = None
+
+    elif line.startswith("//BAUD="):
+        val = line.split("=", 1)[1].strip().upper()
+        if val == "AUTO":
+            cfg["BAUD"] = "AUTO"
+        elif val.isdigit():
+            cfg["BAUD"] = int(val)
+
+    elif line.startswith("//MATRIX="):
+        cfg["MATRIX"].append(line.split("=", 1)[1].strip())
+
+    elif line.startswith("//COM="):
+        # Ensure the format is COMx
+        cfg["COM"] = "COM" + line.split("=", 1)[1].strip().upper().replace("COM", "")
+
+    elif line.startswith("//PLATFORM="):
+        plat = line.split("=", 1)[1].strip().upper()
+        if plat in ("ESP32S3", "ESP32_S3"):
+            cfg["PLATFORM"] = "esp32s3"
+        elif plat in ("ESP32C3", "ESP32_C3"):
+            cfg["PLATFORM"] = "esp32c3"
+        else:
+            cfg["PLATFORM"] = "esp32"
+
+    elif line.startswith("//ESP32S3"):
+        cfg["PLATFORM"] = "esp32s3"
+    elif line.startswith("//ESP32C3"):
+        cfg["PLATFORM"] = "esp32c3"
+    elif line.startswith("//ESP32"):
+        cfg["PLATFORM"] = "esp32"
+
+
 def parse_directives(ino: str) -> dict:
     cfg = {
         "PART": "AUTO",   # AUTO/MS/HA/DEFAULT or raw name (default, min_spiffs, huge_app, etc.)
@@ -166,146 +1371,193 @@ def parse_directives(ino: str) -> dict:
         "ERASE": False,
         "CUST": None,
         "PLATFORM": "esp32",  # esp32 / esp32s3 / esp32c3
-        "COM": None
+        "COM": None,
+        "OTA": [],        # ArduinoOTA hosts ("host" or "host:port") – network instead of serial
+        "CACHE": True,
+        "DIFF": False,
+        "VERIFY": False,
+        "FS": "SPIFFS",   # SPIFFS / LITTLEFS – filesystem image built from data/
+        "ASSETS": None,   # None / MIN / GZIP / ALL – pre-processing of data/ for the image
+        "BAUD": None,     # None = BAUD, "AUTO" or a fixed rate
+        "MATRIX": []      # --matrix variants, e.g. "ESP32S3,PART=HA,FLASH=16MB"
     }
 
-    def norm_flash(val: str) -> str:
-        v = val.upper().replace(" ", "")
-        v = v.replace("MB", "").replace("M", "")
-        if v not in ("2", "4", "8", "16", "32"):
-            return "4MB"
-        return f"{v}MB"
-
-    def norm_part_alias(val: str) -> str:
-        if not val:
-            return "AUTO"
-        u = val.strip().upper().replace("-", "_")
-        if u in ("MS", "MINIMAL_SPIFFS", "MIN_SPIFFS", "MIN_SPIPFS", "MIN_SPIFS"):
-            return "MS"
-        if u in ("HA", "HUGE_APP", "HUGEAPP", "HUGE"):
-            return "HA"
-        if u in ("DEF", "DEFAULT"):
-            return "DEFAULT"
-        if u in ("AUTO", "AUT"):
-            return "AUTO"
-        # raw name – leave as is (e.g., default_8MB, mf_large, no_ota)
-        return val.strip()
-
     with open(ino, "r", encoding="utf-8") as f:
         for raw in f:
-            line = raw.strip()
+            apply_directive(cfg, raw.strip())
 
-            # disabled directives – //-SOMETHING
-            if line.startswith("//-"):
-                continue
+    return cfg
 
-            if line.startswith("//PART="):
-                val = line.split("=", 1)[1].strip()
-                cfg["PART"] = norm_part_alias(val)
 
-            elif line.startswith("//FLASH-SIZE=") or line.startswith("//FLASH="):
-                val = line.split("=", 1)[1].strip()
-                cfg["FLASH"] = norm_flash(val)
+# ---------------- PARTITION CSV / SPIFFS ----------------
 
-            elif line.startswith("//PSRAM="):
-                cfg["PSRAM"] = line.split("=", 1)[1].strip()
+def get_partitions_dir() -> str:
+    # BOOT_APP0 sits in ...\tools\partitions\
+    return os.path.dirname(BOOT_APP0)
 
-            elif line.startswith("//ERASE="):
-                cfg["ERASE"] = (line.split("=", 1)[1].strip().upper() == "TRUE")
 
-            elif line.startswith("//CUST="):
-                cfg["CUST"] = line.split("=", 1)[1].strip()
+@dataclass
+class PartitionScheme:
+    """One partition CSV, parsed once (see partition_catalog())."""
+    name: str
+    csv: str
+    app_size: int                # largest app partition (what one firmware may occupy)
+    fs_offset: int | None        # filesystem (spiffs / littlefs) data partition, if any
+    fs_size: int | None
+    flash_bytes: int             # end of the last partition = minimal flash size
+    ota: bool                    # ota_0 + ota_1 app slots – the firmware can take an OTA update
 
-            elif line.startswith("//COM="):
-                # Ensure the format is COMx
-                cfg["COM"] = "COM" + line.split("=", 1)[1].strip().upper().replace("COM", "")
 
-            elif line.startswith("//PLATFORM="):
-                plat = line.split("=", 1)[1].strip().upper()
-                if plat in ("ESP32S3", "ESP32_S3"):
-                    cfg["PLATFORM"] = "esp32s3"
-                elif plat in ("ESP32C3", "ESP32_C3"):
-                    cfg["PLATFORM"] = "esp32c3"
-                else:
-                    cfg["PLATFORM"] = "esp32"
+# parsed once per process
+_partition_catalog: dict[str, PartitionScheme] | None = None
+_partition_menus: dict[str, dict[str, tuple[str, int | None]]] | None = None
 
-            elif line.startswith("//ESP32S3"):
-                cfg["PLATFORM"] = "esp32s3"
-            elif line.startswith("//ESP32C3"):
-                cfg["PLATFORM"] = "esp32c3"
-            elif line.startswith("//ESP32"):
-                cfg["PLATFORM"] = "esp32"
 
-    return cfg
+def parse_csv_size(val: str) -> int:
+    v = val.strip().upper()
+    if v.endswith("K"):
+        return int(v[:-1], 0) * 1024
+    if v.endswith("M"):
+        return int(v[:-1], 0) * 1024 * 1024
+    return int(v, 0)
 
 
-# ---------------- PARTITION CSV / SPIFFS ----------------
+FS_SUBTYPES = ("spiffs", "littlefs")
 
-def get_partitions_dir() -> str:
-    # BOOT_APP0 sits in ...\tools\partitions\
-    return os.path.dirname(BOOT_APP0)
 
+def parse_partition_csv(csv_path: str) -> PartitionScheme | None:
+    app_size = 0
+    app_subtypes = set()
+    fs_offset = fs_size = None
+    end = 0x9000    # first partition follows the partition table at 0x8000
+    try:
+        with open(csv_path, "r", encoding="utf-8") as f:
+            for raw in f:
+                line = raw.strip()
+                if not line or line.startswith("#"):
+                    continue
+                cols = [c.strip() for c in line.split(",")]
+                if len(cols) < 5:
+                    continue
+                name, ptype, subtype, offset, size = cols[:5]
+                align = 0x10000 if ptype.lower() == "app" else 0x1000
+                off_val = parse_csv_size(offset) if offset else (end + align - 1) // align * align
+                size_val = parse_csv_size(size)
+                end = max(end, off_val + size_val)
+
+                if ptype.lower() == "app":
+                    app_size = max(app_size, size_val)
+                    app_subtypes.add(subtype.lower())
+                # filesystem – the core's CSVs call it "spiffs" also when LittleFS is used
+                elif ptype.lower() == "data" and (subtype.lower() in FS_SUBTYPES or name.lower() in FS_SUBTYPES):
+                    if fs_offset is None:
+                        fs_offset, fs_size = off_val, size_val
+    except (OSError, ValueError):
+        return None
 
-def find_partition_csv(part_name: str) -> str | None:
+    flash_bytes = 2 * 1024 * 1024
+    while flash_bytes < end:
+        flash_bytes *= 2
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    return PartitionScheme(name, csv_path, app_size, fs_offset, fs_size, flash_bytes,
+                           {"ota_0", "ota_1"} <= app_subtypes)
+
+
+def partition_catalog() -> dict[str, PartitionScheme]:
+    """All partition CSVs of the core, indexed by name (directory scanned once)."""
+    global _partition_catalog
+    if _partition_catalog is None:
+        # built completely before it is published – matrix workers share it
+        catalog = {}
+        part_dir = get_partitions_dir()
+        if os.path.isdir(part_dir):
+            for e in os.scandir(part_dir):
+                if e.name.lower().endswith(".csv"):
+                    scheme = parse_partition_csv(e.path)
+                    if scheme:
+                        catalog[scheme.name] = scheme
+        _partition_catalog = catalog
+    return _partition_catalog
+
+
+def partition_menu(plat: str) -> dict[str, tuple[str, int | None]]:
+    """
+    PartitionScheme menu of the board from the core's boards.txt:
+    menu id -> (CSV name, upload.maximum_size). Empty when boards.txt is missing.
+    """
+    global _partition_menus
+    if _partition_menus is None:
+        menus = {}
+        # BOOT_APP0 sits in ...\hardware\esp32\<version>\tools\partitions\
+        boards_txt = os.path.join(os.path.dirname(os.path.dirname(get_partitions_dir())), "boards.txt")
+        try:
+            with open(boards_txt, "r", encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            lines = []
+        for line in lines:
+            key, sep, val = line.partition("=")
+            parts = key.strip().split(".")
+            if not sep or len(parts) != 6 or parts[1:3] != ["menu", "PartitionScheme"]:
+                continue
+            board, opt, prop = parts[0], parts[3], ".".join(parts[4:])
+            csv_name, max_size = menus.setdefault(board, {}).get(opt, (opt, None))
+            if prop == "build.partitions":
+                csv_name = val.strip()
+            elif prop == "upload.maximum_size":
+                max_size = int(val.strip())
+            menus[board][opt] = (csv_name, max_size)
+        _partition_menus = menus
+    return _partition_menus.get(plat, {})
+
+
+def get_partition_scheme(part_name: str, plat: str | None = None) -> PartitionScheme | None:
+    """Resolves a menu id or CSV name (or a unique prefix of one) to its parsed scheme."""
+    catalog = partition_catalog()
+    menus = [partition_menu(plat)] if plat else list((_partition_menus or {}).values())
+    for menu in menus:
+        if part_name in menu and menu[part_name][0] in catalog:
+            return catalog[menu[part_name][0]]
+    if part_name in catalog:
+        return catalog[part_name]
+    candidates = sorted((n for n in catalog if n.lower().startswith(part_name.lower())), key=len)
+    return catalog[candidates[0]] if candidates else None
+
+
+def find_partition_csv(part_name: str, plat: str | None = None) -> str | None:
     part_dir = get_partitions_dir()
     if not os.path.isdir(part_dir):
         print(Fore.RED + f"❌ Missing partitions directory: {part_dir}")
         return None
-
-    exact = os.path.join(part_dir, f"{part_name}.csv")
-    if os.path.exists(exact):
-        return exact
-
-    candidates = [
-        f for f in os.listdir(part_dir)
-        if f.lower().startswith(part_name.lower()) and f.endswith(".csv")
-    ]
-    if not candidates:
-        return None
-    candidates.sort(key=len)
-    return os.path.join(part_dir, candidates[0])
+    scheme = get_partition_scheme(part_name, plat)
+    return scheme.csv if scheme else None
 
 
-def get_spiffs_region(part_name: str) -> tuple[int | None, int | None]:
+def get_spiffs_region(part_name: str, plat: str | None = None) -> tuple[int | None, int | None]:
     """
-    Returns (size_bytes, offset) for the SPIFFS partition in the given scheme.
+    Returns (size_bytes, offset) for the filesystem (spiffs / littlefs) partition in the given scheme.
     """
-    csv_path = find_partition_csv(part_name)
-    if not csv_path:
+    scheme = get_partition_scheme(part_name, plat)
+    if not scheme:
         print(Fore.YELLOW + f"ℹ CSV file not found for partition '{part_name}'.")
         return None, None
 
-    print(Fore.CYAN + f"📄 Using partition table: {csv_path}")
+    print(Fore.CYAN + f"📄 Using partition table: {scheme.csv}")
 
-    with open(csv_path, "r", encoding="utf-8") as f:
-        for raw in f:
-            line = raw.strip()
-            if not line or line.startswith("#"):
-                continue
-            cols = [c.strip() for c in line.split(",")]
-            if len(cols) < 5:
-                continue
-
-            name, ptype, subtype, offset, size = cols[:5]
-
-            # if it's SPIFFS
-            if ptype.lower() == "data" and (subtype.lower() == "spiffs" or name.lower() == "spiffs"):
-                try:
-                    off_val = int(offset, 0)
-                    size_val = int(size, 0)
-                    print(Fore.MAGENTA + f"📦 SPIFFS from CSV: offset=0x{off_val:06X}, size=0x{size_val:06X}")
-                    return size_val, off_val
-                except ValueError:
-                    continue
+    if scheme.fs_size is None:
+        print(Fore.YELLOW + f"ℹ Partition '{part_name}' does not contain a filesystem partition.")
+        return None, None
 
-    print(Fore.YELLOW + f"ℹ Partition '{part_name}' does not contain SPIFFS.")
-    return None, None
+    print(Fore.MAGENTA + f"📦 Filesystem from CSV: offset=0x{scheme.fs_offset:06X}, size=0x{scheme.fs_size:06X}")
+    return scheme.fs_size, scheme.fs_offset
 
 
-def auto_choose_partition(cfg: dict, data_bytes: int | None) -> None:
+def auto_choose_partition(cfg: dict, data_bytes: int | None, app_bytes: int | None = None) -> None:
     """
     Sets cfg["PART"] to a specific PartitionScheme (default / min_spiffs / huge_app / custom),
-    considering aliases (AUTO/MS/HA/DEFAULT) and the size of the 'data' directory.
+    considering aliases (AUTO/MS/HA/DEFAULT), the size of the 'data' directory, the
+    size of the last compiled app (if known) and the //FLASH= size. With //OTA=
+    AUTO only takes schemes with two OTA slots (no huge_app / no_ota).
     """
     part = cfg["PART"]
     plat = cfg["PLATFORM"]
@@ -342,67 +1594,444 @@ def auto_choose_partition(cfg: dict, data_bytes: int | None) -> None:
         cfg["PART"] = "default"
         return
 
-    print(Fore.CYAN + f"ℹ PART=AUTO, data size = {data_bytes} B – attempting to select min_spiffs / huge_app.")
-
-    # get SPIFFS sizes for min_spiffs and huge_app
-    size_min, _ = get_spiffs_region("min_spiffs")
-    size_ha, _ = get_spiffs_region("huge_app")
+    flash_limit = int(cfg["FLASH"][:-2]) * 1024 * 1024
+    app_txt = f", last app = {app_bytes} B" if app_bytes else ""
+    print(Fore.CYAN + f"ℹ PART=AUTO, data size = {data_bytes} B{app_txt}, flash = {cfg['FLASH']} "
+                      f"– looking for the tightest scheme.")
+
+    # data_bytes is the image usage (fs_usage) – keep room for the filesystem to work in
+    margin = max(2 * SPIFFS_BLOCK_SIZE, data_bytes // 20)
+    catalog = partition_catalog()
+    # menu ids of the board (valid for the FQBN); without boards.txt the CSV names
+    menu = partition_menu(plat) or {name: (name, None) for name in catalog}
+    # first run, app size unknown: no scheme with less app room than 'default'
+    min_app = 0 if app_bytes or "default" not in catalog else catalog["default"].app_size
+
+    best = None
+    for opt, (csv_name, max_size) in menu.items():
+        scheme = catalog.get(csv_name)
+        if not scheme or not scheme.fs_size or scheme.flash_bytes > flash_limit:
+            continue
+        if cfg["OTA"] and not scheme.ota:
+            continue
+        if data_bytes >= scheme.fs_size - margin:
+            continue
+        if app_bytes and app_bytes > (max_size or scheme.app_size):
+            continue
+        if scheme.app_size < min_app:
+            continue
+        # least unused SPIFFS first, then the most room for the app
+        rank = (scheme.fs_size - data_bytes, -scheme.app_size, opt)
+        if best is None or rank < best[0]:
+            best = (rank, opt, scheme)
+
+    if best:
+        _, opt, scheme = best
+        cfg["PART"] = opt
+        print(Fore.GREEN + f"✅ Selected PartitionScheme={opt} ({cfg['FS']} ~0x{scheme.fs_size:X} B, "
+                           f"app 0x{scheme.app_size:X} B, needs {scheme.flash_bytes // (1024 * 1024)}MB flash)")
+        return
 
-    margin = 4096  # some buffer for SPIFFS structures
+    # no sensible SPIFFS (e.g., data larger than any scheme) – fallback to default
+    print(Fore.YELLOW + "⚠ No partition scheme fits data/ and the app – using 'default'.")
+    cfg["PART"] = "default"
 
-    # prefer min_spiffs if there is enough space
-    if size_min and data_bytes < (size_min - margin):
-        cfg["PART"] = "min_spiffs"
-        print(Fore.GREEN + f"✅ Selected PartitionScheme=min_spiffs (SPIFFS ~0x{size_min:X} B)")
-        return
 
-    # otherwise try huge_app
-    if size_ha and data_bytes < (size_ha - margin):
-        cfg["PART"] = "huge_app"
-        print(Fore.GREEN + f"✅ Selected PartitionScheme=huge_app (SPIFFS ~0x{size_ha:X} B)")
+def warn_no_ota(cfg: dict) -> None:
+    """//OTA= with a scheme without OTA slots: this upload works, the firmware cannot take the next one."""
+    if not cfg["OTA"]:
         return
+    scheme = get_partition_scheme(cfg["PART"], cfg["PLATFORM"])
+    if scheme and not scheme.ota:
+        print(Fore.YELLOW + f"⚠ PartitionScheme={cfg['PART']} has no OTA slots – "
+                            f"the flashed firmware cannot receive OTA updates.")
 
-    # no sensible SPIFFS (e.g., custom scheme without spiffs) – fallback to default
-    print(Fore.YELLOW + "⚠ Could not match min_spiffs/huge_app – using 'default'.")
-    cfg["PART"] = "default"
 
-
-def make_spiffs_image(data_dir: str, out_path: str, size_bytes: int) -> bool:
+def make_fs_image(data_dir: str, out_path: str, size_bytes: int, build_path: str,
+                  inventory: DirInventory | None = None, fs: str = "SPIFFS") -> bool:
+    """
+    Builds the //FS= image (SPIFFS or LITTLEFS) of data/ with the configured
+    builder; the SPIFFS page cache lives in build_path.
+    """
     if not os.path.isdir(data_dir):
-        print(Fore.YELLOW + "⚠ Missing data/ directory – not creating SPIFFS.")
+        print(Fore.YELLOW + f"⚠ Missing data/ directory – not creating {fs}.")
         return False
 
-    file_count = 0
-    dir_count = 0
-    for root, dirs, files in os.walk(data_dir):
-        if root == data_dir:
-            dir_count += len(dirs)
-        else:
-            dir_count += 1
-        file_count += len(files)
-
-    payload_size = calc_dir_size(data_dir)
-    print(Fore.CYAN + f"📁 data/: {dir_count} directories, {file_count} files, {payload_size} B of data")
+    if inventory is None:
+        inventory = scan_dir(data_dir)
+    payload_size = inventory.total_bytes
+    print(Fore.CYAN + f"📁 data/: {inventory.dir_count} directories, {inventory.file_count} files, "
+                      f"{payload_size} B of data")
 
-    if payload_size > size_bytes - 4096:
-        print(Fore.RED + f"❌ Data ({payload_size} B) does not fit in SPIFFS partition ({size_bytes} B).")
+    need = fs_usage(inventory, fs)
+    if need > size_bytes - 4096:
+        print(Fore.RED + f"❌ Data ({need} B in {fs}) does not fit in the partition ({size_bytes} B).")
         print(Fore.RED + "   Reduce data/ content or select a larger partition scheme (e.g., HA/huge_app).")
         return False
 
-    print(Fore.CYAN + f"🔧 Building SPIFFS image of size {size_bytes} B ...")
+    print(Fore.CYAN + f"🔧 Building {fs} image of size {size_bytes} B ...")
 
-    cmd = f'"{MK_SPIFFS}" -c "{data_dir}" -b 4096 -p 256 -s {size_bytes} "{out_path}"'
-    run(cmd)
+    if fs == "LITTLEFS":
+        if LITTLEFS_BUILDER == "python" and HAVE_LITTLEFS:
+            if not build_littlefs_image(out_path, size_bytes, inventory):
+                return False
+        else:
+            if LITTLEFS_BUILDER == "python":
+                print(Fore.YELLOW + "⚠ littlefs-python not installed (pip install littlefs-python) – using mklittlefs.")
+            run([MK_LITTLEFS, "-c", inventory.root, "-b", str(LITTLEFS_BLOCK_SIZE), "-p", str(LITTLEFS_PAGE_SIZE),
+                 "-s", str(size_bytes), out_path], kind="mklittlefs")
+    elif SPIFFS_BUILDER == "mkspiffs":
+        run([MK_SPIFFS, "-c", inventory.root, "-b", "4096", "-p", "256", "-s", str(size_bytes), out_path],
+            kind="mkspiffs")
+    else:
+        img = build_spiffs_image(data_dir, size_bytes, os.path.join(build_path, SPIFFS_CACHE_DIR), inventory)
+        if img is None:
+            return False
+        with open(out_path, "wb") as f:
+            f.write(img)
 
     if os.path.exists(out_path):
         sz = os.path.getsize(out_path)
-        print(Fore.GREEN + f"✅ SPIFFS generated: {out_path} ({sz} B)")
+        print(Fore.GREEN + f"✅ {fs} generated: {out_path} ({sz} B)")
         return True
     else:
-        print(Fore.RED + "❌ mkspiffs failed to create the file!")
+        print(Fore.RED + f"❌ {fs} image was not created!")
         return False
 
 
+# ---------------- SPIFFS IMAGE BUILDER ----------------
+# In-process replacement for 'mkspiffs -b 4096 -p 256' with the configuration
+# of the arduino-esp32 mkspiffs build: 32 B names, 4 B metadata, magic with length.
+
+SPIFFS_PAGE_SIZE     = 256
+SPIFFS_BLOCK_SIZE    = 4096
+SPIFFS_OBJ_NAME_LEN  = 32
+SPIFFS_OBJ_META_LEN  = 4
+
+SPIFFS_PAGES_PER_BLOCK = SPIFFS_BLOCK_SIZE // SPIFFS_PAGE_SIZE
+SPIFFS_LU_PAGES        = -(-SPIFFS_PAGES_PER_BLOCK * 2 // SPIFFS_PAGE_SIZE)   # obj id lookup pages
+SPIFFS_USABLE_PAGES    = SPIFFS_PAGES_PER_BLOCK - SPIFFS_LU_PAGES
+SPIFFS_DATA_HDR_LEN    = 5                                                  # obj_id, span_ix, flags
+SPIFFS_DATA_LEN        = SPIFFS_PAGE_SIZE - SPIFFS_DATA_HDR_LEN
+SPIFFS_IX_HDR_LEN      = 8 + 4 + 1 + SPIFFS_OBJ_NAME_LEN + SPIFFS_OBJ_META_LEN  # + size, type, name, meta
+SPIFFS_IX_HEAD_ENTRIES = (SPIFFS_PAGE_SIZE - SPIFFS_IX_HDR_LEN) // 2
+SPIFFS_IX_ENTRIES      = (SPIFFS_PAGE_SIZE - 8) // 2
+SPIFFS_MAGIC_OFFSET    = SPIFFS_LU_PAGES * SPIFFS_PAGE_SIZE - 2 * 2              # in the block, before the erase count
+
+SPIFFS_IX_FLAG       = 0x8000
+SPIFFS_FLAG_DATA     = 0xFC      # USED + FINAL cleared
+SPIFFS_FLAG_INDEX    = 0xF8      # USED + FINAL + INDEX cleared
+SPIFFS_TYPE_FILE     = 1
+SPIFFS_UNDEFINED_LEN = 0xFFFFFFFF
+
+# files mkspiffs leaves out unless called with --all-files
+SPIFFS_SKIP_FILES = (".DS_Store",)
+SPIFFS_SKIP_DIRS  = (".git",)
+
+# (sha256, obj_id) -> serialized data pages of the last build of every cache dir;
+# survives between builds in one process (--watch)
+_spiffs_page_memo: dict[str, dict[tuple[str, int], bytes]] = {}
+
+
+def fs_files(inventory: DirInventory) -> list[tuple[str, str, int, int]]:
+    """Inventory entries that go into a filesystem image (SPIFFS_SKIP_* left out)."""
+    files = []
+    for f in inventory.files:
+        parts = f[0].split("/")
+        if parts[-1] in SPIFFS_SKIP_FILES or any(p in SPIFFS_SKIP_DIRS for p in parts[:-1]):
+            continue
+        files.append(f)
+    return files
+
+
+def fs_usage(inventory: DirInventory, fs: str) -> int:
+    """
+    Bytes the inventory needs in an fs image. SPIFFS: data pages (5 B header
+    each), index pages and the lookup page of every block, as spiffs_layout()
+    places them. LittleFS stores every file that is not inlined in its
+    directory in whole blocks.
+    """
+    files = fs_files(inventory)
+    if fs != "LITTLEFS":
+        pages = 0
+        for _, _, size, _ in files:
+            data = -(-size // SPIFFS_DATA_LEN)
+            pages += data + 1 + -(-max(0, data - SPIFFS_IX_HEAD_ENTRIES) // SPIFFS_IX_ENTRIES)
+        return -(-pages // SPIFFS_USABLE_PAGES) * SPIFFS_BLOCK_SIZE
+    blocks = 2 * (inventory.dir_count + 1)                        # metadata pair of root + every directory
+    blocks += 2 * -(-len(files) * 64 // LITTLEFS_BLOCK_SIZE)      # directory entries (rough)
+    for _, _, size, _ in files:
+        if size > LITTLEFS_PAGE_SIZE:                             # smaller files are inlined
+            blocks += -(-size // (LITTLEFS_BLOCK_SIZE - 8))       # CTZ skip-list pointers
+    return blocks * LITTLEFS_BLOCK_SIZE
+
+
+def fs_name_fits(rel: str, fs: str) -> bool:
+    """Whether a data/ path can be stored: SPIFFS limits the whole path, LittleFS every name in it."""
+    if fs == "LITTLEFS":
+        return all(len(p.encode("utf-8")) <= LITTLEFS_NAME_MAX for p in rel.split("/"))
+    return len(("/" + rel).encode("utf-8")) < SPIFFS_OBJ_NAME_LEN
+
+
+def spiffs_data_pages(data: bytes, obj_id: int) -> bytes:
+    """Serializes file content into SPIFFS data pages (span index = page number)."""
+    out = bytearray()
+    for span, pos in enumerate(range(0, len(data), SPIFFS_DATA_LEN)):
+        chunk = data[pos:pos + SPIFFS_DATA_LEN]
+        out += struct.pack("<HHB", obj_id, span, SPIFFS_FLAG_DATA)
+        out += chunk + b"\xff" * (SPIFFS_DATA_LEN - len(chunk))
+    return bytes(out)
+
+
+def spiffs_index_page(obj_id: int, span: int, entries: list[int],
+                      name: str | None = None, size: int = 0) -> bytes:
+    """Object index page; span 0 is the header page carrying size, type and name."""
+    page = bytearray(struct.pack("<HHB", obj_id | SPIFFS_IX_FLAG, span, SPIFFS_FLAG_INDEX))
+    page += b"\xff" * 3
+    if span == 0:
+        raw_name = name.encode("utf-8")
+        page += struct.pack("<IB", size if size else SPIFFS_UNDEFINED_LEN, SPIFFS_TYPE_FILE)
+        page += raw_name + b"\0" * (SPIFFS_OBJ_NAME_LEN - len(raw_name))
+        page += b"\xff" * SPIFFS_OBJ_META_LEN
+    for pix in entries:
+        page += struct.pack("<H", pix)
+    return bytes(page + b"\xff" * (SPIFFS_PAGE_SIZE - len(page)))
+
+
+def spiffs_layout(objects: list[tuple[int, str, int, bytes]], size_bytes: int) -> bytes:
+    """
+    Places (obj_id, name, size, data_pages) objects into a formatted image: every object
+    gets its index page(s) followed by its data pages, allocated in order across
+    blocks. Raises ValueError when the image is full.
+    """
+    block_count = size_bytes // SPIFFS_BLOCK_SIZE
+    img = bytearray(b"\xff" * (block_count * SPIFFS_BLOCK_SIZE))
+    capacity = block_count * SPIFFS_USABLE_PAGES
+    slot = 0
+
+    def alloc(lu_id: int) -> int:
+        nonlocal slot
+        if slot >= capacity:
+            raise ValueError("SPIFFS image is full")
+        bix, entry = divmod(slot, SPIFFS_USABLE_PAGES)
+        slot += 1
+        struct.pack_into("<H", img, bix * SPIFFS_BLOCK_SIZE + entry * 2, lu_id)
+        return bix * SPIFFS_PAGES_PER_BLOCK + SPIFFS_LU_PAGES + entry
+
+    for obj_id, name, size, pages in objects:
+        index = [(alloc(obj_id | SPIFFS_IX_FLAG), [])]
+        limit = SPIFFS_IX_HEAD_ENTRIES
+        for pos in range(0, len(pages), SPIFFS_PAGE_SIZE):
+            if len(index[-1][1]) == limit:
+                index.append((alloc(obj_id | SPIFFS_IX_FLAG), []))
+                limit = SPIFFS_IX_ENTRIES
+            pix = alloc(obj_id)
+            img[pix * SPIFFS_PAGE_SIZE:(pix + 1) * SPIFFS_PAGE_SIZE] = pages[pos:pos + SPIFFS_PAGE_SIZE]
+            index[-1][1].append(pix)
+        for span, (pix, entries) in enumerate(index):
+            img[pix * SPIFFS_PAGE_SIZE:(pix + 1) * SPIFFS_PAGE_SIZE] = \
+                spiffs_index_page(obj_id, span, entries, name, size)
+
+    # every block carries the magic in the second to last lookup slot (SPIFFS_MAGIC_PADDR),
+    # also the empty ones; the last slot is the erase count and stays 0xFFFF
+    for bix in range(block_count):
+        magic = (0x20140529 ^ SPIFFS_PAGE_SIZE ^ (block_count - bix)) & 0xFFFF
+        struct.pack_into("<H", img, bix * SPIFFS_BLOCK_SIZE + SPIFFS_MAGIC_OFFSET, magic)
+    return bytes(img)
+
+
+def build_spiffs_image(data_dir: str, size_bytes: int, cache_dir: str,
+                       inventory: DirInventory | None = None) -> bytes | None:
+    """
+    Builds the SPIFFS image of data_dir in memory. Data pages of every file are
+    cached by content hash in cache_dir (one per sketch / variant build path),
+    so only changed files are re-encoded. Every path keeps its obj_id (stored
+    in the index) – the id is part of the pages, so adding or removing a file
+    does not renumber the others.
+    Returns None (after printing the reason) when the content does not fit.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, "index.json")
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            known = json.load(f)
+    except (OSError, ValueError):
+        known = {}
+
+    if inventory is None:
+        inventory = scan_dir(data_dir)
+    files = [("/" + rel, fp, size, mtime_ns) for rel, fp, size, mtime_ns in fs_files(inventory)]
+
+    # index: name -> [size, mtime_ns, sha256, obj_id]; known paths keep their id, new ones take free ids
+    ids = {}
+    taken = set()
+    for name, *_ in files:
+        prev = known.get(name)
+        if prev and len(prev) > 3 and prev[3] not in taken:
+            ids[name] = prev[3]
+            taken.add(prev[3])
+    free = (i for i in range(1, SPIFFS_IX_FLAG) if i not in taken)
+    for name, *_ in files:
+        if name not in ids:
+            ids[name] = next(free)
+
+    objects = []
+    index = {}
+    live = set()
+    memo = _spiffs_page_memo.get(cache_dir, {})
+    new_memo = {}
+    encoded = 0
+    for name, fp, size, mtime_ns in files:
+        if len(name.encode("utf-8")) >= SPIFFS_OBJ_NAME_LEN:
+            print(Fore.RED + f"❌ SPIFFS name too long (max {SPIFFS_OBJ_NAME_LEN - 1} B): {name}")
+            return None
+
+        obj_id = ids[name]
+        sig = [size, mtime_ns]
+        prev = known.get(name)
+        if prev and prev[:2] == sig:
+            sha = prev[2]
+        else:
+            with open(fp, "rb") as f:
+                sha = hashlib.sha256(f.read()).hexdigest()
+        index[name] = sig + [sha, obj_id]
+
+        cache_file = os.path.join(cache_dir, f"{sha}_{obj_id}.pages")
+        pages = memo.get((sha, obj_id))
+        if pages is None and os.path.exists(cache_file):
+            with open(cache_file, "rb") as f:
+                pages = f.read()
+        if pages is None:
+            with open(fp, "rb") as f:
+                pages = spiffs_data_pages(f.read(), obj_id)
+            with open(cache_file, "wb") as f:
+                f.write(pages)
+            encoded += 1
+        new_memo[(sha, obj_id)] = pages
+        live.add(os.path.basename(cache_file))
+        objects.append((obj_id, name, size, pages))
+
+    try:
+        img = spiffs_layout(objects, size_bytes)
+    except ValueError as e:
+        print(Fore.RED + f"❌ {e} – reduce data/ content or select a larger partition scheme.")
+        return None
+
+    # keep only the pages of the current tree – in memory as well, so --watch does not grow it
+    _spiffs_page_memo[cache_dir] = new_memo
+    for fname in os.listdir(cache_dir):
+        if fname.endswith(".pages") and fname not in live:
+            os.remove(os.path.join(cache_dir, fname))
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+
+    print(Fore.CYAN + f"🧩 SPIFFS: {len(objects)} files, {encoded} re-encoded, {len(objects) - encoded} from page cache")
+    return img
+
+
+# ---------------- LITTLEFS IMAGE BUILDER ----------------
+# //FS=LITTLEFS images are built in-process by littlefs-python with the geometry
+# of the arduino-esp32 mklittlefs build (MK_LITTLEFS is the fallback without it).
+# The last image is kept with a (size, mtime) manifest of its files; a rebuild
+# mounts it and writes only the files that changed.
+
+LITTLEFS_BLOCK_SIZE   = 4096
+LITTLEFS_PAGE_SIZE    = 256
+LITTLEFS_NAME_MAX     = 64            # CONFIG_LITTLEFS_OBJ_NAME_LEN of esp_littlefs
+LITTLEFS_DISK_VERSION = 0x00020000    # v2.0 – also mountable by older esp_littlefs releases
+
+
+def littlefs_open(size_bytes: int, image: bytearray | None):
+    """LittleFS over an in-memory image (a blank, erased one when image is None)."""
+    ctx = littlefs.UserContext(buffer=image) if image is not None else littlefs.UserContext(size_bytes)
+    return littlefs.LittleFS(context=ctx, mount=False,
+                             block_size=LITTLEFS_BLOCK_SIZE, block_count=size_bytes // LITTLEFS_BLOCK_SIZE,
+                             read_size=LITTLEFS_PAGE_SIZE, prog_size=LITTLEFS_PAGE_SIZE,
+                             name_max=LITTLEFS_NAME_MAX, disk_version=LITTLEFS_DISK_VERSION)
+
+
+def littlefs_apply(lfs, files: dict[str, tuple[str, int, int]], known: dict) -> tuple[int, int]:
+    """Brings a mounted LittleFS to the content of files; returns (written, removed)."""
+    removed = [rel for rel in known if rel not in files]
+    for rel in removed:
+        lfs.remove(rel)
+        # directories left empty
+        d = rel.rpartition("/")[0]
+        while d and not lfs.listdir(d):
+            lfs.rmdir(d)
+            d = d.rpartition("/")[0]
+
+    written = 0
+    for rel, (fp, size, mtime_ns) in files.items():
+        if known.get(rel) == [size, mtime_ns]:
+            continue
+        d = rel.rpartition("/")[0]
+        if d:
+            lfs.makedirs(d, exist_ok=True)
+        with open(fp, "rb") as src, lfs.open(rel, "wb") as dst:
+            dst.write(src.read())
+        written += 1
+    return written, len(removed)
+
+
+def build_littlefs_image(out_path: str, size_bytes: int, inventory: DirInventory) -> bool:
+    """
+    Writes the LittleFS image of the inventory to out_path. When out_path still
+    holds the image of the previous build (same geometry, checksum in the state
+    file) it is updated in place; otherwise – or when the update runs out of
+    space – the image is built from scratch.
+    """
+    state_path = out_path + ".state.json"
+    geometry = [size_bytes, LITTLEFS_BLOCK_SIZE, LITTLEFS_PAGE_SIZE, LITTLEFS_NAME_MAX, LITTLEFS_DISK_VERSION]
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+
+    files = {}
+    for rel, fp, size, mtime_ns in fs_files(inventory):
+        if not fs_name_fits(rel, "LITTLEFS"):
+            print(Fore.RED + f"❌ LittleFS name too long (max {LITTLEFS_NAME_MAX} B per name): /{rel}")
+            return False
+        files[rel] = (fp, size, mtime_ns)
+
+    previous = None
+    if state.get("geometry") == geometry and os.path.exists(out_path):
+        with open(out_path, "rb") as f:
+            previous = bytearray(f.read())
+        if hashlib.sha256(previous).hexdigest() != state.get("sha"):
+            previous = None
+
+    for image in ([previous, None] if previous is not None else [None]):
+        known = state["files"] if image is not None else {}
+        lfs = littlefs_open(size_bytes, image)
+        try:
+            if image is None:
+                lfs.format()
+            lfs.mount()
+            written, removed = littlefs_apply(lfs, files, known)
+            lfs.unmount()
+            break
+        except littlefs.LittleFSError as e:
+            if image is None:
+                print(Fore.RED + f"❌ LittleFS: {e} – reduce data/ content or select a larger partition scheme.")
+                return False
+            print(Fore.YELLOW + f"⚠ LittleFS update failed ({e}) – rebuilding the image from scratch.")
+
+    img = bytes(lfs.context.buffer)
+    with open(out_path + ".tmp", "wb") as f:
+        f.write(img)
+    os.replace(out_path + ".tmp", out_path)
+    with open(state_path, "w", encoding="utf-8") as f:
+        json.dump({"geometry": geometry, "sha": hashlib.sha256(img).hexdigest(),
+                   "files": {rel: [size, mtime_ns] for rel, (_, size, mtime_ns) in files.items()}}, f)
+
+    how = "updated in place" if image is not None else "built from scratch"
+    print(Fore.CYAN + f"🧩 LittleFS: {len(files)} files, {written} written, {removed} removed – {how}")
+    return True
+
+
 # ---------------- MERGE + FQBN ----------------
 
 def merge_bin(bin_dir: str, ino_name: str, flash_size: str, chip: str) -> str:
@@ -421,44 +2050,120 @@ def merge_bin(bin_dir: str, ino_name: str, flash_size: str, chip: str) -> str:
     if chip == "esp32":
         # classic ESP32 – bootloader at 0x1000
         layout = [
-            (0x1000,  boot),
-            (0x8000,  part),
-            (0xE000,  BOOT_APP0),
-            (0x10000, app),
+            (0x1000,         boot),
+            (0x8000,         part),
+            (OTADATA_OFFSET, BOOT_APP0),
+            (APP_OFFSET,     app),
         ]
     elif chip in ("esp32s3", "esp32c3"):
         # ESP32-S3 / C3 – bootloader at 0x0000
         layout = [
-            (0x0000,  boot),
-            (0x8000,  part),
-            (0xE000,  BOOT_APP0),
-            (0x10000, app),
+            (0x0000,         boot),
+            (0x8000,         part),
+            (OTADATA_OFFSET, BOOT_APP0),
+            (APP_OFFSET,     app),
         ]
     else:
         # fallback – treat as classic ESP32
         layout = [
-            (0x1000,  boot),
-            (0x8000,  part),
-            (0xE000,  BOOT_APP0),
-            (0x10000, app),
+            (0x1000,         boot),
+            (0x8000,         part),
+            (OTADATA_OFFSET, BOOT_APP0),
+            (APP_OFFSET,     app),
         ]
 
-    # build string for esptool merge-bin
-    segs = []
+    if MERGE_BUILDER == "python":
+        merge_images(layout, merged, flash_size)
+        return merged
+
+    # argv for esptool merge-bin
+    cmd = [ESPTOOL, "--chip", chip, "merge-bin", "--flash-size", flash_size, "-o", merged]
     for off, path in layout:
-        segs.append(f"0x{off:X} \"{path}\"")
-    segs_str = " ".join(segs)
-
-    cmd = (
-        f'"{ESPTOOL}" --chip {chip} merge-bin '
-        f'--flash-size {flash_size} '
-        f'-o "{merged}" '
-        f'{segs_str}'
-    )
-    run(cmd)
+        cmd += [f"0x{off:X}", path]
+    run(cmd, kind="merge")
     return merged
 
 
+# fixed offsets of every scheme of the core (partition table at 0x8000)
+OTADATA_OFFSET = 0xE000
+APP_OFFSET     = 0x10000
+
+# bootloader header: flash size code in the upper nibble of byte 3
+FLASH_SIZE_CODES = {"1MB": 0x00, "2MB": 0x10, "4MB": 0x20, "8MB": 0x30,
+                    "16MB": 0x40, "32MB": 0x50, "64MB": 0x60, "128MB": 0x70}
+ESP_IMAGE_MAGIC = 0xE9
+
+
+def image_data_length(img: bytes) -> int:
+    """Length of an ESP image up to (not including) the appended SHA256 digest."""
+    pos = 8 + 16    # header + extended header
+    for _ in range(img[1]):
+        _, seg_len = struct.unpack_from("<II", img, pos)
+        pos += 8 + seg_len
+    # checksum byte sits at the end of the 16 B aligned block
+    return pos + 16 - pos % 16
+
+
+def patch_bootloader(img: bytes, flash_size: str) -> bytes:
+    """Sets the flash size in the bootloader header like 'merge-bin --flash-size'."""
+    if len(img) < 24 or img[0] != ESP_IMAGE_MAGIC or flash_size not in FLASH_SIZE_CODES:
+        print(Fore.YELLOW + "⚠ Bootloader does not look like an ESP image – flash size not changed.")
+        return img
+    out = bytearray(img)
+    out[3] = FLASH_SIZE_CODES[flash_size] | (out[3] & 0x0F)
+    if out[8 + 15] == 1:
+        # SHA256 appended – recalculate it over the modified image
+        length = image_data_length(out)
+        out[length:length + 32] = hashlib.sha256(out[:length]).digest()
+    return bytes(out)
+
+
+def merge_images(layout: list[tuple[int, str]], merged: str, flash_size: str) -> None:
+    """
+    In-process merge-bin: the inputs are memory-mapped and written at their
+    offsets, the gaps are 0xFF. Trailing erased bytes are trimmed (an erased
+    sector reads 0xFF anyway). Skipped when the inputs hash the same as last time.
+    """
+    stamp_path = merged + ".inputs"
+    h = hashlib.sha256(flash_size.encode())
+    maps = []
+    try:
+        for off, path in layout:
+            with open(path, "rb") as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b""
+            maps.append((off, path, m))
+            h.update(f"{off:X}|".encode())
+            h.update(hashlib.sha256(m).digest())
+        stamp = h.hexdigest()
+
+        try:
+            with open(stamp_path, "r", encoding="utf-8") as f:
+                if f.read() == stamp and os.path.exists(merged):
+                    print(Fore.GREEN + "✅ Merge inputs unchanged – reusing " + os.path.basename(merged))
+                    return
+        except OSError:
+            pass
+
+        out = bytearray()
+        for i, (off, path, m) in enumerate(maps):
+            out += b"\xff" * (off - len(out))
+            # layout starts with the bootloader
+            out += patch_bootloader(bytes(m), flash_size) if i == 0 else m
+    finally:
+        for _, _, m in maps:
+            if isinstance(m, mmap.mmap):
+                m.close()
+
+    full = len(out)
+    size = len(out.rstrip(b"\xff"))
+    size = (size + 3) & ~3    # write-flash works in 4 B words
+    with open(merged, "wb") as f:
+        f.write(out[:size])
+    with open(stamp_path, "w", encoding="utf-8") as f:
+        f.write(stamp)
+    print(Fore.GREEN + f"✅ Merged {size} B → {os.path.basename(merged)} ({full - size} B of trailing 0xFF trimmed)")
+
+
 def build_fqbn(cfg: dict) -> str:
     plat = cfg["PLATFORM"]
     if plat == "esp32":
@@ -502,114 +2207,1646 @@ def build_fqbn(cfg: dict) -> str:
     return fqbn
 
 
+# ---------------- BUILD CACHE ----------------
 
+# files that take part in the compilation (sketch root + src/ and other subfolders)
+SKETCH_SRC_EXT = (".ino", ".pde", ".h", ".hpp", ".c", ".cpp", ".cc", ".S", ".s", ".yaml")
 
-# ---------------- MAIN ----------------
+# artifacts restored into bin_out on a cache hit
+BUILD_ARTIFACTS = (".ino.bin", ".ino.bootloader.bin", ".ino.partitions.bin")
 
-def main():
-    global_start = time.time()
-    print(Fore.GREEN + "🚀 BF_mkspiffs START")
-    project = os.getcwd()
-    ino = find_ino(project)
-    ino_name = os.path.basename(ino)
-    cfg = parse_directives(ino)
 
-    # Detected chip (esp32, esp32s3, esp32c3)
-    target_chip = cfg["PLATFORM"]
+def hash_sketch_sources(project: str) -> str:
+    """Hashes the content of every source file in the sketch (data/ and bin_out/ excluded)."""
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(project):
+        dirs[:] = sorted(d for d in dirs if d not in ("data", "bin_out") and not d.startswith("."))
+        for f in sorted(files):
+            if not f.endswith(SKETCH_SRC_EXT):
+                continue
+            fp = os.path.join(root, f)
+            h.update(os.path.relpath(fp, project).replace("\\", "/").encode("utf-8") + b"\0")
+            with open(fp, "rb") as fh:
+                h.update(hashlib.sha256(fh.read()).digest())
+    return h.hexdigest()
 
-    build_path = os.path.join(BUILD_BASE, os.path.splitext(ino_name)[0])
-    os.makedirs(build_path, exist_ok=True)
 
-    data_src = os.path.join(project, "data")
-    data_dst = os.path.join(build_path, "data")
+def hash_libraries() -> str:
+    """
+    Cheap fingerprint of the libraries folder: path, size and mtime of every file.
+    Installing/updating a library changes at least one of them.
+    """
+    h = hashlib.sha256()
+    if not os.path.isdir(LIBRARIES):
+        return h.hexdigest()
+    for root, dirs, files in os.walk(LIBRARIES):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for f in sorted(files):
+            st = os.stat(os.path.join(root, f))
+            rel = os.path.relpath(os.path.join(root, f), LIBRARIES).replace("\\", "/")
+            h.update(f"{rel}|{st.st_size}|{st.st_mtime_ns}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def build_cache_key(project: str, cfg: dict, fqbn: str) -> str:
+    h = hashlib.sha256()
+    h.update(hash_sketch_sources(project).encode())
+    h.update(hash_libraries().encode())
+    for k in ("PART", "PSRAM", "PLATFORM"):
+        h.update(f"{k}={cfg[k]}\n".encode())
+    h.update(fqbn.encode())
+    # the core version is part of the BOOT_APP0 path (…\esp32\3.3.3\…)
+    h.update(BOOT_APP0.encode())
+    return h.hexdigest()[:32]
+
+
+def build_cache_restore(key: str, base: str, bin_out: str) -> bool:
+    """Copies cached artifacts into bin_out. Returns False on a miss."""
+    entry = os.path.join(BUILD_CACHE_DIR, key)
+    names = [f"{base}{suffix}" for suffix in BUILD_ARTIFACTS]
+    if not all(os.path.isfile(os.path.join(entry, n)) for n in names):
+        return False
+    os.makedirs(bin_out, exist_ok=True)
+    for name in names:
+        shutil.copy2(os.path.join(entry, name), os.path.join(bin_out, name))
+        print("→", name, "(cache)")
+    # LRU – the entry mtime is its last use
+    os.utime(entry)
+    return True
+
+
+def build_cache_store(key: str, base: str, build_path: str) -> None:
+    entry = os.path.join(BUILD_CACHE_DIR, key)
+    tmp = entry + ".tmp"
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    for suffix in BUILD_ARTIFACTS:
+        src = os.path.join(build_path, f"{base}{suffix}")
+        if not os.path.exists(src):
+            print(Fore.YELLOW + f"⚠ Build cache: missing {src} – not stored.")
+            shutil.rmtree(tmp)
+            return
+        shutil.copy2(src, tmp)
+    if os.path.exists(entry):
+        shutil.rmtree(entry)
+    os.replace(tmp, entry)
+    build_cache_evict()
+
+
+def build_cache_evict() -> None:
+    """Removes least recently used entries until the cache fits BUILD_CACHE_MAX_MB."""
+    entries = []
+    for name in os.listdir(BUILD_CACHE_DIR):
+        path = os.path.join(BUILD_CACHE_DIR, name)
+        if not os.path.isdir(path) or name.endswith(".tmp"):
+            continue
+        size = sum(e.stat().st_size for e in os.scandir(path) if e.is_file())
+        entries.append((os.path.getmtime(path), size, path))
+
+    limit = BUILD_CACHE_MAX_MB * 1024 * 1024
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        print(Fore.YELLOW + f"🗑 Build cache: evicted {os.path.basename(path)} ({size} B)")
+        log(f"BUILD CACHE EVICT {os.path.basename(path)} {size} B")
+
+
+def build_cache_report(key: str, hit: bool) -> None:
+    """Prints HIT/MISS and keeps cumulative hit/miss counters next to the cache."""
+    stats_path = os.path.join(BUILD_CACHE_DIR, "stats.json")
+    stats = {"hits": 0, "misses": 0}
+    try:
+        with open(stats_path, "r", encoding="utf-8") as f:
+            stats.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+    stats["hits" if hit else "misses"] += 1
+    with open(stats_path, "w", encoding="utf-8") as f:
+        json.dump(stats, f)
+
+    lookups = stats["hits"] + stats["misses"]
+    ratio = 100.0 * stats["hits"] / lookups
+    txt = (f"Build cache {'HIT' if hit else 'MISS'} [{key[:12]}] – "
+           f"hits {stats['hits']} / misses {stats['misses']} ({ratio:.0f}% hit rate)")
+    print((Fore.GREEN if hit else Fore.YELLOW) + "🗃 " + txt)
+    log(txt)
 
-    # calculate data size in project (before copying)
-    data_bytes = None
-    if os.path.isdir(data_src):
-        data_bytes = calc_dir_size(data_src)
-        print(Fore.CYAN + f"📏 Size of data/ directory: {data_bytes} B")
-    else:
-        print(Fore.YELLOW + "⚠ Missing data/ in the project.")
-        data_bytes = None
 
-    # select PartitionScheme based on PART + data size
-    auto_choose_partition(cfg, data_bytes)
+# ---------------- DIFFERENTIAL FLASH ----------------
 
-    # copy data to build_path
-    if os.path.isdir(data_src):
-        if os.path.exists(data_dst):
-            shutil.rmtree(data_dst)
-        shutil.copytree(data_src, data_dst)
-        print(Fore.GREEN + f"📂 data/ copied → {data_dst}")
+SECTOR_SIZE = 0x1000    # smallest erasable unit
+DIFF_BLOCK  = 0x10000   # coarse MD5 probe; only mismatching blocks are split into sectors
 
-    port = cfg["COM"] or detect_port()
 
-    # ERASE FLASH
-    if cfg["ERASE"]:
+@contextmanager
+def esptool_session(chip: str, port: str, flash_size: str, baud: int = BAUD, stub: bool = True):
+    """
+    One in-process esptool connection: sync, stub, baud change and flash attach.
+    stub=False stays in the ROM loader at its own baud rate (short commands only).
+    The chip is hard-reset when the block finishes without an error; the port
+    is closed by the loader's own context manager (the stub shares its port).
+    """
+    with detect_chip(port=port) as rom:
+        detected = rom.CHIP_NAME.lower().replace("-", "")
+        if detected != chip:
+            raise FatalError(f"Connected chip is {rom.CHIP_NAME}, PLATFORM expects {chip}.")
+        esp = rom
+        if stub:
+            esp = run_stub(rom)
+            if baud > esp.ESP_ROM_BAUD:
+                esp.change_baud(baud)
+        attach_flash(esp)
+        esp.flash_set_parameters(flash_size_bytes(flash_size))
+        yield esp
+        reset_chip(esp, "hard-reset")
+
+
+def changed_ranges(esp, offset: int, data: bytes) -> list[tuple[int, int]]:
+    """
+    Compares data with flash at offset and returns sector-aligned (start, end)
+    ranges of data that differ. Neighbouring changed sectors are joined.
+    """
+    ranges = []
+    for blk in range(0, len(data), DIFF_BLOCK):
+        chunk = data[blk:blk + DIFF_BLOCK]
+        if esp.flash_md5sum(offset + blk, len(chunk)) == hashlib.md5(chunk).hexdigest():
+            continue
+        for sec in range(blk, blk + len(chunk), SECTOR_SIZE):
+            part = data[sec:sec + SECTOR_SIZE]
+            if esp.flash_md5sum(offset + sec, len(part)) == hashlib.md5(part).hexdigest():
+                continue
+            if ranges and ranges[-1][1] == sec:
+                ranges[-1] = (ranges[-1][0], sec + len(part))
+            else:
+                ranges.append((sec, sec + len(part)))
+    return ranges
+
+
+def diff_flash(chip: str, port: str, flash_size: str, regions: list[tuple[int, str]],
+               baud: int = BAUD) -> None:
+    """Writes only the changed sectors of every (offset, image path) region."""
+    with esptool_session(chip, port, flash_size, baud) as esp:
+        total = 0
+        sent = 0
+        for offset, path in regions:
+            with open(path, "rb") as f:
+                data = f.read()
+            ranges = changed_ranges(esp, offset, data)
+            changed = sum(end - start for start, end in ranges)
+            total += len(data)
+            sent += changed
+            print(Fore.CYAN + f"🔍 0x{offset:06X} {os.path.basename(path)}: "
+                              f"{len(ranges)} changed range(s), {changed} / {len(data)} B")
+            if ranges:
+                write_flash(esp, [(offset + start, data[start:end]) for start, end in ranges])
+
+    txt = f"DIFF FLASH: sent {sent} B of {total} B ({total - sent} B skipped)"
+    print(Fore.GREEN + "✅ " + txt)
+    log(txt)
+
+
+# ---------------- SPARSE FILESYSTEM FLASH ----------------
+# A SPIFFS/LittleFS image is mostly unused 0xFF sectors. On erased flash they
+# already read as 0xFF, so only the populated extents of the image are written –
+# every sector up to its last non-blank 256 B page. An empty SPIFFS block holds
+# just the magic in its lookup page, so it costs one page instead of 4 KB.
+# The partition counts as erased when this run erased the chip (//ERASE=TRUE – not
+# in --watch iterations, they never erase); otherwise it is erased with
+# one 'erase-region' first (block erase, much faster than writing blank sectors),
+# which only pays off when enough of the image is blank.
+
+SPARSE_FS       = True         # write only the populated extents of the filesystem image
+SPARSE_PAGE     = 256          # flash program page – trailing blank pages of a sector are not written
+SPARSE_GAP      = 2048         # blank bytes between two extents that are written anyway (one region less)
+SPARSE_MAX_REGIONS = 128       # esptool arguments / flash_begin round trips per session
+SPARSE_MIN_SKIP = 256 * 1024   # blank bytes needed before an extra erase-region is worth its connection
+
+
+def image_extents(data: bytes, gap: int = SPARSE_GAP,
+                  max_regions: int = SPARSE_MAX_REGIONS) -> list[tuple[int, int]]:
+    """
+    (start, end) ranges of data that are not 0xFF. Starts are sector-aligned
+    (esptool erases whole sectors), ends are trimmed to the last non-blank page.
+    Ranges at most gap blank bytes apart are joined, then the closest ones
+    until no more than max_regions are left.
+    """
+    blank = b"\xff" * SPARSE_PAGE
+    extents = []
+    for sec in range(0, len(data), SECTOR_SIZE):
+        end = sec
+        for pg in range(sec, min(sec + SECTOR_SIZE, len(data)), SPARSE_PAGE):
+            page = data[pg:pg + SPARSE_PAGE]
+            if page != blank[:len(page)]:
+                end = pg + len(page)
+        if end == sec:
+            continue
+        if extents and sec - extents[-1][1] <= gap:
+            extents[-1] = (extents[-1][0], end)
+        else:
+            extents.append((sec, end))
+    while len(extents) > max_regions:
+        i = min(range(1, len(extents)), key=lambda i: extents[i][0] - extents[i - 1][1])
+        extents[i - 1:i + 1] = [(extents[i - 1][0], extents[i][1])]
+    return extents
+
+
+def sparse_fs_regions(offset: int, path: str, erased: bool) -> tuple[list[tuple[int, str]], int]:
+    """
+    Splits the filesystem image at offset into one file per populated extent
+    (next to the image, as <image>.0x<offset>.bin). Returns the (offset, path) regions
+    to write and the number of blank bytes skipped – ([(offset, path)], 0) when
+    the whole image is to be written.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    extents = image_extents(data)
+    skipped = len(data) - sum(end - start for start, end in extents)
+    if not skipped or (not erased and skipped < SPARSE_MIN_SKIP):
+        return [(offset, path)], 0
+
+    stem = os.path.splitext(path)[0]
+    for old in glob.glob(glob.escape(stem) + ".0x*.bin"):
+        os.remove(old)
+    regions = []
+    for start, end in extents:
+        part = f"{stem}.0x{offset + start:06X}.bin"
+        with open(part, "wb") as f:
+            f.write(data[start:end])
+        regions.append((offset + start, part))
+    return regions, skipped
+
+
+# ---------------- ON-CHIP VERIFY ----------------
+# //VERIFY=TRUE: after the write the chip computes the MD5 of every flashed
+# region itself and only the digests travel back – no readback of the data.
+# The ROM loader can hash, so the session skips the stub upload and baud change;
+# the expected digests are taken when the images are prepared (MERGE BIN, MK_FS).
+
+def file_md5(path: str) -> str:
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def note_digest(ctx: dict, path: str) -> None:
+    """Remembers the MD5 of a freshly prepared image for //VERIFY=TRUE."""
+    if ctx["cfg"]["VERIFY"]:
+        ctx["digests"][path] = file_md5(path)
+
+
+def verify_board(chip: str, port: str, flash_size: str, checks: list[tuple[int, str, str]],
+                 tag: str = "", output: str | None = None) -> bool:
+    """
+    Compares the on-chip MD5 of every (offset, image path, expected MD5) region.
+    Without the esptool package 'esptool verify-flash' is used (also digest
+    based, but with its own stub upload).
+    """
+    start = time.time()
+    with span("VERIFY", "flash", port=port, regions=len(checks)):
+        if not HAVE_ESPTOOL:
+            cmd = [ESPTOOL, "--chip", chip, "--port", port, "verify-flash"]
+            for off, path, _ in checks:
+                cmd += [f"0x{off:x}", path]
+            bad = ["verify-flash"] if run(cmd, False, output, kind="verify") != 0 else []
+        else:
+            try:
+                with esptool_session(chip, port, flash_size, stub=False) as esp:
+                    bad = [f"0x{off:06X} {os.path.basename(path)}" for off, path, md5 in checks
+                           if esp.flash_md5sum(off, os.path.getsize(path)) != md5]
+            except (FatalError, serial.SerialException) as e:
+                bad = [str(e)]
+        span_args(ok=not bad)
+
+    secs = time.time() - start
+    if bad:
+        print(Fore.RED + f"❌ Verify failed{tag}: {', '.join(bad)}")
+        log(f"VERIFY FAILED {', '.join(bad)}", port=port, duration=secs)
+        return False
+    print(Fore.GREEN + f"🔐 Verified {len(checks)} region(s) on-chip{tag} in {secs:.2f}s")
+    log(f"VERIFY OK {len(checks)} region(s)", port=port, duration=secs)
+    return True
+
+
+# ---------------- BAUD PROFILE ----------------
+# Every flash adds its result to BAUD_PROFILE, keyed by the USB adapter:
+# {"10C4:EA60": {"921600": {"ok": 12, "fail": 0, "bps": 81234}, ...}}
+# //BAUD=AUTO starts at the best known rate instead of the fixed BAUD.
+# Delete the file to profile an adapter from scratch.
+
+BAUD_LADDER    = (2000000, 1500000, 921600, 460800, 230400, 115200)
+BAUD_PROBE_UP  = 3    # clean flashes at the best rate before one step higher is tried
+BAUD_FALLBACKS = 2    # lower rates retried in the same run after a failed flash
+
+_baud_lock = threading.Lock()
+
+
+def port_usb_id(port: str) -> str:
+    """VID:PID of the USB adapter behind the port (the port name if it is not USB)."""
+    for p in serial.tools.list_ports.comports():
+        if p.device == port and p.vid is not None:
+            return f"{p.vid:04X}:{p.pid:04X}"
+    return port
+
+
+def load_baud_profile() -> dict:
+    try:
+        with open(BAUD_PROFILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def best_baud(rates: dict) -> int | None:
+    """Fastest measured rate with at most one failure per ten flashes."""
+    good = [(st["bps"], int(b)) for b, st in rates.items()
+            if st["ok"] and st["fail"] * 9 <= st["ok"]]
+    return max(good)[1] if good else None
+
+
+def baud_candidates(cfg: dict, usb_id: str) -> list[int]:
+    """
+    Rates to try for one flash, in order. A fixed //BAUD=<n> (or BAUD) is tried
+    alone; AUTO starts at the best known rate of the adapter – one step higher
+    once that rate is proven – and falls back to lower rates on failure.
+    """
+    if cfg["BAUD"] != "AUTO":
+        return [cfg["BAUD"] or BAUD]
+
+    with _baud_lock:
+        rates = load_baud_profile().get(usb_id, {})
+    start = best_baud(rates) or BAUD
+    ladder = sorted(set(BAUD_LADDER) | {start}, reverse=True)
+    i = ladder.index(start)
+    if i > 0 and str(ladder[i - 1]) not in rates and rates.get(str(start), {}).get("ok", 0) >= BAUD_PROBE_UP:
+        i -= 1
+    return ladder[i:i + 1 + BAUD_FALLBACKS]
+
+
+def record_baud(usb_id: str, baud: int, ok: bool, nbytes: int = 0, secs: float = 0.0) -> None:
+    """Adds one flash result; bps is a moving average of the clean flashes."""
+    with _baud_lock:
+        prof = load_baud_profile()
+        st = prof.setdefault(usb_id, {}).setdefault(str(baud), {"ok": 0, "fail": 0, "bps": 0})
+        if ok:
+            st["ok"] += 1
+            if nbytes and secs > 0:
+                bps = nbytes / secs
+                st["bps"] = round(bps if not st["bps"] else st["bps"] * 0.7 + bps * 0.3)
+        else:
+            st["fail"] += 1
+
+        os.makedirs(os.path.dirname(BAUD_PROFILE) or ".", exist_ok=True)
+        tmp = BAUD_PROFILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(prof, f, indent=1, sort_keys=True)
+        os.replace(tmp, BAUD_PROFILE)
+
+
+# ---------------- FLASH + FARM ----------------
+
+def flash_once(chip: str, port: str, baud: int, flash_size: str, regions: list[tuple[int, str]],
+               diff: bool, erase: bool, tag: str, output: str | None,
+               pre_erase: list[tuple[int, int]] = (), status: dict | None = None) -> bool:
+    """One flash attempt; status["transport"] is set when it failed on the serial link."""
+    if diff:
+        # DIFF FLASH – firmware + SPIFFS in one session, changed sectors only
+        try:
+            diff_flash(chip, port, flash_size, regions, baud)
+        except (FatalError, serial.SerialException) as e:
+            print(Fore.RED + f"❌ Differential flash failed{tag}: {e}")
+            log(f"ERROR {e}", port=port)
+            if status is not None and RE_TRANSPORT.search(str(e)):
+                status["transport"] = True
+            return False
+        return True
+
+    # SPARSE FS – the filesystem partition is erased first, its blank sectors are not written
+    for off, size in pre_erase:
+        cmd = [ESPTOOL, "--chip", chip, "--port", port, "--baud", str(baud),
+               "erase-region", f"0x{off:x}", f"0x{size:x}"]
+        if run(cmd, False, output, kind="erase", status=status) != 0:
+            return False
+    if not regions:
+        return True
+
+    # FLASH – erase + firmware + SPIFFS in a single esptool session
+    # (one reset/sync/stub upload/baud change instead of up to three)
+    cmd = [ESPTOOL, "--chip", chip, "--port", port, "--baud", str(baud), "write-flash"]
+    if erase:
+        cmd.append("--erase-all")
+    for off, path in regions:
+        cmd += [f"0x{off:x}", path]
+    return run(cmd, False, output, kind="flash_erase" if erase else "flash",
+               label=port if output else "", status=status) == 0
+
+
+def flash_board(cfg: dict, port: str, regions: list[tuple[int, str]], global_start: float,
+                diff: bool = False, erase: bool = False, output: str | None = None,
+                pre_erase: list[tuple[int, int]] = (), checks: list[tuple[int, str, str]] = ()) -> bool:
+    """
+    Flashes every (offset, image path) region to one port in one session
+    (preceded by an erase-region of every (offset, size) in pre_erase), then
+    lets the chip hash the (offset, image path, MD5) checks of //VERIFY=TRUE.
+    Returns False instead of exiting, so one bad board does not stop a farm run.
+    With //BAUD=AUTO a flash that failed on the serial link (RE_TRANSPORT, hung
+    tool) is retried at the next lower rate. Other failures – no board, busy
+    port, chip mismatch, verify mismatch – are neither retried nor held against
+    the baud rate in BAUD_PROFILE.
+    """
+    chip = cfg["PLATFORM"]
+    tag = f" [{port}]" if output else ""
+
+    # erase and MD5 probing time is not transfer time – only count plain writes
+    nbytes = 0 if diff or erase or pre_erase else sum(os.path.getsize(p) for _, p in regions)
+
+    usb_id = port_usb_id(port)
+    rates = baud_candidates(cfg, usb_id)
+    for i, baud in enumerate(rates):
+        if i:
+            print(Fore.YELLOW + f"↘ Flash failed at {rates[i - 1]} baud{tag} – retrying at {baud}")
         step_start = time.time()
-        run(f'"{ESPTOOL}" --chip {target_chip} --port {port} erase-flash')
-        print_step_time("ERASE FLASH", step_start, global_start)
+        status = {"transport": False}
+        with span("FLASH SESSION", "flash", port=port, usb=usb_id, baud=baud, diff=diff, erase=erase,
+                  regions={f"0x{off:X}": os.path.getsize(p) for off, p in regions},
+                  pre_erase={f"0x{off:X}": size for off, size in pre_erase}):
+            ok = flash_once(chip, port, baud, cfg["FLASH"], regions, diff, erase, tag, output, pre_erase, status)
+            secs = time.time() - step_start
+            if ok and checks:
+                ok = verify_board(chip, port, cfg["FLASH"], checks, tag, output)
+            span_args(ok=ok, bytes=nbytes if ok else 0, transport_error=status["transport"])
+        if ok or status["transport"]:
+            record_baud(usb_id, baud, ok, nbytes, secs)
+        if not ok:
+            if status["transport"]:
+                continue
+            break
+
+        if nbytes:
+            txt = f"{nbytes / secs / 1024:.1f} KB/s at {baud} baud ({usb_id})"
+            print(Fore.CYAN + f"📈 {txt}{tag}")
+            log(f"THROUGHPUT {txt}", port=port, baud=baud, bytes=nbytes, duration=secs)
+        if diff or tag:
+            print_step_time(("DIFF FLASH" if diff else "FLASH") + tag, step_start, global_start)
+        return True
+    forget_port(port)
+    return False
 
-    fqbn = build_fqbn(cfg)
 
-    # COMPILATION
-    step_start = time.time()
-    run(f'"{ARDUINO_CLI}" compile --fqbn "{fqbn}" --build-path "{build_path}" "{project}"')
-    print_step_time("COMPILATION", step_start, global_start)
+def flash_farm(cfg: dict, ports: list[str], regions: list[tuple[int, str]], global_start: float,
+               workers: int, diff: bool = False, erase: bool = False,
+               pre_erase: list[tuple[int, int]] = (), checks: list[tuple[int, str, str]] = ()) -> bool:
+    """
+    Flashes the same images to all ports concurrently. Tool output of every port
+    goes to bin_out/farm_<port>.log; a per-port status/timing table is printed.
+    """
+    # a blank //CUST image on erased flash leaves nothing to write, only the erase
+    log_dir = os.path.dirname(regions[-1][1]) if regions else os.getcwd()
+
+    def worker(port: str) -> tuple[str, bool, float]:
+        start = time.time()
+        output = os.path.join(log_dir, f"farm_{os.path.basename(port)}.log")
+        try:
+            ok = flash_board(cfg, port, regions, global_start,
+                             diff=diff, erase=erase, output=output,
+                             pre_erase=pre_erase, checks=checks)
+        except Exception as e:  # one broken port must not take the others down
+            print(Fore.RED + f"❌ [{port}] {e}")
+            log(f"ERROR {e}", port=port)
+            ok = False
+        return port, ok, time.time() - start
+
+    print(Fore.CYAN + f"🏭 Flashing {len(ports)} board(s) with {workers} worker(s) ...")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(worker, ports))
+
+    print(Style.BRIGHT + f"\n{'PORT':<16}{'STATUS':<8}{'TIME':>9}")
+    for port, ok, duration in results:
+        color = Fore.GREEN if ok else Fore.RED
+        print(color + f"{port:<16}{'OK' if ok else 'FAILED':<8}{duration:>8.2f}s")
+        log(f"FARM {'OK' if ok else 'FAILED'}", port=port, duration=duration)
+
+    failed = sum(1 for _, ok, _ in results if not ok)
+    if failed:
+        print(Fore.RED + f"❌ {failed} of {len(results)} board(s) failed – see farm_<port>.log in {log_dir}")
+    return failed == 0
+
+
+# ---------------- OTA ----------------
+# //OTA=<host>[:port],... uploads over Wi-Fi with the ArduinoOTA protocol of
+# espota.py: a UDP invitation "<cmd> <local port> <size> <md5>", optional MD5
+# challenge (OTA_PASSWORD), then the board connects back to a local TCP port
+# and acknowledges every chunk. The board checks the MD5 of the invitation before
+# it answers "OK" – with //VERIFY=TRUE that check is the verification (no readback
+# over the network). The board reboots after each image, so the
+# filesystem goes first and the app upload waits for it to come back.
+# ota_receiver.py is a stand-in board for testing.
+
+OTA_PORT        = 3232      # ArduinoOTA default port on ESP32
+OTA_PASSWORD    = ""        # ArduinoOTA.setPassword() of the firmware, "" = none
+OTA_CHUNK       = 1460      # one TCP segment per acknowledged chunk
+OTA_TIMEOUT     = 10        # s for an answer to the invitation / a chunk
+OTA_REBOOT_WAIT = 30        # s the board may take to come back after an upload
+OTA_CMD_FLASH, OTA_CMD_SPIFFS, OTA_CMD_AUTH = 0, 100, 200
+
+
+def ota_target(spec: str) -> tuple[str, int]:
+    host, _, port = spec.partition(":")
+    return host, int(port) if port else OTA_PORT
+
+
+def ota_invite(udp, remote: tuple[str, int], message: bytes, wait: float) -> str | None:
+    """Sends the invitation until the board answers (a rebooting board misses the first ones)."""
+    deadline = time.time() + wait
+    while True:
+        udp.sendto(message, remote)
+        try:
+            return udp.recv(64).decode("utf-8", errors="replace").strip()
+        except socket.timeout:
+            pass
+        except ConnectionError:
+            # Windows reports the ICMP "port unreachable" of a booting board here
+            time.sleep(1)
+        if time.time() > deadline:
+            return None
+
+
+def ota_upload(spec: str, command: int, path: str, wait: float = OTA_TIMEOUT) -> bool:
+    """One image to one board; prints the reason and returns False on failure."""
+    host, port = ota_target(spec)
+    with open(path, "rb") as f:
+        data = f.read()
+    md5 = hashlib.md5(data).hexdigest()
+    what = "filesystem" if command == OTA_CMD_SPIFFS else "app"
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listener, \
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp:
+        listener.bind(("0.0.0.0", 0))
+        listener.listen(1)
+        listener.settimeout(OTA_TIMEOUT)
+        udp.settimeout(1)
+        try:
+            remote = (socket.gethostbyname(host), port)
+        except OSError as e:
+            print(Fore.RED + f"❌ [{spec}] {e}")
+            return False
+
+        invitation = f"{command} {listener.getsockname()[1]} {len(data)} {md5}\n".encode()
+        reply = ota_invite(udp, remote, invitation, wait)
+        if reply is None:
+            print(Fore.RED + f"❌ [{spec}] no answer to the OTA invitation within {wait:.0f}s.")
+            return False
+        if reply.startswith("AUTH"):
+            nonce = reply.split()[1]
+            cnonce = hashlib.md5(f"{path}{len(data)}{md5}{remote[0]}".encode()).hexdigest()
+            passmd5 = hashlib.md5(OTA_PASSWORD.encode()).hexdigest()
+            result = hashlib.md5(f"{passmd5}:{nonce}:{cnonce}".encode()).hexdigest()
+            udp.settimeout(OTA_TIMEOUT)
+            udp.sendto(f"{OTA_CMD_AUTH} {cnonce} {result}\n".encode(), remote)
+            try:
+                reply = udp.recv(64).decode("utf-8", errors="replace").strip()
+            except socket.timeout:
+                reply = ""
+            if reply != "OK":
+                print(Fore.RED + f"❌ [{spec}] OTA authentication failed – check OTA_PASSWORD.")
+                return False
+        elif reply != "OK":
+            print(Fore.RED + f"❌ [{spec}] board refused the upload: {reply}")
+            return False
+
+        try:
+            conn, _ = listener.accept()
+        except socket.timeout:
+            print(Fore.RED + f"❌ [{spec}] board accepted but did not connect back (firewall?).")
+            return False
+
+        start = time.time()
+        with conn:
+            conn.settimeout(OTA_TIMEOUT)
+            sent = 0
+            shown = -1
+            answer = b""
+            try:
+                # stop-and-wait like espota.py: every chunk is answered with the byte count
+                while sent < len(data):
+                    conn.sendall(data[sent:sent + OTA_CHUNK])
+                    sent += min(OTA_CHUNK, len(data) - sent)
+                    answer = conn.recv(32)
+                    if not answer:
+                        break
+                    step = sent * 4 // len(data)
+                    if step > shown:
+                        shown = step
+                        print(Fore.CYAN + f"📶 [{spec}] {what}: {sent * 100 // len(data)}%")
+                # "OK" once the board has checked the MD5 and finished the update
+                while answer and b"OK" not in answer:
+                    answer = conn.recv(32)
+            except OSError as e:
+                print(Fore.RED + f"❌ [{spec}] {what} upload interrupted at {sent} B: {e}")
+                return False
+        secs = time.time() - start
+        if b"OK" not in answer:
+            print(Fore.RED + f"❌ [{spec}] {what} rejected by the board: {answer.decode(errors='replace')}")
+            return False
+
+    txt = f"{len(data) / secs / 1024:.1f} KB/s OTA {what} ({len(data)} B in {secs:.2f}s)"
+    print(Fore.CYAN + f"📈 [{spec}] {txt}")
+    log(f"OTA {txt}", host=spec, bytes=len(data), duration=secs, md5=md5)
+    span_args(bytes=len(data), bps=round(len(data) / secs) if secs else 0, md5=md5)
+    return True
+
+
+def ota_board(spec: str, uploads: list[tuple[int, str]], verify: bool = False) -> bool:
+    """
+    All images to one board, in order; after the first one the board has to
+    reboot. verify (//VERIFY=TRUE) reports the board's MD5 checks as the verification.
+    """
+    wait = OTA_TIMEOUT
+    for command, path in uploads:
+        with span("OTA UPLOAD", "ota", host=spec, image=os.path.basename(path)):
+            ok = ota_upload(spec, command, path, wait)
+            span_args(ok=ok)
+        if not ok:
+            return False
+        wait = OTA_REBOOT_WAIT
+    if verify:
+        txt = f"VERIFY OK: board checked the MD5 of {len(uploads)} image(s)"
+        print(Fore.GREEN + f"✅ [{spec}] {txt}")
+        log(txt, host=spec)
+    return True
+
+
+def ota_farm(hosts: list[str], uploads: list[tuple[int, str]], workers: int, verify: bool = False) -> bool:
+    """Uploads to all hosts concurrently and prints a per-host status/timing table."""
+    def worker(spec: str) -> tuple[str, bool, float]:
+        start = time.time()
+        try:
+            ok = ota_board(spec, uploads, verify)
+        except Exception as e:  # one unreachable board must not take the others down
+            print(Fore.RED + f"❌ [{spec}] {e}")
+            log(f"ERROR {e}", host=spec)
+            ok = False
+        return spec, ok, time.time() - start
+
+    print(Fore.CYAN + f"📡 OTA to {len(hosts)} board(s) with {workers} worker(s) ...")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(worker, hosts))
+
+    print(Style.BRIGHT + f"\n{'HOST':<24}{'STATUS':<8}{'TIME':>9}")
+    for spec, ok, duration in results:
+        color = Fore.GREEN if ok else Fore.RED
+        print(color + f"{spec:<24}{'OK' if ok else 'FAILED':<8}{duration:>8.2f}s")
+        log(f"OTA {'OK' if ok else 'FAILED'}", host=spec, duration=duration)
+    return all(ok for _, ok, _ in results)
+
+
+# ---------------- STAGE SCHEDULER ----------------
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable[[dict], None]
+    deps: tuple[str, ...] = ()
+    start: float = 0.0
+    end: float = 0.0
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+def run_stages(stages: list[Stage], ctx: dict) -> None:
+    """
+    Runs every stage as soon as all of its dependencies have finished.
+    An error in one stage (including sys.exit() from run()) is re-raised here
+    once the stages already running have completed.
+    """
+    if not stages:
+        return
+    names = {s.name for s in stages}
+    for s in stages:
+        for d in s.deps:
+            if d not in names:
+                raise ValueError(f"Stage '{s.name}' depends on unknown stage '{d}'")
+
+    def execute(stage: Stage) -> None:
+        stage.start = time.time()
+        try:
+            with span(stage.name, "stage"):
+                stage.func(ctx)
+        finally:
+            stage.end = time.time()
+
+    pending = list(stages)
+    done = set()
+    running = {}
+    with ThreadPoolExecutor(max_workers=len(stages)) as pool:
+        while pending or running:
+            ready = [s for s in pending if all(d in done for d in s.deps)]
+            for s in ready:
+                pending.remove(s)
+                running[pool.submit(execute, s)] = s
+            if not running:
+                raise ValueError("Stage graph has a cycle: " + ", ".join(s.name for s in pending))
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                s = running.pop(fut)
+                fut.result()
+                done.add(s.name)
+                print_step_time(s.name, s.start, ctx["global_start"])
+
+
+def print_critical_path(stages: list[Stage]) -> None:
+    """Prints the chain of stages that determined the wall-clock time."""
+    if not stages:
+        return
+    by_name = {s.name: s for s in stages}
+    path = [max(stages, key=lambda s: s.end)]
+    while path[-1].deps:
+        path.append(max((by_name[d] for d in path[-1].deps), key=lambda s: s.end))
+    path.reverse()
+
+    wall = max(s.end for s in stages) - min(s.start for s in stages)
+    busy = sum(s.duration for s in stages)
+    chain = " → ".join(f"{s.name} {s.duration:.2f}s" for s in path)
+    print(Back.WHITE + Fore.BLACK + Style.BRIGHT + f"🧭 Critical path: {chain}" + Style.RESET_ALL)
+    txt = f"Stages: {busy:.2f}s of work in {wall:.2f}s wall-clock (overlap saved {busy - wall:.2f}s)"
+    print(Fore.CYAN + txt)
+    log(f"CRITICAL PATH {chain} | {txt}")
+
+
+# ---------------- PIPELINE STAGES ----------------
+# Every stage reads/writes the shared ctx dict built in main().
+
+def stage_data_copy(ctx: dict) -> None:
+    data_dst = ctx["data_dst"]
+    st = sync_dir(ctx["data_src"], data_dst, data_dst + ".manifest.json", ctx["data_inv"])
+    txt = (f"data/ synced → {data_dst}: {st['copied']} copied ({st['bytes']} B moved), "
+           f"{st['linked']} hardlinked, {st['deleted']} deleted, {st['unchanged']} unchanged")
+    print(Fore.GREEN + "📂 " + txt)
+    log(txt)
+    span_args(bytes=st["bytes"])
+
 
-    # Copy bins to bin_out
-    bin_out = os.path.join(project, "bin_out")
-    os.makedirs(bin_out, exist_ok=True)
+def stage_port_discovery(ctx: dict) -> None:
+    cfg, args = ctx["cfg"], ctx["args"]
+    plat = cfg["PLATFORM"]
+    found = ctx["discovery"].result()
+    for f in found:
+        src = "cached" if f["cached"] else "probed"
+        print(Fore.CYAN + f"🔎 {f['port']}: {f['chip']} {f['mac']} ({src})")
+    matches = [f["port"] for f in found if f["chip"] == plat]
+
+    if args.farm:
+        ports = matches or detect_ports()
+        if not ports:
+            print(Fore.RED + "❌ No ESP ports found for --farm")
+            sys.exit(1)
+        print(Fore.GREEN + f"🔌 Farm ports: {', '.join(ports)}")
+        ctx["ports"] = ports
+        return
 
-    base = os.path.splitext(ino_name)[0]
+    if matches:
+        if len(matches) > 1:
+            print(Fore.YELLOW + f"⚠ {len(matches)} {plat} boards found – using {matches[0]} (set //COM= to choose).")
+        print(Fore.GREEN + f"🔌 {plat} detected: {matches[0]}")
+        ctx["port"] = matches[0]
+    elif found:
+        chips = ", ".join(f"{f['chip']} on {f['port']}" for f in found)
+        print(Fore.RED + f"❌ No {plat} connected ({chips}) – check //PLATFORM= or set //COM=.")
+        # the next run probes these ports again instead of trusting the cache
+        for f in found:
+            forget_port(f["port"])
+        sys.exit(1)
+    else:
+        print(Fore.YELLOW + "⚠ No port answered – guessing from the port description.")
+        ctx["port"] = detect_port()
+
+
+def stage_erase(ctx: dict) -> None:
+    run([ESPTOOL, "--chip", ctx["cfg"]["PLATFORM"], "--port", ctx["port"], "erase-flash"], kind="erase")
+    ctx["erased"] = True
+
+
+def compile_cmd(fqbn: str, build_path: str, project: str, jobs: int = 0) -> list[str]:
+    # jobs=0: arduino-cli uses every core
+    jobs_arg = ["--jobs", str(jobs)] if jobs else []
+    return [ARDUINO_CLI, "compile", "--fqbn", fqbn, "--build-path", build_path,
+            "--build-cache-path", CORE_CACHE_DIR, *jobs_arg, project]
+
+
+def copy_build_artifacts(build_path: str, base: str, dest: str, verbose: bool = True) -> None:
     for name in [f"{base}.ino.bootloader.bin", f"{base}.ino.partitions.bin", f"{base}.ino.bin"]:
         src = os.path.join(build_path, name)
         if os.path.exists(src):
-            shutil.copy2(src, os.path.join(bin_out, name))
-            print("→", name)
+            shutil.copy2(src, os.path.join(dest, name))
+            if verbose:
+                print("→", name)
+
+
+def stage_compile(ctx: dict) -> None:
+    run(compile_cmd(ctx["fqbn"], ctx["build_path"], ctx["project"]), kind="compile")
+    app = os.path.join(ctx["build_path"], f"{ctx['base']}.ino.bin")
+    if os.path.exists(app):
+        span_args(bytes=os.path.getsize(app))
+
+
+def stage_copy_bins(ctx: dict) -> None:
+    base = ctx["base"]
+    copy_build_artifacts(ctx["build_path"], base, ctx["bin_out"])
+
+    if ctx["cache_key"]:
+        build_cache_store(ctx["cache_key"], base, ctx["build_path"])
+
 
-    # --- SPIFFS via mkspiffs with CUST ---
-    spiffs_bin_path = None
-    spiffs_offset = None
+def stage_mk_fs(ctx: dict) -> None:
+    cfg = ctx["cfg"]
+    fs = cfg["FS"]
+    size_bytes, off = get_spiffs_region(cfg["PART"], cfg["PLATFORM"])
+    if not size_bytes or off is None:
+        print(Fore.RED + f"❌ Selected partition has no filesystem partition – {fs} has nowhere to go.")
+        return
+    fs_bin = os.path.join(ctx["bin_out"], f"{ctx['base']}.{fs.lower()}.bin")
+    if make_fs_image(ctx["data_src"], fs_bin, size_bytes, ctx["build_path"], ctx["data_inv"], fs) \
+            and os.path.exists(fs_bin):
+        ctx["fs_bin"] = fs_bin
+        ctx["fs_offset"] = off
+        ctx["fs_size"] = size_bytes
+        note_digest(ctx, fs_bin)
+        span_args(bytes=os.path.getsize(fs_bin))
+
+
+def stage_merge(ctx: dict) -> None:
+    ctx["merged"] = merge_bin(ctx["bin_out"], ctx["ino_name"], ctx["cfg"]["FLASH"], ctx["cfg"]["PLATFORM"])
+    note_digest(ctx, ctx["merged"])
+    span_args(bytes=os.path.getsize(ctx["merged"]))
+
+
+def stage_flash(ctx: dict) -> None:
+    cfg, args = ctx["cfg"], ctx["args"]
+
+    use_diff = cfg["DIFF"] and not cfg["ERASE"]
+    if cfg["DIFF"] and cfg["ERASE"]:
+        print(Fore.YELLOW + "ℹ ERASE=TRUE – DIFF ignored, flashing full images.")
+    if use_diff and not HAVE_ESPTOOL:
+        print(Fore.YELLOW + "⚠ DIFF=TRUE needs the esptool Python package (pip install esptool) – full flash.")
+        use_diff = False
+
+    regions = []
+    if ctx["merged"]:
+        regions.append((0x0, ctx["merged"]))
+    elif ctx["app_bin"]:
+        # watch mode, sources changed: app + otadata reset, bootloader/partitions untouched
+        regions += [(OTADATA_OFFSET, BOOT_APP0), (APP_OFFSET, ctx["app_bin"])]
+    # what //VERIFY=TRUE hashes: the whole fs image, blank sectors included
+    images = regions + ([(ctx["fs_offset"], ctx["fs_bin"])] if ctx["fs_bin"] else [])
+
+    pre_erase = []
+    if ctx["fs_bin"] and SPARSE_FS and not use_diff:
+        # after an erase in this run the partition is blank already, else one erase-region makes it so
+        erased = ctx["erased"] or ctx["erase_in_session"]
+        fs_regions, skipped = sparse_fs_regions(ctx["fs_offset"], ctx["fs_bin"], erased)
+        if skipped:
+            if not erased:
+                pre_erase.append((ctx["fs_offset"], ctx["fs_size"]))
+            written = sum(os.path.getsize(p) for _, p in fs_regions)
+            txt = (f"SPARSE {cfg['FS']}: {len(fs_regions)} extent(s), {written} of {written + skipped} B written, "
+                   f"{skipped} B blank skipped" + ("" if erased else " (erase-region first)"))
+            print(Fore.CYAN + f"🕳 {txt}")
+            log(txt, bytes=written, skipped=skipped)
+            span_args(fs_skipped=skipped)
+        regions += fs_regions
+    elif ctx["fs_bin"]:
+        if not use_diff:
+            print(Fore.CYAN + f"💾 {cfg['FS']} goes to offset 0x{ctx['fs_offset']:06X} in the same session.")
+        regions.append((ctx["fs_offset"], ctx["fs_bin"]))
+    elif ctx["merged"]:
+        print(Fore.YELLOW + f"⚠ Missing {cfg['FS']} image – filesystem step skipped.")
+
+    if not regions and not pre_erase:
+        print(Fore.YELLOW + "ℹ Nothing to flash.")
+        return
+
+    checks = []
+    if cfg["VERIFY"]:
+        checks = [(off, path, ctx["digests"].get(path) or file_md5(path)) for off, path in images]
+
+    if args.farm:
+        workers = args.workers or len(ctx["ports"])
+        ctx["ok"] = flash_farm(cfg, ctx["ports"], regions, ctx["global_start"], workers,
+                               diff=use_diff, erase=ctx["erase_in_session"], pre_erase=pre_erase, checks=checks)
+    elif not flash_board(cfg, ctx["port"], regions, ctx["global_start"],
+                         diff=use_diff, erase=ctx["erase_in_session"], pre_erase=pre_erase, checks=checks):
+        sys.exit(1)
+
+
+def stage_ota(ctx: dict) -> None:
+    cfg, args = ctx["cfg"], ctx["args"]
+    uploads = []
+    if ctx["fs_bin"]:
+        uploads.append((OTA_CMD_SPIFFS, ctx["fs_bin"]))
+    if ctx["app_bin"]:
+        uploads.append((OTA_CMD_FLASH, ctx["app_bin"]))
+    if not uploads:
+        print(Fore.YELLOW + "ℹ Nothing to upload.")
+        return
+    span_args(bytes=sum(os.path.getsize(p) for _, p in uploads) * len(cfg["OTA"]))
+    ctx["ok"] = ota_farm(cfg["OTA"], uploads, args.workers or len(cfg["OTA"]), cfg["VERIFY"])
+
+
+def build_pipeline(ctx: dict) -> list[Stage]:
+    """
+    Dependency graph of one run. Independent stages (erase vs. compile,
+    mkspiffs vs. compile, data copy) overlap; flashing waits for all inputs.
+    """
+    cfg = ctx["cfg"]
+    stages = []
+    flash_deps = ["MERGE BIN"]
+    port_deps = ()
+
+    if cfg["OTA"]:
+        return build_ota_pipeline(ctx)
+
+    # with //ASSETS= the processed mirror already exists (built in make_context)
+    if os.path.isdir(ctx["data_src"]) and not cfg["ASSETS"]:
+        stages.append(Stage("DATA COPY", stage_data_copy))
+
+    if ctx["discovery"]:
+        stages.append(Stage("PORT DISCOVERY", stage_port_discovery))
+        port_deps = ("PORT DISCOVERY",)
+        flash_deps.append("PORT DISCOVERY")
+
+    # A separate erase connection only pays off while the compiler is busy;
+    # otherwise (cache hit, farm workers) it is folded into the flash session.
+    if cfg["ERASE"]:
+        if ctx["cache_hit"] or ctx["args"].farm:
+            ctx["erase_in_session"] = True
+        else:
+            stages.append(Stage("ERASE FLASH", stage_erase, port_deps))
+            flash_deps.append("ERASE FLASH")
+
+    if ctx["cache_hit"]:
+        stages.append(Stage("MERGE BIN", stage_merge))
+    else:
+        stages.append(Stage("COMPILATION", stage_compile))
+        stages.append(Stage("COPY BINS", stage_copy_bins, ("COMPILATION",)))
+        stages.append(Stage("MERGE BIN", stage_merge, ("COPY BINS",)))
 
     if cfg["CUST"]:
-        size_bytes, off = get_spiffs_region(cfg["PART"])
-        if size_bytes and off is not None:
-            spiffs_bin_path = os.path.join(bin_out, f"{base}.spiffs.bin")
-            step_start = time.time()
-            if make_spiffs_image(data_src, spiffs_bin_path, size_bytes):
-                print_step_time("MK_SPIFFS", step_start, global_start)
-                spiffs_offset = off
+        stages.append(Stage(f"MK_{cfg['FS']}", stage_mk_fs))
+        flash_deps.append(f"MK_{cfg['FS']}")
+    else:
+        print(Fore.YELLOW + "ℹ Missing CUST – skipping the filesystem image.")
+
+    stages.append(Stage("FLASH", stage_flash, tuple(flash_deps)))
+    return stages
+
+
+def build_ota_pipeline(ctx: dict) -> list[Stage]:
+    """//OTA=: only the app and the fs image go over the network – no port, erase or merge."""
+    cfg = ctx["cfg"]
+    stages = []
+    ota_deps = []
+    if cfg["ERASE"]:
+        print(Fore.YELLOW + "ℹ ERASE=TRUE is not possible over OTA – ignored.")
+    if cfg["VERIFY"]:
+        print(Fore.CYAN + "ℹ VERIFY=TRUE over OTA: the board's MD5 check of every image is the verification.")
+
+    if os.path.isdir(ctx["data_src"]) and not cfg["ASSETS"]:
+        stages.append(Stage("DATA COPY", stage_data_copy))
+
+    ctx["app_bin"] = os.path.join(ctx["bin_out"], f"{ctx['base']}.ino.bin")
+    if not ctx["cache_hit"]:
+        stages.append(Stage("COMPILATION", stage_compile))
+        stages.append(Stage("COPY BINS", stage_copy_bins, ("COMPILATION",)))
+        ota_deps.append("COPY BINS")
+
+    if cfg["CUST"]:
+        stages.append(Stage(f"MK_{cfg['FS']}", stage_mk_fs))
+        ota_deps.append(f"MK_{cfg['FS']}")
+
+    stages.append(Stage("OTA", stage_ota, tuple(ota_deps)))
+    return stages
+
+
+# ---------------- WATCH MODE ----------------
+
+WATCH_INTERVAL = 0.5    # s between polls; a change is acted on once two polls agree
+
+
+def source_snapshot(project: str) -> dict[str, tuple[int, int]]:
+    """Size and mtime of every sketch source (same file set as hash_sketch_sources())."""
+    snap = {}
+    for root, dirs, files in os.walk(project):
+        dirs[:] = [d for d in dirs if d not in ("data", "bin_out") and not d.startswith(".")]
+        for f in files:
+            if f.endswith(SKETCH_SRC_EXT):
+                st = os.stat(os.path.join(root, f))
+                snap[os.path.relpath(os.path.join(root, f), project)] = (st.st_size, st.st_mtime_ns)
+    return snap
+
+
+def watch_snapshot(project: str, data_src: str) -> tuple[dict, DirInventory | None]:
+    return source_snapshot(project), scan_dir(data_src) if os.path.isdir(data_src) else None
+
+
+def wait_for_change(project: str, data_src: str, last: tuple) -> tuple:
+    """Polls until the snapshot differs from last and has been stable for one interval."""
+    prev = last
+    while True:
+        time.sleep(WATCH_INTERVAL)
+        try:
+            snap = watch_snapshot(project, data_src)
+        except OSError:
+            # a file vanished mid-scan (editor swap file) – next poll
+            continue
+        if snap != last and snap == prev:
+            return snap
+        prev = snap
+
+
+def watch_context(prev: dict, app: bool, data_inv: DirInventory | None, global_start: float) -> dict:
+    """ctx of an incremental iteration: config, partition, port and FQBN carried over."""
+    ctx = dict(prev, global_start=global_start, data_inv=data_inv, fs_bin=None, fs_offset=None,
+               fs_size=None, merged=None, app_bin=None, cache_key=None, cache_hit=False, erase_in_session=False,
+               erased=False, digests={}, ok=True)
+    cfg = ctx["cfg"]
+    if app and cfg["CACHE"]:
+        ctx["cache_key"] = build_cache_key(ctx["project"], cfg, ctx["fqbn"])
+        ctx["cache_hit"] = build_cache_restore(ctx["cache_key"], ctx["base"], ctx["bin_out"])
+        build_cache_report(ctx["cache_key"], ctx["cache_hit"])
+    return ctx
+
+
+def build_watch_pipeline(ctx: dict, app: bool, data: bool) -> list[Stage]:
+    """
+    Incremental iteration: sources changed → compile + app flash, data/ changed →
+    SPIFFS rebuild + SPIFFS flash. No erase, no merge.
+    """
+    stages = []
+    flash_deps = []
+    if app:
+        ctx["app_bin"] = os.path.join(ctx["bin_out"], f"{ctx['base']}.ino.bin")
+        if not ctx["cache_hit"]:
+            stages.append(Stage("COMPILATION", stage_compile))
+            stages.append(Stage("COPY BINS", stage_copy_bins, ("COMPILATION",)))
+            flash_deps.append("COPY BINS")
+    if data and ctx["data_inv"]:
+        if not ctx["cfg"]["ASSETS"]:
+            stages.append(Stage("DATA COPY", stage_data_copy))
+        if ctx["cfg"]["CUST"]:
+            stages.append(Stage(f"MK_{ctx['cfg']['FS']}", stage_mk_fs))
+            flash_deps.append(f"MK_{ctx['cfg']['FS']}")
+    if app or flash_deps:
+        if ctx["cfg"]["OTA"]:
+            stages.append(Stage("OTA", stage_ota, tuple(flash_deps)))
         else:
-            print(Fore.RED + "❌ Selected partition has no SPIFFS – mkspiffs has nowhere to write.")
+            stages.append(Stage("FLASH", stage_flash, tuple(flash_deps)))
+    return stages
+
+
+def watch(args, project: str, ino: str) -> None:
+    """
+    Resident edit-flash loop. Every change is classified: directives changed →
+    full pipeline, sources changed → compile + app flash, data/ changed → SPIFFS
+    rebuild + SPIFFS flash. Parsed config, partition index and port stay warm.
+    A failed iteration is folded into the next one; only Ctrl+C ends the loop.
+    """
+    data_src = os.path.join(project, "data")
+    snap = watch_snapshot(project, data_src)
+    raw_cfg = None
+    ctx = None
+    full, app, data = True, False, False
+    checked_app = None   # app size the PART=AUTO choice was last checked against
+
+    while True:
+        global_start = time.time()
+        _trace_spans.clear()
+        try:
+            if full:
+                raw_cfg = parse_directives(ino)
+                port = ctx["port"] if ctx else None
+                ports = ctx["ports"] if ctx else None
+                ctx = make_context(args, project, ino, dict(raw_cfg), global_start, port, ports)
+                stages = build_pipeline(ctx)
+            else:
+                data_inv = asset_inventory(ctx["cfg"], snap[1], ctx["build_path"]) if data else ctx["data_inv"]
+                ctx = watch_context(ctx, app, data_inv, global_start)
+                stages = build_watch_pipeline(ctx, app, data)
+            execute_pipeline(ctx, stages)
+            ok = ctx["ok"]
+        except SystemExit:
+            ok = False
+        except Exception as e:  # e.g. a file vanished under the build – the loop must survive it
+            print(Fore.RED + f"❌ {type(e).__name__}: {e}")
+            log(f"ERROR watch iteration {type(e).__name__}: {e}")
+            ok = False
+        if ok:
+            full, app, data = False, False, False
+        else:
+            print(Fore.RED + "❌ Iteration failed – it is repeated with the next change.")
+
+        print(Fore.CYAN + f"👀 Watching {project} – Ctrl+C to stop")
+        try:
+            new = wait_for_change(project, data_src, snap)
+            src_changed, data_changed = new[0] != snap[0], new[1] != snap[1]
+            snap = new
+
+            new_cfg = parse_directives(ino)
+            if ctx is None or new_cfg != raw_cfg or (new[1] is None) != (ctx["data_inv"] is None):
+                full = True
+            elif raw_cfg["PART"] == "AUTO" and new[1]:
+                # data/ or the last app build may have outgrown the selected scheme
+                last_app = os.path.join(ctx["bin_out"], f"{ctx['base']}.ino.bin")
+                app_bytes = os.path.getsize(last_app) if os.path.exists(last_app) else None
+                if data_changed or app_bytes != checked_app:
+                    probe = dict(raw_cfg)
+                    auto_choose_partition(probe, fs_usage(asset_inventory(raw_cfg, new[1], ctx["build_path"]),
+                                                          raw_cfg["FS"]), app_bytes)
+                    checked_app = app_bytes
+                    full = full or probe["PART"] != ctx["cfg"]["PART"]
+            app = app or src_changed
+            data = data or data_changed
+        except Exception as e:  # sketch or data/ mid-edit – the full pipeline sorts it out
+            print(Fore.RED + f"❌ Change detection failed – {type(e).__name__}: {e}")
+            log(f"ERROR watch classify {type(e).__name__}: {e}")
+            full = True
+
+        what = "directives/partition → full pipeline" if full else \
+            " + ".join(n for n, f in (("sources → compile + app flash", app),
+                                      ("data/ → SPIFFS rebuild + flash", data)) if f)
+        print(Fore.MAGENTA + f"\n🔁 Change detected: {what}")
+
+
+# ---------------- BUILD MATRIX ----------------
+# --matrix builds every //MATRIX= variant of the sketch, e.g.
+#   //MATRIX=ESP32,PART=DEFAULT
+#   //MATRIX=ESP32S3,PART=HA,FLASH=16MB,PSRAM=OPI
+# Each comma separated item is applied as a //directive on top of the sketch's
+# own directives. Variants compile concurrently (every arduino-cli is its own
+# process) with isolated build paths; compiled cores are shared via CORE_CACHE_DIR.
+
+_matrix_lock = threading.Lock()    # build, asset and SPIFFS page caches are not shared-writer safe (also --batch)
+
+
+def matrix_variants(cfg: dict) -> list[tuple[str, dict]]:
+    """(variant name, cfg) for every //MATRIX= line."""
+    variants = []
+    for spec in cfg["MATRIX"]:
+        vcfg = dict(cfg, MATRIX=[])
+        for item in spec.split(","):
+            if item.strip():
+                apply_directive(vcfg, "//" + item.strip())
+        name = spec.lower().replace("=", "-").replace(",", "_").replace(" ", "")
+        variants.append((name, vcfg))
+    return variants
+
+
+def build_variant(ctx: dict, name: str, vcfg: dict, out: str | None = None,
+                  build_path: str | None = None) -> dict:
+    """
+    Compile + merge (+ SPIFFS) of one variant into bin_out/matrix/<name>/ (or out).
+    ctx["compile_slot"] / ctx["disk_slot"] bound how many variants compile or
+    write images at the same time (--batch); ctx["jobs"] is arduino-cli --jobs.
+    """
+    base, project = ctx["base"], ctx["project"]
+    res = {"name": name, "fqbn": "", "ok": False, "cached": False, "compile": 0.0, "total": 0.0, "size": 0}
+    start = time.time()
+    out = out or os.path.join(ctx["bin_out"], "matrix", name)
+    os.makedirs(out, exist_ok=True)
+    build_log = os.path.join(out, "build.log")
+
+    with span(f"VARIANT {name}", "matrix"):
+        build_path = build_path or os.path.join(BUILD_BASE, base, "matrix", name)
+        os.makedirs(build_path, exist_ok=True)
+        data_inv = ctx["data_inv"]
+        if data_inv and vcfg["ASSETS"]:
+            with _matrix_lock:
+                data_inv = asset_inventory(vcfg, data_inv, build_path)
+        auto_choose_partition(vcfg, fs_usage(data_inv, vcfg["FS"]) if data_inv else None)
+        fqbn = res["fqbn"] = build_fqbn(vcfg)
+
+        key = None
+        if vcfg["CACHE"]:
+            with _matrix_lock:
+                key = build_cache_key(project, vcfg, fqbn)
+                res["cached"] = build_cache_restore(key, base, out)
+        if not res["cached"]:
+            with ctx["compile_slot"]:
+                t = time.time()
+                rc = run(compile_cmd(fqbn, build_path, project, ctx["jobs"]), False, build_log,
+                         kind="compile", label=name)
+                res["compile"] = time.time() - t
+            if rc:
+                print(Fore.RED + f"❌ [{name}] compilation failed – see {build_log}")
+                res["total"] = time.time() - start
+                return res
+            copy_build_artifacts(build_path, base, out, verbose=False)
+            if key:
+                with _matrix_lock:
+                    build_cache_store(key, base, build_path)
+
+        with ctx["disk_slot"]:
+            merged = merge_bin(out, ctx["ino_name"], vcfg["FLASH"], vcfg["PLATFORM"])
+            res["size"] = os.path.getsize(merged)
+
+            if vcfg["CUST"] and data_inv:
+                size_bytes, _ = get_spiffs_region(vcfg["PART"], vcfg["PLATFORM"])
+                if size_bytes:
+                    with _matrix_lock:
+                        make_fs_image(ctx["data_src"], os.path.join(out, f"{base}.{vcfg['FS'].lower()}.bin"),
+                                      size_bytes, build_path, data_inv, vcfg["FS"])
+        span_args(bytes=res["size"], fqbn=fqbn, cached=res["cached"])
+
+    res["ok"] = True
+    res["total"] = time.time() - start
+    return res
+
+
+def build_matrix(project: str, ino: str, cfg: dict, workers: int) -> bool:
+    """Builds all variants concurrently and prints a per-variant timing table."""
+    variants = matrix_variants(cfg)
+    if not variants:
+        print(Fore.RED + "❌ --matrix needs at least one //MATRIX= line in the .ino")
+        return False
+
+    ino_name = os.path.basename(ino)
+    data_src = os.path.join(project, "data")
+    ctx = {
+        "project": project,
+        "ino_name": ino_name,
+        "base": os.path.splitext(ino_name)[0],
+        "bin_out": os.path.join(project, "bin_out"),
+        "data_src": data_src,
+        # data/ is scanned once for all variants
+        "data_inv": scan_dir(data_src) if os.path.isdir(data_src) else None,
+        "compile_slot": nullcontext(),
+        "disk_slot": nullcontext(),
+        "jobs": 0,
+    }
+    if cfg["CACHE"]:
+        os.makedirs(BUILD_CACHE_DIR, exist_ok=True)
+
+    # warm the shared partition index before the workers use it
+    partition_catalog()
+    for _, vcfg in variants:
+        partition_menu(vcfg["PLATFORM"])
+
+    def worker(item: tuple[str, dict]) -> dict:
+        name, vcfg = item
+        try:
+            return build_variant(ctx, name, vcfg)
+        except (Exception, SystemExit) as e:  # one broken variant must not take the others down
+            print(Fore.RED + f"❌ [{name}] {e}")
+            log(f"ERROR {e}", variant=name)
+            return {"name": name, "fqbn": "", "ok": False, "cached": False, "compile": 0.0, "total": 0.0, "size": 0}
+
+    workers = workers or len(variants)
+    print(Fore.CYAN + f"🧮 Building {len(variants)} variant(s) with {workers} worker(s) ...")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(worker, variants))
+
+    print(Style.BRIGHT + f"\n{'VARIANT':<34}{'STATUS':<8}{'COMPILE':>9}{'TOTAL':>9}{'MERGED':>10}")
+    for r in results:
+        color = Fore.GREEN if r["ok"] else Fore.RED
+        status = ("CACHED" if r["cached"] else "OK") if r["ok"] else "FAILED"
+        print(color + f"{r['name']:<34}{status:<8}{r['compile']:>8.2f}s{r['total']:>8.2f}s{r['size']:>10}")
+        log(f"MATRIX {status}", variant=r["name"], fqbn=r["fqbn"], duration=r["total"])
+
+    print(Fore.CYAN + f"📁 Output: {os.path.join(ctx['bin_out'], 'matrix')}")
+    return all(r["ok"] for r in results)
+
+
+# ---------------- BATCH ----------------
+# --batch DIR builds every sketch folder under DIR (compile + merge + //CUST
+# image, no flashing), e.g. all yoRadio variants after a core update. The parsed
+# directives are cached per .ino (size/mtime, then content hash) in
+# DIRECTIVE_CACHE. Sketches run through build_variant() on one worker pool;
+# BATCH_COMPILES bounds the concurrent arduino-cli runs (each gets its share of
+# the cores via --jobs) and BATCH_DISK_JOBS the concurrent image writers.
+
+BATCH_SKIP_DIRS = ("data", "bin_out", "build", "node_modules")
+
+
+def find_sketches(root: str) -> list[str]:
+    """Main .ino of every sketch folder under root (a sketch's own subfolders are not searched)."""
+    inos = []
+    for path, dirs, _ in os.walk(root):
+        ino = sketch_ino(path)
+        if ino:
+            inos.append(ino)
+            dirs[:] = []
+            continue
+        dirs[:] = sorted(d for d in dirs if d not in BATCH_SKIP_DIRS and not d.startswith("."))
+    return inos
+
+
+def load_directive_cache() -> dict:
+    """{ino path: {"size", "mtime", "sha", "cfg"}} – dropped when facade.py itself changed."""
+    tool = os.stat(__file__).st_mtime_ns
+    try:
+        with open(DIRECTIVE_CACHE, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        if cache.get("tool") == tool:
+            return cache
+    except (OSError, ValueError):
+        pass
+    return {"tool": tool, "sketches": {}}
+
+
+def save_directive_cache(cache: dict) -> None:
+    os.makedirs(os.path.dirname(DIRECTIVE_CACHE) or ".", exist_ok=True)
+    tmp = DIRECTIVE_CACHE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(tmp, DIRECTIVE_CACHE)
+
+
+def cached_directives(ino: str, cache: dict) -> tuple[dict, bool]:
+    """parse_directives() through the cache; returns (cfg, cache hit)."""
+    st = os.stat(ino)
+    key = os.path.abspath(ino)
+    entry = cache["sketches"].get(key)
+    if entry and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime_ns:
+        return dict(entry["cfg"]), True
+
+    # touched but maybe not changed (checkout, copy) – the content decides
+    with open(ino, "rb") as f:
+        sha = hashlib.sha256(f.read()).hexdigest()
+    hit = bool(entry) and entry["sha"] == sha
+    cfg = entry["cfg"] if hit else parse_directives(ino)
+    cache["sketches"][key] = {"size": st.st_size, "mtime": st.st_mtime_ns, "sha": sha, "cfg": dict(cfg)}
+    return dict(cfg), hit
+
+
+def build_batch(root: str, workers: int) -> bool:
+    """Builds every sketch under root on one bounded pool; prints a table and sketches/minute."""
+    start = time.time()
+    inos = find_sketches(root)
+    if not inos:
+        print(Fore.RED + f"❌ --batch: no sketch folder under {root}")
+        return False
+
+    cache = load_directive_cache()
+    jobs = []
+    bases = {}
+    hits = 0
+    for ino in inos:
+        name = os.path.splitext(os.path.basename(ino))[0]
+        if name in bases:
+            # BUILD_BASE/<name> would be shared by both
+            print(Fore.YELLOW + f"⚠ {ino}: sketch name already used by {bases[name]} – skipped")
+            continue
+        bases[name] = ino
+        cfg, hit = cached_directives(ino, cache)
+        hits += hit
+        jobs.append((ino, cfg))
+    save_directive_cache(cache)
+    print(Fore.CYAN + f"📝 Directives: {hits} of {len(jobs)} sketch(es) from cache")
+
+    if any(cfg["CACHE"] for _, cfg in jobs):
+        os.makedirs(BUILD_CACHE_DIR, exist_ok=True)
+    partition_catalog()
+    for plat in {cfg["PLATFORM"] for _, cfg in jobs}:
+        partition_menu(plat)
+
+    compile_slot = threading.Semaphore(BATCH_COMPILES)
+    disk_slot = threading.Semaphore(BATCH_DISK_JOBS)
+    cpu_share = max(1, (os.cpu_count() or 1) // BATCH_COMPILES)
+
+    def worker(item: tuple[str, dict]) -> dict:
+        ino, cfg = item
+        project = os.path.dirname(ino)
+        ino_name = os.path.basename(ino)
+        base = os.path.splitext(ino_name)[0]
+        data_src = os.path.join(project, "data")
+        ctx = {
+            "project": project,
+            "ino_name": ino_name,
+            "base": base,
+            "bin_out": os.path.join(project, "bin_out"),
+            "data_src": data_src,
+            "data_inv": scan_dir(data_src) if os.path.isdir(data_src) else None,
+            "compile_slot": compile_slot,
+            "disk_slot": disk_slot,
+            "jobs": cpu_share,
+        }
+        try:
+            # same build path as a normal run – the next run of the sketch stays incremental
+            return build_variant(ctx, base, cfg, out=ctx["bin_out"], build_path=os.path.join(BUILD_BASE, base))
+        except (Exception, SystemExit) as e:  # one broken sketch must not take the others down
+            print(Fore.RED + f"❌ [{base}] {e}")
+            log(f"ERROR {e}", sketch=base)
+            return {"name": base, "fqbn": "", "ok": False, "cached": False, "compile": 0.0, "total": 0.0, "size": 0}
+
+    workers = workers or BATCH_COMPILES + BATCH_DISK_JOBS
+    print(Fore.CYAN + f"📚 Building {len(jobs)} sketch(es) with {workers} worker(s), "
+                      f"{BATCH_COMPILES} compile(s) x {cpu_share} job(s) ...")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(worker, jobs))
+
+    print(Style.BRIGHT + f"\n{'SKETCH':<34}{'STATUS':<8}{'COMPILE':>9}{'TOTAL':>9}{'MERGED':>10}")
+    for r in results:
+        color = Fore.GREEN if r["ok"] else Fore.RED
+        status = ("CACHED" if r["cached"] else "OK") if r["ok"] else "FAILED"
+        print(color + f"{r['name']:<34}{status:<8}{r['compile']:>8.2f}s{r['total']:>8.2f}s{r['size']:>10}")
+        log(f"BATCH {status}", sketch=r["name"], fqbn=r["fqbn"], duration=r["total"])
+
+    secs = time.time() - start
+    ok = sum(r["ok"] for r in results)
+    cached = sum(r["ok"] and r["cached"] for r in results)
+    rate = ok / secs * 60 if secs > 0 else 0.0
+    txt = (f"{ok} of {len(results)} sketch(es) in {secs:.1f}s – {rate:.1f} sketches/min "
+           f"({cached} from build cache, {len(results) - ok} failed)")
+    print((Fore.GREEN if ok == len(results) else Fore.YELLOW) + f"📊 {txt}")
+    log(f"BATCH {txt}", sketches=len(results), duration=secs)
+    return ok == len(results)
+
+
+# ---------------- MAIN ----------------
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="ESP32 Build and Flash Utility (Facade)")
+    ap.add_argument("--farm", action="store_true",
+                    help="flash every detected ESP port concurrently from one build")
+    ap.add_argument("--ports", help="comma separated port list for --farm")
+    ap.add_argument("--workers", type=int, default=0,
+                    help="parallel workers for --farm / --matrix / --batch "
+                         "(default: one per port/variant, BATCH_COMPILES + BATCH_DISK_JOBS for --batch)")
+    ap.add_argument("--report", action="store_true",
+                    help="print p50/p95 stage timings per board type from the run history and exit")
+    ap.add_argument("--watch", action="store_true",
+                    help="stay resident, rebuild and reflash only what changed")
+    ap.add_argument("--matrix", action="store_true",
+                    help="build every //MATRIX= variant concurrently (no flashing)")
+    ap.add_argument("--batch", metavar="DIR",
+                    help="build every sketch folder under DIR (no flashing)")
+    return ap.parse_args()
+
+
+def make_context(args, project: str, ino: str, cfg: dict, global_start: float,
+                 port: str | None = None, ports: list[str] | None = None) -> dict:
+    """
+    Everything one pipeline run needs: paths, data/ inventory, partition scheme,
+    port(s), FQBN and the build cache lookup. port/ports skip the detection.
+    """
+    # port(s): //COM= / --ports / the previous watch iteration, otherwise discovered in parallel
+    discovery = None
+    if cfg["OTA"]:
+        print(Fore.GREEN + f"📡 OTA target(s): {', '.join(cfg['OTA'])}")
+    elif args.farm:
+        if not ports and args.ports:
+            ports = args.ports.split(",")
+        if ports:
+            print(Fore.GREEN + f"🔌 Farm ports: {', '.join(ports)}")
+        else:
+            discovery = start_port_discovery(cfg["PLATFORM"])
     else:
-        print(Fore.YELLOW + "ℹ Missing CUST – mkspiffs unused, skipping SPIFFS.")
+        port = cfg["COM"] or port
+        if not port:
+            discovery = start_port_discovery(cfg["PLATFORM"])
 
-    # MERGE BIN
-    step_start = time.time()
-    merged = merge_bin(bin_out, ino_name, cfg["FLASH"], target_chip)
-    print_step_time("MERGE BIN", step_start, global_start)
+    ino_name = os.path.basename(ino)
+    base = os.path.splitext(ino_name)[0]
+    build_path = os.path.join(BUILD_BASE, base)
+    os.makedirs(build_path, exist_ok=True)
 
-    # FLASH FIRMWARE
-    step_start = time.time()
-    run(f'"{ESPTOOL}" --chip {target_chip} --port {port} --baud {BAUD} write-flash 0x0 "{merged}"')
-    print_step_time("FLASH FIRMWARE", step_start, global_start)
+    data_src = os.path.join(project, "data")
 
-    # FLASH SPIFFS
-    if spiffs_bin_path and spiffs_offset is not None and os.path.exists(spiffs_bin_path):
-        print(Fore.CYAN + f"💾 Flashing SPIFFS to offset 0x{spiffs_offset:06X} ...")
-        step_start = time.time()
-        run(
-            f'"{ESPTOOL}" --chip {target_chip} --port {port} --baud {BAUD} '
-            f'write-flash 0x{spiffs_offset:x} "{spiffs_bin_path}"'
-        )
-        print_step_time("FLASH SPIFFS", step_start, global_start)
+    # scan data/ once – size, partition choice, mirror and SPIFFS share the inventory
+    data_bytes = None
+    data_inv = None
+    if os.path.isdir(data_src):
+        data_inv = scan_dir(data_src)
+        data_bytes = data_inv.total_bytes
+        print(Fore.CYAN + f"📏 Size of data/ directory: {data_bytes} B ({data_inv.file_count} files)")
+        if cfg["ASSETS"]:
+            with span("ASSETS", "stage"):
+                data_inv = asset_inventory(cfg, data_inv, build_path)
+        data_bytes = fs_usage(data_inv, cfg["FS"])
     else:
-        print(Fore.YELLOW + "⚠ Missing SPIFFS image – SPIFFS step skipped.")
+        print(Fore.YELLOW + "⚠ Missing data/ in the project.")
+        data_bytes = None
+
+    # select PartitionScheme based on PART + data size (+ size of the last build of the app)
+    last_app = os.path.join(project, "bin_out", f"{base}.ino.bin")
+    app_bytes = os.path.getsize(last_app) if os.path.exists(last_app) else None
+    auto_choose_partition(cfg, data_bytes, app_bytes)
+    warn_no_ota(cfg)
+
+    fqbn = build_fqbn(cfg)
+
+    bin_out = os.path.join(project, "bin_out")
+    os.makedirs(bin_out, exist_ok=True)
 
-    total = time.time() - global_start
+    # BUILD CACHE
+    cache_key = None
+    cache_hit = False
+    if cfg["CACHE"]:
+        os.makedirs(BUILD_CACHE_DIR, exist_ok=True)
+        cache_key = build_cache_key(project, cfg, fqbn)
+        cache_hit = build_cache_restore(cache_key, base, bin_out)
+        build_cache_report(cache_key, cache_hit)
+
+    return {
+        "args": args,
+        "cfg": cfg,
+        "project": project,
+        "ino_name": ino_name,
+        "base": base,
+        "build_path": build_path,
+        "bin_out": bin_out,
+        "data_src": data_src,
+        "data_dst": os.path.join(build_path, "data"),
+        "data_inv": data_inv,
+        "fqbn": fqbn,
+        "port": port,
+        "ports": ports,
+        "discovery": discovery,
+        "cache_key": cache_key,
+        "cache_hit": cache_hit,
+        "fs_bin": None,
+        "fs_offset": None,
+        "fs_size": None,
+        "merged": None,
+        "app_bin": None,
+        "erase_in_session": False,
+        "erased": False,
+        "digests": {},
+        "ok": True,
+        "global_start": global_start,
+    }
+
+
+def execute_pipeline(ctx: dict, stages: list[Stage]) -> None:
+    """Runs the stages, exports the trace and prints the timing summary."""
+    try:
+        run_stages(stages, ctx)
+    except BaseException:
+        ctx["ok"] = False
+        raise
+    finally:
+        trace_export(ctx["base"], ctx["cfg"]["PLATFORM"], ctx["ok"], ctx["global_start"])
+    print_critical_path(stages)
+
+    total = time.time() - ctx["global_start"]
     print(Fore.GREEN + f"✅ Done. Total: {total:.2f}s")
-    log(f"TOTAL {total:.2f}s")
+    log("TOTAL", duration=total)
+
+
+def main():
+    args = parse_args()
+    if args.report:
+        trace_report()
+        return
+
+    global_start = time.time()
+    print(Fore.GREEN + "🚀 BF_mkspiffs START")
+
+    if args.batch:
+        ok = False
+        try:
+            ok = build_batch(args.batch, args.workers)
+        finally:
+            trace_export(os.path.basename(os.path.abspath(args.batch)), "batch", ok, global_start)
+        if not ok:
+            sys.exit(1)
+        return
+
+    project = os.getcwd()
+    ino = find_ino(project)
+
+    if args.watch:
+        try:
+            watch(args, project, ino)
+        except KeyboardInterrupt:
+            print(Fore.GREEN + "\n👋 Watch mode stopped.")
+        return
+
+    cfg = parse_directives(ino)
+    if args.matrix:
+        ok = False
+        try:
+            ok = build_matrix(project, ino, cfg, args.workers)
+        finally:
+            trace_export(os.path.splitext(os.path.basename(ino))[0], "matrix", ok, global_start)
+        total = time.time() - global_start
+        print(Fore.GREEN + f"✅ Done. Total: {total:.2f}s")
+        log("TOTAL", duration=total)
+        if not ok:
+            sys.exit(1)
+        return
+
+    ctx = make_context(args, project, ino, cfg, global_start)
+    execute_pipeline(ctx, build_pipeline(ctx))
+    if not ctx["ok"]:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,399 @@
+"""
+Facade orchestration benchmark
+--------------------------------------------------------------------------------
+Measures the Python-side overhead of facade.py apart from the toolchain.
+
+A synthetic sketch project (configurable data/ tree) and fake ARDUINO_CLI,
+ESPTOOL and MK_SPIFFS executables are generated in a temporary directory. The
+fakes write realistic artifact files and sleep for a configurable time, so no
+board and no Arduino installation are needed (plain Linux box is enough).
+
+Every Python-side stage is timed on its own (median of --runs), then the whole
+pipeline is run cold (build cache miss) and warm (cache hit); for those the
+time spent inside the fake tools is subtracted, leaving facade's own overhead.
+
+USAGE:
+  python facade_bench.py                         # run and compare with the baseline
+  python facade_bench.py --save-baseline         # run and store the results as baseline
+  python facade_bench.py --files 500 --size 4000000 --depth 4
+
+Exits with code 1 when a stage is slower than the baseline by more than
+--threshold (relative) AND --slack-ms (absolute, ignores timer noise).
+The baseline (facade_bench_baseline.json) is machine specific and not under
+version control: create it once per machine / CI runner with --save-baseline
+(on the commit to compare against); without it nothing can regress.
+"""
+import os
+import sys
+import json
+import random
+import shutil
+import struct
+import argparse
+import tempfile
+import statistics
+import time
+from contextlib import redirect_stdout
+
+from colorama import init, Fore, Style
+
+import facade as F
+
+init(autoreset=True)
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "facade_bench_baseline.json")
+
+
+# ---------------- FAKE TOOLCHAIN ----------------
+
+FAKE_ARDUINO_CLI = r'''
+import os, sys, time
+a = sys.argv
+build_path, project = a[a.index("--build-path") + 1], a[-1]
+base = [f for f in os.listdir(project) if f.endswith(".ino")][0][:-4]
+time.sleep(float(os.environ["BENCH_COMPILE_S"]))
+with open(os.path.join(os.environ["BENCH_ASSETS"], "bootloader.bin"), "rb") as f:
+    boot = f.read()
+outputs = {
+    ".ino.bin": os.urandom(int(os.environ["BENCH_APP_BYTES"])),
+    ".ino.bootloader.bin": boot,
+    ".ino.partitions.bin": os.urandom(3072),
+}
+for suffix, data in outputs.items():
+    with open(os.path.join(build_path, base + suffix), "wb") as f:
+        f.write(data)
+'''
+
+FAKE_ESPTOOL = r'''
+import os, sys, time
+a = sys.argv
+if "merge-bin" in a:
+    with open(a[a.index("-o") + 1], "wb") as f:
+        f.write(b"\xff" * 0x10000)
+else:
+    time.sleep(float(os.environ["BENCH_FLASH_S"]))
+'''
+
+FAKE_MKSPIFFS = r'''
+import sys
+a = sys.argv
+with open(a[-1], "wb") as f:
+    f.write(b"\xff" * int(a[a.index("-s") + 1]))
+'''
+
+PARTITION_CSVS = {
+    "default": [("nvs", "data", "nvs", 0x9000, 0x5000), ("otadata", "data", "ota", 0xE000, 0x2000),
+                ("app0", "app", "ota_0", 0x10000, 0x140000), ("app1", "app", "ota_1", 0x150000, 0x140000),
+                ("spiffs", "data", "spiffs", 0x290000, 0x160000), ("coredump", "data", "coredump", 0x3F0000, 0x10000)],
+    "min_spiffs": [("nvs", "data", "nvs", 0x9000, 0x5000), ("otadata", "data", "ota", 0xE000, 0x2000),
+                   ("app0", "app", "ota_0", 0x10000, 0x1E0000), ("app1", "app", "ota_1", 0x1F0000, 0x1E0000),
+                   ("spiffs", "data", "spiffs", 0x3D0000, 0x20000), ("coredump", "data", "coredump", 0x3F0000, 0x10000)],
+    "huge_app": [("nvs", "data", "nvs", 0x9000, 0x5000), ("otadata", "data", "ota", 0xE000, 0x2000),
+                 ("app0", "app", "ota_0", 0x10000, 0x300000), ("spiffs", "data", "spiffs", 0x310000, 0xE0000),
+                 ("coredump", "data", "coredump", 0x3F0000, 0x10000)],
+    "default_8MB": [("nvs", "data", "nvs", 0x9000, 0x5000), ("otadata", "data", "ota", 0xE000, 0x2000),
+                    ("app0", "app", "ota_0", 0x10000, 0x330000), ("app1", "app", "ota_1", 0x340000, 0x330000),
+                    ("spiffs", "data", "spiffs", 0x670000, 0x180000), ("coredump", "data", "coredump", 0x7F0000, 0x10000)],
+}
+
+BOARD_MENU = {"default": "default", "min_spiffs": "min_spiffs", "huge_app": "huge_app", "default_8MB": "default_8MB"}
+
+
+def write_script(path: str, body: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"#!{sys.executable}\n" + body)
+    os.chmod(path, 0o755)
+
+
+def fake_bootloader() -> bytes:
+    """Minimal ESP image (one segment, no SHA) – enough for the bootloader header patch."""
+    seg = os.urandom(0x4000)
+    img = bytearray([F.ESP_IMAGE_MAGIC, 1, 2, 0x20]) + struct.pack("<I", 0x40080000) + bytes(16)
+    img += struct.pack("<II", 0x3FFF0000, len(seg)) + seg
+    img += bytes(16 - len(img) % 16)
+    return bytes(img)
+
+
+def make_toolchain(root: str) -> None:
+    """Fake tools, core partitions dir (CSVs, boot_app0.bin, boards.txt) and an empty libraries dir."""
+    tools = os.path.join(root, "tools")
+    parts = os.path.join(root, "core", "tools", "partitions")
+    os.makedirs(tools)
+    os.makedirs(parts)
+    os.makedirs(os.path.join(root, "libraries"))
+
+    write_script(os.path.join(tools, "arduino-cli"), FAKE_ARDUINO_CLI)
+    write_script(os.path.join(tools, "esptool"), FAKE_ESPTOOL)
+    write_script(os.path.join(tools, "mkspiffs"), FAKE_MKSPIFFS)
+
+    for name, rows in PARTITION_CSVS.items():
+        with open(os.path.join(parts, name + ".csv"), "w", encoding="utf-8") as f:
+            f.write("# Name,   Type, SubType, Offset,  Size, Flags\n")
+            for row in rows:
+                f.write("{},{},{},0x{:X},0x{:X},\n".format(*row))
+    with open(os.path.join(parts, "boot_app0.bin"), "wb") as f:
+        f.write(b"\xff" * 0x1000 + b"\x01\x00\x00\x00" + b"\xff" * 0xFFC)
+    with open(os.path.join(root, "core", "boards.txt"), "w", encoding="utf-8") as f:
+        for opt, csv in BOARD_MENU.items():
+            app = max(size for _, kind, _, _, size in PARTITION_CSVS[csv] if kind == "app")
+            f.write(f"esp32.menu.PartitionScheme.{opt}.build.partitions={csv}\n")
+            f.write(f"esp32.menu.PartitionScheme.{opt}.upload.maximum_size={app}\n")
+
+    assets = os.path.join(root, "assets")
+    os.makedirs(assets)
+    with open(os.path.join(assets, "bootloader.bin"), "wb") as f:
+        f.write(fake_bootloader())
+
+
+def make_project(root: str, files: int, size: int, depth: int, seed: int = 1) -> str:
+    """Sketch dir 'bench' with a data/ tree of `files` files, `size` bytes in total, `depth` levels."""
+    rnd = random.Random(seed)
+    project = os.path.join(root, "bench")
+    data = os.path.join(project, "data")
+    os.makedirs(data)
+    with open(os.path.join(project, "bench.ino"), "w", encoding="utf-8") as f:
+        f.write("//PART=AUTO\n//CUST=TRUE\n//COM=BENCH\n//PLATFORM=ESP32\n\nvoid setup() {}\nvoid loop() {}\n")
+
+    per_file = max(1, size // max(1, files))
+    for i in range(files):
+        level = i % (depth + 1)
+        sub = os.path.join(data, *(f"d{(i >> k) % 3}" for k in range(level)))
+        os.makedirs(sub, exist_ok=True)
+        n = max(1, int(per_file * rnd.uniform(0.5, 1.5)))
+        with open(os.path.join(sub, f"f{i}.bin"), "wb") as f:
+            f.write(rnd.randbytes(n))
+    return project
+
+
+def point_facade_at(root: str) -> None:
+    """Redirects every path global of facade.py into the benchmark sandbox."""
+    F.ARDUINO_CLI = os.path.join(root, "tools", "arduino-cli")
+    F.ESPTOOL = os.path.join(root, "tools", "esptool")
+    F.MK_SPIFFS = os.path.join(root, "tools", "mkspiffs")
+    F.MK_LITTLEFS = os.path.join(root, "tools", "mklittlefs")
+    F.BOOT_APP0 = os.path.join(root, "core", "tools", "partitions", "boot_app0.bin")
+    F.LIBRARIES = os.path.join(root, "libraries")
+    F.BUILD_BASE = os.path.join(root, "builds")
+    F.BUILD_CACHE_DIR = os.path.join(F.BUILD_BASE, "_build_cache")
+    F.CORE_CACHE_DIR = os.path.join(F.BUILD_BASE, "_core_cache")
+    F.ASSET_CACHE_DIR = os.path.join(F.BUILD_BASE, "_asset_cache")
+    F.TRACE_DIR = os.path.join(F.BUILD_BASE, "_traces")
+    F.TRACE_HISTORY = os.path.join(F.BUILD_BASE, "_trace_history.jsonl")
+    F.BAUD_PROFILE = os.path.join(F.BUILD_BASE, "_baud_profile.json")
+    F.PORT_CACHE = os.path.join(F.BUILD_BASE, "_port_cache.json")
+    F.LOGFILE = os.path.join(root, "bench.log")
+    os.environ["BENCH_ASSETS"] = os.path.join(root, "assets")
+
+
+# ---------------- MEASUREMENT ----------------
+
+def measure(fn, runs: int, setup=None) -> float:
+    """Median wall time of fn() in ms; setup() runs untimed before every call."""
+    times = []
+    for _ in range(runs):
+        if setup:
+            setup()
+        with open(os.devnull, "w") as null, redirect_stdout(null):
+            start = time.perf_counter()
+            fn()
+            times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def reset_partition_memo() -> None:
+    F._partition_catalog = None
+    F._partition_menus = None
+
+
+def spiffs_cache_dir() -> str:
+    return os.path.join(F.BUILD_BASE, "bench", F.SPIFFS_CACHE_DIR)
+
+
+def reset_spiffs_cache() -> None:
+    F._spiffs_page_memo.clear()
+    shutil.rmtree(spiffs_cache_dir(), ignore_errors=True)
+
+
+def run_pipeline(project: str, cold: bool) -> float:
+    """One facade main() run; returns the wall time minus the time spent in tools, in ms."""
+    if cold:
+        shutil.rmtree(F.BUILD_BASE, ignore_errors=True)
+        shutil.rmtree(os.path.join(project, "bin_out"), ignore_errors=True)
+    F._trace_spans.clear()
+    cwd = os.getcwd()
+    argv = sys.argv
+    os.chdir(project)
+    sys.argv = ["facade.py"]
+    try:
+        start = time.perf_counter()
+        F.main()
+        wall = time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+        sys.argv = argv
+    # tool calls overlap (port probing, compile, erase) – subtract the time covered by any of them
+    tools = 0.0
+    covered_until = None
+    for start, end in sorted((sp["start"], sp["end"]) for sp in F._trace_spans if sp["cat"] == "cmd"):
+        if covered_until is not None and start < covered_until:
+            start = covered_until
+        if end > start:
+            tools += end - start
+        covered_until = end if covered_until is None else max(covered_until, end)
+    return (wall - tools) * 1000
+
+
+def bench(args, root: str) -> dict[str, float]:
+    make_toolchain(root)
+    project = make_project(root, args.files, args.size, args.depth)
+    point_facade_at(root)
+    os.environ["BENCH_COMPILE_S"] = str(args.compile_s)
+    os.environ["BENCH_FLASH_S"] = str(args.flash_s)
+    os.environ["BENCH_APP_BYTES"] = str(args.app_bytes)
+
+    ino = os.path.join(project, "bench.ino")
+    data = os.path.join(project, "data")
+    cfg = F.parse_directives(ino)
+    inv = F.scan_dir(data)
+    results = {}
+
+    results["directives"] = measure(lambda: F.parse_directives(ino), args.runs)
+    results["data scan"] = measure(lambda: F.scan_dir(data), args.runs)
+
+    mirror = os.path.join(root, "mirror")
+    manifest = mirror + ".manifest.json"
+
+    def clear_mirror():
+        shutil.rmtree(mirror, ignore_errors=True)
+        if os.path.exists(manifest):
+            os.remove(manifest)
+
+    results["data copy cold"] = measure(lambda: F.sync_dir(data, mirror, manifest, inv), args.runs, clear_mirror)
+    results["data copy warm"] = measure(lambda: F.sync_dir(data, mirror, manifest, inv), args.runs)
+
+    assets = os.path.join(root, "assets_out")
+
+    def clear_assets():
+        shutil.rmtree(assets, ignore_errors=True)
+        shutil.rmtree(F.ASSET_CACHE_DIR, ignore_errors=True)
+        if os.path.exists(assets + ".manifest.json"):
+            os.remove(assets + ".manifest.json")
+
+    results["assets cold"] = measure(lambda: F.prepare_assets("ALL", inv, assets), args.runs, clear_assets)
+    results["assets warm"] = measure(lambda: F.prepare_assets("ALL", inv, assets), args.runs)
+
+    def choose():
+        F.auto_choose_partition(dict(cfg), F.fs_usage(inv, "SPIFFS"), args.app_bytes)
+
+    results["partition cold"] = measure(choose, args.runs, reset_partition_memo)
+    results["partition warm"] = measure(choose, args.runs)
+
+    # resolve PART=AUTO like make_context() – the FQBN and cache key carry the chosen scheme
+    F.auto_choose_partition(cfg, F.fs_usage(inv, "SPIFFS"), args.app_bytes)
+    fqbn = F.build_fqbn(cfg)
+    fs_size, _ = F.get_spiffs_region(cfg["PART"], cfg["PLATFORM"])
+    if fs_size:
+        results["spiffs cold"] = measure(lambda: F.build_spiffs_image(data, fs_size, spiffs_cache_dir(), inv),
+                                         args.runs, reset_spiffs_cache)
+        results["spiffs warm"] = measure(lambda: F.build_spiffs_image(data, fs_size, spiffs_cache_dir(), inv), args.runs)
+
+    bins = os.path.join(root, "bins")
+    os.makedirs(bins)
+    with open(os.path.join(os.environ["BENCH_ASSETS"], "bootloader.bin"), "rb") as f:
+        boot = f.read()
+    for suffix, data_bytes in ((".ino.bin", os.urandom(args.app_bytes)),
+                               (".ino.bootloader.bin", boot),
+                               (".ino.partitions.bin", os.urandom(3072))):
+        with open(os.path.join(bins, "bench" + suffix), "wb") as f:
+            f.write(data_bytes)
+    stamp = os.path.join(bins, "bench_merged.bin.inputs")
+
+    def clear_stamp():
+        if os.path.exists(stamp):
+            os.remove(stamp)
+
+    def merge():
+        F.merge_bin(bins, "bench.ino", cfg["FLASH"], cfg["PLATFORM"])
+
+    results["merge cold"] = measure(merge, args.runs, clear_stamp)
+    results["merge warm"] = measure(merge, args.runs)
+
+    results["cache key"] = measure(lambda: F.build_cache_key(project, cfg, fqbn), args.runs)
+
+    with open(os.devnull, "w") as null, redirect_stdout(null):
+        cold = [run_pipeline(project, True) for _ in range(args.pipeline_runs)]
+        run_pipeline(project, False)
+        warm = [run_pipeline(project, False) for _ in range(args.pipeline_runs)]
+    results["pipeline cold"] = statistics.median(cold)
+    results["pipeline warm"] = statistics.median(warm)
+    return results
+
+
+# ---------------- REPORT ----------------
+
+def compare(results: dict[str, float], baseline: dict[str, float], threshold: float, slack_ms: float) -> list[str]:
+    """Prints the result table; returns the stages that regressed."""
+    regressed = []
+    print(Style.BRIGHT + f"\n{'STAGE':<18}{'NOW':>11}{'BASELINE':>11}{'CHANGE':>9}")
+    for name, ms in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<18}{ms:>9.2f}ms{'-':>11}{'':>9}")
+            continue
+        change = (ms - base) / base * 100 if base else 0.0
+        bad = ms > base * (1 + threshold) and ms - base > slack_ms
+        color = Fore.RED if bad else (Fore.GREEN if ms <= base else "")
+        print(color + f"{name:<18}{ms:>9.2f}ms{base:>9.2f}ms{change:>+8.1f}%")
+        if bad:
+            regressed.append(name)
+    return regressed
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Facade orchestration benchmark")
+    ap.add_argument("--files", type=int, default=200, help="number of files in data/")
+    ap.add_argument("--size", type=int, default=1_000_000, help="total size of data/ in bytes")
+    ap.add_argument("--depth", type=int, default=3, help="directory depth of data/")
+    ap.add_argument("--app-bytes", type=int, default=1_000_000, help="size of the fake firmware")
+    ap.add_argument("--compile-s", type=float, default=0.2, help="fake arduino-cli compile time")
+    ap.add_argument("--flash-s", type=float, default=0.1, help="fake esptool write-flash time")
+    ap.add_argument("--runs", type=int, default=5, help="repetitions per stage (median is used)")
+    ap.add_argument("--pipeline-runs", type=int, default=3, help="repetitions of the full pipeline")
+    ap.add_argument("--baseline", default=BASELINE, help="baseline JSON file")
+    ap.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    ap.add_argument("--threshold", type=float, default=0.25, help="allowed relative slowdown (0.25 = 25%%)")
+    ap.add_argument("--slack-ms", type=float, default=2.0, help="slowdowns below this many ms are ignored")
+    return ap.parse_args()
+
+
+def main():
+    args = parse_args()
+    root = tempfile.mkdtemp(prefix="facade_bench_")
+    print(Fore.GREEN + f"🏁 Facade benchmark – {args.files} files / {args.size} B / depth {args.depth} in {root}")
+    try:
+        results = bench(args, root)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    elif not args.save_baseline:
+        print(Fore.YELLOW + f"⚠ No baseline at {args.baseline} – nothing to compare against. "
+                            f"Run once with --save-baseline on the reference commit.")
+    regressed = compare(results, baseline, args.threshold, args.slack_ms)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({k: round(v, 3) for k, v in results.items()}, f, indent=2)
+        print(Fore.GREEN + f"💾 Baseline saved: {args.baseline}")
+    elif regressed:
+        print(Fore.RED + f"❌ Regression in: {', '.join(regressed)}")
+        sys.exit(1)
+    else:
+        print(Fore.GREEN + "✅ No regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Stand-in ArduinoOTA receiver
+--------------------------------------------------------------------------------
+Plays the board side of the ArduinoOTA protocol so //OTA= uploads of facade.py
+can be tried without hardware: answers the UDP invitation (with the MD5
+challenge when --password is set), connects back to the uploader, acknowledges
+every chunk, checks the MD5 and stores the image. After every upload it
+"reboots" (stops answering for --reboot seconds) like a real board.
+
+USAGE:
+  python ota_receiver.py                          # one board on port 3232
+  python ota_receiver.py --boards 4 --port 4000   # boards on ports 4000..4003
+  python ota_receiver.py --password secret --out received
+
+then, in the sketch:
+  //OTA=127.0.0.1:4000,127.0.0.1:4001,127.0.0.1:4002,127.0.0.1:4003
+
+Received images are written to --out as <port>_app.bin / <port>_fs.bin.
+"""
+import os
+import socket
+import hashlib
+import argparse
+import threading
+import time
+
+from colorama import init, Fore
+
+init(autoreset=True)
+
+CMD_FLASH, CMD_SPIFFS, CMD_AUTH = 0, 100, 200
+CHUNK = 1460
+
+
+def md5_hex(data: bytes) -> str:
+    return hashlib.md5(data).hexdigest()
+
+
+def invitation(udp, password: str) -> tuple[int, int, int, str, tuple] | None:
+    """Waits for one invitation (and authenticates it); returns (cmd, port, size, md5, sender)."""
+    msg, sender = udp.recvfrom(128)
+    try:
+        cmd, port, size, md5 = msg.decode("utf-8").split()
+        cmd, port, size = int(cmd), int(port), int(size)
+    except ValueError:
+        return None
+
+    if password:
+        nonce = md5_hex(os.urandom(16))
+        udp.sendto(f"AUTH {nonce}".encode(), sender)
+        udp.settimeout(10)
+        try:
+            reply, _ = udp.recvfrom(128)
+        finally:
+            udp.settimeout(None)
+        parts = reply.decode("utf-8", errors="replace").split()
+        expected = md5_hex(f"{md5_hex(password.encode())}:{nonce}:{parts[1] if len(parts) > 1 else ''}".encode())
+        if len(parts) != 3 or parts[0] != str(CMD_AUTH) or parts[2] != expected:
+            udp.sendto(b"Authentication Failed", sender)
+            print(Fore.RED + f"🔒 [{udp.getsockname()[1]}] authentication failed from {sender[0]}")
+            return None
+    udp.sendto(b"OK", sender)
+    return cmd, port, size, md5, sender
+
+
+def receive(host: str, port: int, size: int) -> bytes:
+    """Connects back to the uploader and reads the image, acknowledging every chunk."""
+    buf = bytearray()
+    with socket.create_connection((host, port), timeout=10) as conn:
+        while len(buf) < size:
+            chunk = conn.recv(CHUNK)
+            if not chunk:
+                break
+            buf += chunk
+            conn.sendall(str(len(chunk)).encode())
+        ok = len(buf) == size
+        conn.sendall(b"OK" if ok else b"ERROR[5]: Premature end")
+    return bytes(buf)
+
+
+def serve(port: int, out_dir: str, password: str = "", count: int = 0, reboot: float = 1.0) -> None:
+    """One board: handles uploads on port until count images arrived (0 = forever)."""
+    received = 0
+    while not count or received < count:
+        # the socket is closed while "rebooting" – invitations sent meanwhile are lost
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp:
+            udp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            udp.bind(("0.0.0.0", port))
+            inv = invitation(udp, password)
+        if inv is None:
+            continue
+        cmd, tcp_port, size, md5, sender = inv
+
+        what = "fs" if cmd == CMD_SPIFFS else "app"
+        start = time.time()
+        try:
+            data = receive(sender[0], tcp_port, size)
+        except OSError as e:
+            print(Fore.RED + f"❌ [{port}] {what}: {e}")
+            continue
+        secs = time.time() - start
+        if md5_hex(data) != md5:
+            print(Fore.RED + f"❌ [{port}] {what}: MD5 mismatch ({len(data)} of {size} B)")
+            continue
+
+        os.makedirs(out_dir, exist_ok=True)
+        with open(os.path.join(out_dir, f"{port}_{what}.bin"), "wb") as f:
+            f.write(data)
+        received += 1
+        print(Fore.GREEN + f"📥 [{port}] {what}: {size} B in {secs:.2f}s – rebooting")
+        time.sleep(reboot)
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Stand-in ArduinoOTA receiver")
+    ap.add_argument("--port", type=int, default=3232, help="UDP port of the first board")
+    ap.add_argument("--boards", type=int, default=1, help="number of boards (consecutive ports)")
+    ap.add_argument("--password", default="", help="OTA password (ArduinoOTA.setPassword)")
+    ap.add_argument("--out", default="ota_received", help="directory for the received images")
+    ap.add_argument("--count", type=int, default=0, help="exit after this many images per board (0 = never)")
+    ap.add_argument("--reboot", type=float, default=1.0, help="simulated reboot time in seconds")
+    return ap.parse_args()
+
+
+def main():
+    args = parse_args()
+    threads = []
+    for i in range(args.boards):
+        t = threading.Thread(target=serve, args=(args.port + i, args.out, args.password, args.count, args.reboot),
+                             daemon=True)
+        t.start()
+        threads.append(t)
+    print(Fore.CYAN + f"📡 {args.boards} stand-in board(s) on UDP {args.port}..{args.port + args.boards - 1}"
+                      f" – Ctrl+C to stop")
+    try:
+        for t in threads:
+            t.join()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
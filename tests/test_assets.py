@@ -0,0 +1,64 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("colorama")
+pytest.importorskip("serial")
+
+import facade as F  # noqa: E402
+
+JS = """function row(x) {
+    const html = `<li>
+      ${x.map(i => `  <b>${ {v: i}.v }</b>  `).join("")}
+
+    </li>  `;
+    // a ` in a comment
+    return html + "`" + '`';
+}
+"""
+
+
+def test_minify_keeps_template_literal_whitespace():
+    out = F.minify_asset(".js", JS.encode()).decode()
+    assert out == """function row(x) {
+const html = `<li>
+      ${x.map(i => `  <b>${ {v: i}.v }</b>  `).join("")}
+
+    </li>  `;
+// a ` in a comment
+return html + "`" + '`';
+}"""
+
+
+def test_cache_entry_depends_on_extension(tmp_path, monkeypatch):
+    monkeypatch.setattr(F, "ASSET_CACHE_DIR", str(tmp_path / "cache"))
+    src = tmp_path / "data"
+    src.mkdir()
+    body = b"{\n    \"a\": 1\n}\n"
+    (src / "x.json").write_bytes(body)
+    (src / "x.js").write_bytes(body)
+
+    out = F.prepare_assets("MIN", F.scan_dir(str(src)), str(tmp_path / "out"))
+    files = {rel: open(path, "rb").read() for rel, path, _, _ in out.files}
+    assert files["x.json"] == b'{"a":1}'
+    assert files["x.js"] == b"{\n\"a\": 1\n}"
+
+
+def test_gzip_replaces_only_web_served_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(F, "ASSET_CACHE_DIR", str(tmp_path / "cache"))
+    src = tmp_path / "data"
+    (src / "data").mkdir(parents=True)
+    page = b"<html>" + b"<p>hello world</p>\n" * 200 + b"</html>"
+    for name in ("index.html", "app.js", "style.css", "icon.svg"):
+        (src / name).write_bytes(page)
+    for name in ("config.json", "readme.txt", "feed.xml", "data/playlist.csv"):
+        (src / name).write_bytes(b'{"text": "' + b"a" * 4000 + b'"}')
+
+    out = F.prepare_assets("ALL", F.scan_dir(str(src)), str(tmp_path / "out"))
+    assert sorted(rel for rel, _, _, _ in out.files) == [
+        "app.js.gz", "config.json", "data/playlist.csv", "feed.xml", "icon.svg.gz",
+        "index.html.gz", "readme.txt", "style.css.gz",
+    ]
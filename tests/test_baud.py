@@ -0,0 +1,69 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("colorama")
+pytest.importorskip("serial")
+
+import facade as F  # noqa: E402
+
+USB = "10C4:EA60"
+
+
+@pytest.fixture
+def profile(tmp_path, monkeypatch):
+    path = tmp_path / "baud" / "profile.json"
+    monkeypatch.setattr(F, "BAUD_PROFILE", str(path))
+    monkeypatch.setattr(F, "BAUD", 921600)
+    return path
+
+
+def write(path, rates):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({USB: rates}))
+
+
+def test_fixed_baud_is_tried_alone(profile):
+    assert F.baud_candidates({"BAUD": 460800}, USB) == [460800]
+    assert F.baud_candidates({"BAUD": None}, USB) == [921600]
+
+
+def test_unknown_adapter_starts_at_default(profile):
+    assert F.baud_candidates({"BAUD": "AUTO"}, USB) == [921600, 460800, 230400]
+
+
+def test_best_baud_skips_unreliable_rates():
+    rates = {"2000000": {"ok": 5, "fail": 2, "bps": 190000},
+             "1500000": {"ok": 10, "fail": 1, "bps": 140000},
+             "921600": {"ok": 30, "fail": 0, "bps": 88000},
+             "460800": {"ok": 0, "fail": 0, "bps": 0}}
+    assert F.best_baud(rates) == 1500000
+    rates["1500000"]["fail"] = 2
+    assert F.best_baud(rates) == 921600
+    assert F.best_baud({}) is None
+
+
+def test_proven_rate_probes_one_step_up(profile):
+    write(profile, {"921600": {"ok": F.BAUD_PROBE_UP - 1, "fail": 0, "bps": 88000}})
+    assert F.baud_candidates({"BAUD": "AUTO"}, USB)[0] == 921600
+    write(profile, {"921600": {"ok": F.BAUD_PROBE_UP, "fail": 0, "bps": 88000}})
+    assert F.baud_candidates({"BAUD": "AUTO"}, USB) == [1500000, 921600, 460800]
+
+
+def test_tried_higher_rate_is_not_probed_again(profile):
+    write(profile, {"921600": {"ok": 10, "fail": 0, "bps": 88000},
+                    "1500000": {"ok": 1, "fail": 3, "bps": 120000}})
+    assert F.baud_candidates({"BAUD": "AUTO"}, USB) == [921600, 460800, 230400]
+
+
+def test_record_baud_counts_and_averages(profile):
+    F.record_baud(USB, 921600, True, 100000, 1.0)
+    F.record_baud(USB, 921600, True, 200000, 1.0)
+    F.record_baud(USB, 921600, False)
+    st = json.loads(profile.read_text())[USB]["921600"]
+    assert st == {"ok": 2, "fail": 1, "bps": round(100000 * 0.7 + 200000 * 0.3)}
+    assert not os.path.exists(str(profile) + ".tmp")
@@ -0,0 +1,91 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("colorama")
+pytest.importorskip("serial")
+
+import facade as F  # noqa: E402
+
+CFG = {"PART": "default", "PSRAM": "disabled", "PLATFORM": "esp32"}
+FQBN = "esp32:esp32:esp32:PartitionScheme=default"
+
+
+@pytest.fixture
+def sketch(tmp_path, monkeypatch):
+    monkeypatch.setattr(F, "BUILD_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(F, "LIBRARIES", str(tmp_path / "libraries"))
+    (tmp_path / "cache").mkdir()
+    project = tmp_path / "blink"
+    (project / "src").mkdir(parents=True)
+    (project / "data").mkdir()
+    (project / "bin_out").mkdir()
+    (project / "blink.ino").write_text("void setup() {}\nvoid loop() {}\n")
+    (project / "src" / "led.h").write_text("#define LED 2\n")
+    return project
+
+
+def build_dir(tmp_path, base: str, payload: bytes = b"app") -> str:
+    path = tmp_path / "build"
+    path.mkdir(exist_ok=True)
+    for suffix in F.BUILD_ARTIFACTS:
+        (path / f"{base}{suffix}").write_bytes(payload + suffix.encode())
+    return str(path)
+
+
+def test_key_follows_sources_not_data_or_outputs(sketch):
+    key = F.build_cache_key(str(sketch), CFG, FQBN)
+    (sketch / "data" / "index.html").write_text("<p>data/ is not compiled</p>")
+    (sketch / "bin_out" / "blink.ino.bin").write_bytes(b"\0")
+    (sketch / "notes.txt").write_text("not a source file")
+    assert F.build_cache_key(str(sketch), CFG, FQBN) == key
+
+    (sketch / "src" / "led.h").write_text("#define LED 4\n")
+    assert F.build_cache_key(str(sketch), CFG, FQBN) != key
+
+
+def test_key_follows_config_fqbn_and_libraries(sketch):
+    key = F.build_cache_key(str(sketch), CFG, FQBN)
+    assert F.build_cache_key(str(sketch), dict(CFG, PSRAM="opi"), FQBN) != key
+    assert F.build_cache_key(str(sketch), CFG, FQBN.replace("default", "huge_app")) != key
+
+    lib = sketch.parent / "libraries" / "Foo"
+    lib.mkdir(parents=True)
+    (lib / "Foo.h").write_text("// v1\n")
+    assert F.build_cache_key(str(sketch), CFG, FQBN) != key
+
+
+def test_store_then_restore(sketch, tmp_path):
+    key = F.build_cache_key(str(sketch), CFG, FQBN)
+    out = tmp_path / "out"
+    assert not F.build_cache_restore(key, "blink", str(out))
+
+    F.build_cache_store(key, "blink", build_dir(tmp_path, "blink"))
+    assert F.build_cache_restore(key, "blink", str(out))
+    assert (out / "blink.ino.bin").read_bytes() == b"app.ino.bin"
+    assert sorted(os.listdir(out)) == sorted(f"blink{s}" for s in F.BUILD_ARTIFACTS)
+
+
+def test_incomplete_build_is_not_stored(sketch, tmp_path):
+    build = build_dir(tmp_path, "blink")
+    os.remove(os.path.join(build, "blink.ino.partitions.bin"))
+    F.build_cache_store("k" * 32, "blink", build)
+    assert not F.build_cache_restore("k" * 32, "blink", str(tmp_path / "out"))
+    assert os.listdir(F.BUILD_CACHE_DIR) == []
+
+
+def test_evict_drops_least_recently_used(sketch, tmp_path, monkeypatch):
+    build = build_dir(tmp_path, "blink", os.urandom(130 * 1024))     # ~390 KB per entry
+    for i, key in enumerate("abcd"):
+        F.build_cache_store(key * 32, "blink", build)
+        os.utime(os.path.join(F.BUILD_CACHE_DIR, key * 32), (1000 + i, 1000 + i))
+    assert len(os.listdir(F.BUILD_CACHE_DIR)) == 4
+
+    # 1 MB holds two entries; 'a' was used last – it stays, the two oldest of the rest go
+    monkeypatch.setattr(F, "BUILD_CACHE_MAX_MB", 1)
+    F.build_cache_restore("a" * 32, "blink", str(tmp_path / "out"))
+    F.build_cache_evict()
+    assert sorted(os.listdir(F.BUILD_CACHE_DIR)) == ["a" * 32, "d" * 32]
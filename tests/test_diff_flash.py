@@ -0,0 +1,88 @@
+import hashlib
+import os
+import sys
+from contextlib import contextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("colorama")
+pytest.importorskip("serial")
+
+import facade as F  # noqa: E402
+
+SECTOR = F.SECTOR_SIZE
+
+
+class FakeFlash:
+    """The two loader calls differential flashing uses, over a bytearray."""
+
+    def __init__(self, size: int):
+        self.mem = bytearray(b"\xff" * size)
+        self.md5_calls = 0
+
+    def flash_md5sum(self, addr: int, size: int) -> str:
+        self.md5_calls += 1
+        return hashlib.md5(self.mem[addr:addr + size]).hexdigest()
+
+    def write(self, esp, pairs):
+        for addr, data in pairs:
+            self.mem[addr:addr + len(data)] = data
+
+
+def touch(data: bytearray, *sectors: int) -> None:
+    for sec in sectors:
+        data[sec * SECTOR + 17] ^= 0x55
+
+
+def test_unchanged_image_costs_one_md5_per_block():
+    flash = FakeFlash(0x40000)
+    image = os.urandom(0x30000)
+    flash.mem[0x10000:0x40000] = image
+    assert F.changed_ranges(flash, 0x10000, image) == []
+    assert flash.md5_calls == 0x30000 // F.DIFF_BLOCK
+
+
+def test_neighbouring_sectors_are_joined():
+    flash = FakeFlash(0x40000)
+    image = bytearray(os.urandom(0x30000))
+    flash.mem[0x10000:0x40000] = image
+    touch(image, 1, 2, 3, 7, 16, 17, 0x2F)
+    ranges = F.changed_ranges(flash, 0x10000, bytes(image))
+    assert ranges == [(1 * SECTOR, 4 * SECTOR), (7 * SECTOR, 8 * SECTOR),
+                      (16 * SECTOR, 18 * SECTOR), (0x2F * SECTOR, 0x30 * SECTOR)]
+
+
+def test_partial_last_sector():
+    flash = FakeFlash(0x20000)
+    image = bytearray(os.urandom(SECTOR + 100))
+    assert F.changed_ranges(flash, 0, bytes(image)) == [(0, SECTOR + 100)]
+
+
+def test_diff_flash_writes_only_changed_sectors(tmp_path, monkeypatch):
+    flash = FakeFlash(0x80000)
+    app = bytearray(os.urandom(0x20000))
+    fs = bytearray(os.urandom(0x10000))
+    flash.mem[0x10000:0x30000] = app
+    flash.mem[0x70000:0x80000] = fs
+    touch(app, 5)
+    (tmp_path / "app.bin").write_bytes(app)
+    (tmp_path / "fs.bin").write_bytes(fs)
+
+    writes = []
+
+    @contextmanager
+    def session(*args, **kwargs):
+        yield flash
+
+    def write_flash(esp, pairs):
+        writes.extend((addr, len(data)) for addr, data in pairs)
+        flash.write(esp, pairs)
+
+    monkeypatch.setattr(F, "esptool_session", session)
+    monkeypatch.setattr(F, "write_flash", write_flash, raising=False)
+    F.diff_flash("esp32", "COM1", "4MB",
+                 [(0x10000, str(tmp_path / "app.bin")), (0x70000, str(tmp_path / "fs.bin"))])
+    assert writes == [(0x10000 + 5 * SECTOR, SECTOR)]
+    assert flash.mem[0x10000:0x30000] == app
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("colorama")
+pytest.importorskip("serial")
+
+import facade as F  # noqa: E402
+
+
+def sketch_cfg(tmp_path, text):
+    ino = tmp_path / "sketch.ino"
+    ino.write_text(text, encoding="utf-8")
+    return F.parse_directives(str(ino))
+
+
+def test_variants_override_sketch_directives(tmp_path):
+    cfg = sketch_cfg(tmp_path, "//PART=MS\n//FLASH=8MB\n//CACHE=FALSE\n"
+                               "//MATRIX=ESP32,PART=DEFAULT\n"
+                               "//MATRIX=ESP32S3, PART=HA, FLASH=16MB, PSRAM=OPI\n"
+                               "void setup() {}\n")
+    variants = F.matrix_variants(cfg)
+    assert [name for name, _ in variants] == ["esp32_part-default", "esp32s3_part-ha_flash-16mb_psram-opi"]
+
+    (_, v1), (_, v2) = variants
+    assert v1["PLATFORM"] == "esp32" and v1["PART"] == F.norm_part_alias("DEFAULT")
+    assert v1["FLASH"] == F.norm_flash("8MB")    # inherited from the sketch
+    assert v2["PLATFORM"] == "esp32s3" and v2["PART"] == F.norm_part_alias("HA")
+    assert v2["FLASH"] == F.norm_flash("16MB") and v2["PSRAM"] == "OPI"
+    assert v1["CACHE"] is False and v2["CACHE"] is False
+    assert v1["MATRIX"] == [] and v2["MATRIX"] == []
+
+
+def test_variants_do_not_touch_the_sketch_cfg(tmp_path):
+    cfg = sketch_cfg(tmp_path, "//PLATFORM=ESP32C3\n//MATRIX=ESP32S3,FLASH=16MB\n")
+    before = dict(cfg, MATRIX=list(cfg["MATRIX"]))
+    F.matrix_variants(cfg)
+    assert cfg == before
+
+
+def test_empty_items_and_no_matrix(tmp_path):
+    cfg = sketch_cfg(tmp_path, "//MATRIX=ESP32C3,,PART=MS,\n")
+    [(_, vcfg)] = F.matrix_variants(cfg)
+    assert vcfg["PLATFORM"] == "esp32c3" and vcfg["PART"] == F.norm_part_alias("MS")
+    assert F.matrix_variants(sketch_cfg(tmp_path, "void loop() {}\n")) == []
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import struct
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("colorama")
+pytest.importorskip("serial")
+
+import facade as F  # noqa: E402
+
+
+def esp_image(segments: list[bytes], flash_code: int = 0x20, sha: bool = True) -> bytes:
+    """Minimal ESP image: header, extended header, segments, checksum, optional SHA256."""
+    img = bytearray([F.ESP_IMAGE_MAGIC, len(segments), 0x02, flash_code | 0x0F])
+    img += struct.pack("<I", 0x40080000)
+    ext = bytearray(16)
+    ext[15] = 1 if sha else 0
+    img += ext
+    for i, seg in enumerate(segments):
+        img += struct.pack("<II", 0x3FFF0000 + i * 0x1000, len(seg)) + seg
+    img += b"\x00" * (15 - len(img) % 16) + b"\xef"
+    if sha:
+        img += hashlib.sha256(img).digest()
+    return bytes(img)
+
+
+@pytest.mark.parametrize("sizes", [[4], [12, 20], [3, 5, 7]])
+def test_image_data_length_stops_before_sha(sizes):
+    img = esp_image([b"\x11" * n for n in sizes])
+    assert F.image_data_length(img) == len(img) - 32
+    assert F.image_data_length(img) % 16 == 0
+
+
+def test_patch_bootloader_sets_size_and_recomputes_sha():
+    img = esp_image([b"\x11" * 12, b"\x22" * 20], flash_code=0x20)
+    out = F.patch_bootloader(img, "16MB")
+    assert out[3] == F.FLASH_SIZE_CODES["16MB"] | 0x0F
+    n = F.image_data_length(out)
+    assert out[n:n + 32] == hashlib.sha256(out[:n]).digest()
+    assert out[n:n + 32] != img[n:n + 32]
+    assert len(out) == len(img)
+
+
+def test_patch_bootloader_without_sha_only_changes_header():
+    img = esp_image([b"\x11" * 12], sha=False)
+    out = F.patch_bootloader(img, "8MB")
+    assert out[3] == F.FLASH_SIZE_CODES["8MB"] | 0x0F
+    assert out[:3] == img[:3] and out[4:] == img[4:]
+
+
+def test_patch_bootloader_leaves_foreign_data_alone():
+    blob = b"\x00" * 64
+    assert F.patch_bootloader(blob, "4MB") == blob
+    img = esp_image([b"\x11" * 4])
+    assert F.patch_bootloader(img, "3MB") == img
+
+
+def test_merge_images_layout_padding_and_trim(tmp_path, capsys):
+    boot = esp_image([b"\x11" * 40], flash_code=0x20)
+    part = b"\xaa\x50" + b"\x01" * 30
+    app = b"\x33" * 100 + b"\xff" * 64
+    paths = []
+    for name, data in (("boot", boot), ("part", part), ("app", app)):
+        p = tmp_path / f"{name}.bin"
+        p.write_bytes(data)
+        paths.append(str(p))
+    layout = [(0x1000, paths[0]), (0x8000, paths[1]), (0x10000, paths[2])]
+    merged = str(tmp_path / "merged.bin")
+
+    F.merge_images(layout, merged, "8MB")
+    out = open(merged, "rb").read()
+    assert out[:0x1000] == b"\xff" * 0x1000
+    assert out[0x1000:0x1000 + len(boot)] == F.patch_bootloader(boot, "8MB")
+    assert out[0x1000 + len(boot):0x8000] == b"\xff" * (0x8000 - 0x1000 - len(boot))
+    assert out[0x8000:0x8000 + len(part)] == part
+    assert out[0x10000:] == b"\x33" * 100   # trailing 0xFF trimmed
+    assert len(out) % 4 == 0
+
+    capsys.readouterr()
+    F.merge_images(layout, merged, "8MB")
+    assert "unchanged" in capsys.readouterr().out
+    F.merge_images(layout, merged, "4MB")
+    assert "unchanged" not in capsys.readouterr().out
+    assert open(merged, "rb").read()[0x1003] == F.FLASH_SIZE_CODES["4MB"] | 0x0F
@@ -0,0 +1,81 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("colorama")
+pytest.importorskip("serial")
+
+import facade as F  # noqa: E402
+
+# 4 MB schemes of the core (trimmed to the columns facade reads)
+SCHEMES = {
+    "default": ["app0, app, ota_0, 0x10000, 0x140000", "app1, app, ota_1, 0x150000, 0x140000",
+                "spiffs, data, spiffs, 0x290000, 0x160000"],
+    "min_spiffs": ["app0, app, ota_0, 0x10000, 0x1E0000", "app1, app, ota_1, 0x1F0000, 0x1E0000",
+                   "spiffs, data, spiffs, 0x3D0000, 0x20000"],
+    "huge_app": ["app0, app, ota_0, 0x10000, 0x300000", "spiffs, data, spiffs, 0x310000, 0xE0000"],
+    "no_ota": ["app0, app, factory, 0x10000, 0x200000", "spiffs, data, spiffs, 0x210000, 0x1E0000"],
+}
+
+
+@pytest.fixture(autouse=True)
+def partitions(tmp_path, monkeypatch):
+    part_dir = tmp_path / "tools" / "partitions"
+    part_dir.mkdir(parents=True)
+    for name, rows in SCHEMES.items():
+        lines = ["nvs, data, nvs, 0x9000, 0x5000", "otadata, data, ota, 0xe000, 0x2000", *rows,
+                 "coredump, data, coredump, 0x3F0000, 0x10000"]
+        (part_dir / f"{name}.csv").write_text("\n".join(lines) + "\n")
+    monkeypatch.setattr(F, "BOOT_APP0", str(part_dir / "boot_app0.bin"))
+    monkeypatch.setattr(F, "_partition_catalog", None)
+    monkeypatch.setattr(F, "_partition_menus", None)
+
+
+def choose(data_bytes: int | None, app_bytes: int | None = None, ota: list[str] = ()) -> str:
+    cfg = {"PART": "AUTO", "PLATFORM": "esp32", "FLASH": "4MB", "FS": "SPIFFS", "OTA": list(ota)}
+    F.auto_choose_partition(cfg, data_bytes, app_bytes)
+    return cfg["PART"]
+
+
+def test_csv_ota_slots():
+    catalog = F.partition_catalog()
+    assert catalog["default"].ota and catalog["min_spiffs"].ota
+    assert not catalog["huge_app"].ota and not catalog["no_ota"].ota
+
+
+def test_tightest_scheme_without_ota():
+    assert choose(0xD0000, 0x100000) == "huge_app"
+
+
+def test_ota_excludes_schemes_without_slots(capsys):
+    assert choose(0xD0000, 0x100000, ota=["192.168.1.50"]) == "default"
+    assert choose(0x150000, 0x100000, ota=["192.168.1.50"]) == "default"
+    # more data than any OTA scheme holds – fallback, no huge_app / no_ota
+    assert choose(0x1C0000, 0x100000, ota=["192.168.1.50"]) == "default"
+    assert "No partition scheme fits" in capsys.readouterr().out
+
+
+def test_explicit_scheme_without_ota_warns(capsys):
+    cfg = {"PART": "HA", "PLATFORM": "esp32", "FLASH": "4MB", "FS": "SPIFFS", "OTA": ["esp.local"]}
+    F.auto_choose_partition(cfg, 0x1000)
+    F.warn_no_ota(cfg)
+    assert cfg["PART"] == "huge_app"
+    assert "no OTA slots" in capsys.readouterr().out
+
+
+def test_margin_keeps_room_in_the_filesystem():
+    # min_spiffs (128 KB): 2 free blocks are the minimum working room
+    assert choose(0x20000 - 3 * 4096, 0x100000) == "min_spiffs"
+    assert choose(0x20000 - 2 * 4096, 0x100000) == "huge_app"
+    # large data: 5 % of it (0x130000 B data in 0x160000 B default → 96 KB free, 5 % = 62 KB)
+    assert choose(0x130000, 0x100000) == "default"
+    assert choose(0x158000, 0x100000) == "no_ota"
+
+
+def test_unknown_app_size_keeps_default_app_room():
+    # first build: no scheme with less app room than 'default' (huge_app/no_ota have more)
+    assert choose(0x10000) == "min_spiffs"
+    assert choose(None) == "default"
@@ -0,0 +1,64 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("colorama")
+pytest.importorskip("serial")
+
+import facade as F  # noqa: E402
+
+
+def port(device: str, vid: int | None, description: str = "n/a", serial_number: str | None = None):
+    return SimpleNamespace(device=device, vid=vid, pid=0x7523, description=description,
+                           serial_number=serial_number, location=None)
+
+
+@pytest.fixture
+def ports(tmp_path, monkeypatch):
+    monkeypatch.setattr(F, "PORT_CACHE", str(tmp_path / "ports.json"))
+    listed = [
+        port("/dev/ttyACM0", 0x2341, "Arduino Uno"),         # another MCU – must not be reset
+        port("/dev/ttyUSB0", 0x1A86, "USB Serial"),          # CH340
+        port("/dev/ttyUSB1", 0x0403, "FT232R USB UART"),     # FTDI, e.g. a 3D printer
+        port("/dev/ttyS0", None),
+    ]
+    monkeypatch.setattr(F.serial.tools.list_ports, "comports", lambda: listed)
+    chips = {"/dev/ttyUSB0": "esp32"}
+    probed = []
+
+    def probe(dev):
+        probed.append(dev)
+        return (chips[dev], "aa:bb:cc:dd:ee:ff") if dev in chips else None
+
+    monkeypatch.setattr(F, "probe_port", probe)
+    return chips, probed
+
+
+def test_only_esp_bridges_are_probed(ports, monkeypatch):
+    _, probed = ports
+    found = F.discover_ports("esp32")
+    assert [f["port"] for f in found] == ["/dev/ttyUSB0"]
+    assert probed == ["/dev/ttyUSB0"]
+
+    monkeypatch.setattr(F, "PROBE_ALL_USB", True)
+    probed.clear()
+    F.discover_ports("esp32s3")
+    assert sorted(probed) == ["/dev/ttyACM0", "/dev/ttyUSB0", "/dev/ttyUSB1"]
+
+
+def test_swapped_board_is_probed_again(ports):
+    chips, probed = ports
+    assert F.discover_ports("esp32")[0]["chip"] == "esp32"
+    probed.clear()
+    assert F.discover_ports("esp32")[0]["cached"]
+    assert not probed
+
+    # same CH340, same key – but now an S3 sits behind it
+    chips["/dev/ttyUSB0"] = "esp32s3"
+    found = F.discover_ports("esp32s3")
+    assert probed == ["/dev/ttyUSB0"]
+    assert found[0]["chip"] == "esp32s3" and not found[0]["cached"]
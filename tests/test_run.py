@@ -0,0 +1,87 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("colorama")
+pytest.importorskip("serial")
+
+import facade as F  # noqa: E402
+
+
+@pytest.mark.parametrize("line, addr, pct", [
+    ("Writing at 0x00010000... (12 %)", 0x10000, 12.0),
+    ("Writing at 0x0003c000 [=====>      ]  45.2% 81920/180000 bytes...", 0x3C000, 45.2),
+    ("Writing at 0x00290000 [==============================] 100.0% 131072/131072 bytes...", 0x290000, 100.0),
+])
+def test_writing_esptool_4_and_5(line, addr, pct):
+    assert F.parse_progress(line) == {"kind": "writing", "addr": addr, "pct": pct}
+
+
+def test_wrote_with_and_without_compression():
+    ev = F.parse_progress("Wrote 262144 bytes (130000 compressed) at 0x00010000 in 2.5 seconds (838.9 kbit/s)...")
+    assert ev["kind"] == "wrote" and ev["addr"] == 0x10000
+    assert ev["bytes"] == 262144 and ev["sent"] == 130000
+    assert ev["bps"] == pytest.approx(262144 / 2.5)
+    ev = F.parse_progress("Wrote 4096 bytes at 0x00008000 in 0.0 seconds")
+    assert ev["sent"] == 4096 and ev["bps"] == 0.0
+
+
+def test_compressed_phase_and_size():
+    assert F.parse_progress("Compressed 262144 bytes to 130000...") == \
+        {"kind": "compressed", "bytes": 262144, "sent": 130000}
+    assert F.parse_progress('Compiling library "WiFi"') == {"kind": "phase", "phase": 'Compiling library "WiFi"'}
+    assert F.parse_progress("Linking everything together...")["phase"] == "Linking everything together"
+    assert F.parse_progress("Sketch uses 912345 bytes (69%) of program storage space.") == \
+        {"kind": "size", "bytes": 912345}
+
+
+def test_transport_errors_but_not_connect_failures():
+    ev = F.parse_progress("A fatal error occurred: Timed out waiting for packet header")
+    assert ev == {"kind": "transport", "line": "A fatal error occurred: Timed out waiting for packet header"}
+    assert F.parse_progress("Failed to connect to ESP32: Timed out waiting for packet header") is None
+    assert F.parse_progress("Hard resetting via RTS pin...") is None
+
+
+@pytest.fixture
+def logged(monkeypatch):
+    lines = []
+    monkeypatch.setattr(F, "log", lambda msg, **fields: lines.append((msg, fields)))
+    return lines
+
+
+def test_run_kills_silent_tool(monkeypatch, logged):
+    monkeypatch.setitem(F.RUN_TIMEOUTS, "test", (30, 0.5))
+    status = {}
+    cmd = [sys.executable, "-c", "import time; print('start', flush=True); time.sleep(20)"]
+    rc = F.run(cmd, exit_on_error=False, kind="test", status=status)
+    assert rc != 0
+    assert status["transport"] is True
+    assert ("KILLED", {"tool": os.path.basename(sys.executable), "reason": "no output for 0.5s"}) in logged
+
+
+def test_run_idle_timer_restarts_on_output(monkeypatch, logged):
+    monkeypatch.setitem(F.RUN_TIMEOUTS, "test", (30, 0.8))
+    cmd = [sys.executable, "-c",
+           "import time\nfor i in range(4):\n    print(i, flush=True); time.sleep(0.4)"]
+    assert F.run(cmd, exit_on_error=False, kind="test") == 0
+    assert not [m for m, _ in logged if m == "KILLED"]
+
+
+def test_run_without_limit_and_exit_on_error(logged):
+    cmd = [sys.executable, "-c", "import sys, time; time.sleep(0.6); sys.exit(3)"]
+    assert F.run(cmd, exit_on_error=False, kind="merge") == 3
+    with pytest.raises(SystemExit):
+        F.run(cmd, kind="merge")
+
+
+def test_run_logs_written_bytes(tmp_path, logged):
+    script = ("print('Writing at 0x00010000... (50 %)'); "
+              "print('Wrote 8192 bytes (4000 compressed) at 0x00010000 in 0.5 seconds')")
+    out = tmp_path / "tool.log"
+    assert F.run([sys.executable, "-c", script], output=str(out), kind="flash") == 0
+    assert "Wrote 8192 bytes" in out.read_text()
+    wrote = [f for m, f in logged if m == "WROTE 0x010000"]
+    assert wrote and wrote[0]["bytes"] == 8192 and wrote[0]["sent"] == 4000
@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("colorama")
+pytest.importorskip("serial")
+
+import facade as F  # noqa: E402
+
+BLOCK = 4096
+
+
+@pytest.fixture
+def spiffs_image(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "index.html").write_bytes(os.urandom(5000))
+    (data / "cfg.json").write_bytes(b'{"a":1}')
+    img = F.build_spiffs_image(str(data), 64 * BLOCK, str(tmp_path / "cache"))
+    path = tmp_path / "fs.bin"
+    path.write_bytes(img)
+    return img, str(path)
+
+
+def flashed(regions: list[tuple[int, str]], offset: int, size: int) -> bytes:
+    """What erased flash reads after writing the regions."""
+    flash = bytearray(b"\xff" * size)
+    for off, path in regions:
+        with open(path, "rb") as f:
+            part = f.read()
+        flash[off - offset:off - offset + len(part)] = part
+    return bytes(flash)
+
+
+def test_mostly_empty_spiffs_is_written_sparsely(spiffs_image):
+    img, path = spiffs_image
+    regions, skipped = F.sparse_fs_regions(0x290000, path, erased=True)
+
+    written = sum(os.path.getsize(p) for _, p in regions)
+    assert written + skipped == len(img)
+    # two small files fill 2 blocks; the other 62 cost one lookup page each
+    assert written <= 2 * BLOCK + 62 * F.SPARSE_PAGE
+    assert all((off - 0x290000) % BLOCK == 0 for off, _ in regions)
+    assert flashed(regions, 0x290000, len(img)) == img
+
+
+def test_region_count_is_bounded(spiffs_image):
+    img, _ = spiffs_image
+    extents = F.image_extents(img, max_regions=8)
+    assert len(extents) == 8
+    assert all(start % BLOCK == 0 for start, _ in extents)
+    for start, end in zip(extents, extents[1:]):
+        assert start[1] <= end[0]
@@ -0,0 +1,78 @@
+import os
+import struct
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("colorama")
+pytest.importorskip("serial")
+
+import facade as F  # noqa: E402
+
+PAGE, BLOCK = 256, 4096
+# mkspiffs / ESP-IDF spiffsgen layout for -b 4096 -p 256 (2 B obj ids): one lookup
+# page of 128 slots per block, the magic in slot 126, the erase count in slot 127
+MAGIC_OFFSET = PAGE - 2 * 2
+ERASE_COUNT_OFFSET = PAGE - 2
+
+
+def spiffs_magic(block_count: int, bix: int) -> int:
+    # SPIFFS_MAGIC() with SPIFFS_USE_MAGIC_LENGTH
+    return (0x20140529 ^ PAGE ^ (block_count - bix)) & 0xFFFF
+
+
+def make_data(path, count: int = 4):
+    path.mkdir()
+    for i in range(count):
+        (path / f"f{i}.txt").write_bytes(os.urandom(700 + i * 300))
+    return path
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    F._spiffs_page_memo.clear()
+    return make_data(tmp_path / "data")
+
+
+def test_block_magic_matches_spiffsgen(data_dir):
+    size = 16 * BLOCK
+    img = F.build_spiffs_image(str(data_dir), size, str(data_dir) + ".cache")
+    assert img is not None and len(img) == size
+
+    for bix in range(size // BLOCK):
+        magic, erase_count = struct.unpack_from("<HH", img, bix * BLOCK + MAGIC_OFFSET)
+        assert magic == spiffs_magic(size // BLOCK, bix), bix
+        assert erase_count == 0xFFFF, bix
+
+
+def test_obj_ids_stable_when_a_file_is_added(data_dir, capsys):
+    F.build_spiffs_image(str(data_dir), 16 * BLOCK, str(data_dir) + ".cache")
+    (data_dir / "a_first.txt").write_bytes(b"new file sorts before the others")
+    capsys.readouterr()
+
+    F.build_spiffs_image(str(data_dir), 16 * BLOCK, str(data_dir) + ".cache")
+    assert "5 files, 1 re-encoded, 4 from page cache" in capsys.readouterr().out
+
+
+def test_sketches_keep_their_own_cache(tmp_path, capsys):
+    F._spiffs_page_memo.clear()
+    a, b = make_data(tmp_path / "a"), make_data(tmp_path / "b", 3)
+    F.build_spiffs_image(str(a), 16 * BLOCK, str(tmp_path / "build_a"))
+    F.build_spiffs_image(str(b), 16 * BLOCK, str(tmp_path / "build_b"))
+    F._spiffs_page_memo.clear()
+    capsys.readouterr()
+
+    # building b neither dropped the pages of a nor renumbered its objects
+    F.build_spiffs_image(str(a), 16 * BLOCK, str(tmp_path / "build_a"))
+    assert "4 files, 0 re-encoded, 4 from page cache" in capsys.readouterr().out
+
+
+def test_page_memo_holds_only_the_last_tree(data_dir):
+    cache = str(data_dir) + ".cache"
+    F.build_spiffs_image(str(data_dir), 16 * BLOCK, cache)
+    for i in range(3):
+        (data_dir / "f0.txt").write_bytes(os.urandom(900 + i))
+        F.build_spiffs_image(str(data_dir), 16 * BLOCK, cache)
+    assert len(F._spiffs_page_memo[cache]) == 4
@@ -0,0 +1,75 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("colorama")
+pytest.importorskip("serial")
+
+import facade as F  # noqa: E402
+
+
+def ctx():
+    return {"global_start": time.time()}
+
+
+def recorder(order, name, delay=0.0):
+    def func(ctx):
+        time.sleep(delay)
+        order.append(name)
+    return func
+
+
+def test_stages_run_after_their_deps():
+    order = []
+    stages = [
+        F.Stage("link", recorder(order, "link"), deps=("compile", "fs")),
+        F.Stage("compile", recorder(order, "compile", 0.05)),
+        F.Stage("fs", recorder(order, "fs")),
+        F.Stage("upload", recorder(order, "upload"), deps=("link",)),
+    ]
+    F.run_stages(stages, ctx())
+    assert order.index("link") > order.index("compile")
+    assert order.index("link") > order.index("fs")
+    assert order[-1] == "upload"
+    assert all(s.end >= s.start > 0 for s in stages)
+
+
+def test_independent_stages_overlap():
+    barrier = threading.Barrier(2, timeout=2)
+    stages = [F.Stage("a", lambda c: barrier.wait()), F.Stage("b", lambda c: barrier.wait())]
+    F.run_stages(stages, ctx())
+
+
+def test_failure_propagates_and_skips_dependents():
+    order = []
+
+    def boom(ctx):
+        raise RuntimeError("compile failed")
+
+    stages = [
+        F.Stage("compile", boom),
+        F.Stage("fs", recorder(order, "fs", 0.05)),
+        F.Stage("upload", recorder(order, "upload"), deps=("compile", "fs")),
+    ]
+    with pytest.raises(RuntimeError, match="compile failed"):
+        F.run_stages(stages, ctx())
+    assert "upload" not in order
+
+
+def test_sys_exit_from_stage_propagates():
+    stages = [F.Stage("compile", lambda c: sys.exit(1))]
+    with pytest.raises(SystemExit):
+        F.run_stages(stages, ctx())
+
+
+def test_unknown_dep_and_cycle_are_rejected():
+    with pytest.raises(ValueError, match="unknown stage"):
+        F.run_stages([F.Stage("a", lambda c: None, deps=("nope",))], ctx())
+    cyclic = [F.Stage("a", lambda c: None, deps=("b",)), F.Stage("b", lambda c: None, deps=("a",))]
+    with pytest.raises(ValueError, match="cycle"):
+        F.run_stages(cyclic, ctx())
@@ -0,0 +1,23 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("colorama")
+pytest.importorskip("serial")
+
+import facade as F  # noqa: E402
+
+
+def test_trace_history_keeps_the_newest_runs(tmp_path, monkeypatch):
+    monkeypatch.setattr(F, "TRACE_HISTORY", str(tmp_path / "history.jsonl"))
+    monkeypatch.setattr(F, "TRACE_HISTORY_KEEP", 20)
+    for i in range(100):
+        F.trace_history_append(json.dumps({"run": i}))
+        with open(F.TRACE_HISTORY, encoding="utf-8") as f:
+            runs = [json.loads(line)["run"] for line in f]
+        assert len(runs) <= 22
+        assert runs[-1] == i and runs == list(range(runs[0], i + 1))